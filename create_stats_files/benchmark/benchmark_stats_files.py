@@ -0,0 +1,182 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import subprocess
+from datetime import datetime
+from generate_synthetic_results import OTHER_FUNDERS, ANR_FUNDER_DOI, parse_count, write_synthetic_results
+
+STATS_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'create_stats_files.py')
+BACKENDS = {
+    'exact': [],
+    'approximate': ['--approximate'],
+}
+# Extra create_stats_files arguments for each report type; paths are filled
+# in per run.
+REPORTS = {
+    'aggregate': ['--aggregate-only'],
+    'standard': [],
+    'group_by': ['--group-by', 'anr_programme,year', '--group-by', 'doi_prefix'],
+    'api': ['--aggregate-only', '--api-data-dir', '{out}/api'],
+    'multi_funder': ['--funders', '{funders}'],
+}
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Benchmark create_stats_files on synthetic results files.')
+    parser.add_argument('--sizes', default='100k,1M,10M',
+                        help='Comma-separated row counts (default: 100k,1M,10M)')
+    parser.add_argument('--backends', default=','.join(BACKENDS),
+                        help=f'Comma-separated stats backends (default: {",".join(BACKENDS)})')
+    parser.add_argument('--reports', default=','.join(REPORTS),
+                        help=f'Comma-separated report types (default: {",".join(REPORTS)})')
+    parser.add_argument('-s', '--seed', type=int, default=42,
+                        help='Seed for the synthetic data (default: 42)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Runs per case; the fastest is recorded (default: 1)')
+    parser.add_argument('-w', '--work-dir', default='benchmark_data',
+                        help='Directory for the generated inputs, reused between runs (default: benchmark_data)')
+    parser.add_argument('--history', default='benchmark_history.json',
+                        help='JSON file the results are appended to (default: benchmark_history.json)')
+    parser.add_argument('--label',
+                        help='Label for this run in the history (default: current git commit)')
+    args = parser.parse_args()
+    for name, choices in (('backends', BACKENDS), ('reports', REPORTS)):
+        values = [v.strip() for v in getattr(args, name).split(',') if v.strip()]
+        unknown = [v for v in values if v not in choices]
+        if unknown:
+            parser.error(f"Unknown {name}: {', '.join(unknown)}")
+        setattr(args, name, values)
+    args.sizes = [parse_count(size) for size in args.sizes.split(',') if size.strip()]
+    return args
+
+
+def git_label():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def ensure_input(work_dir, rows, seed, multi_funder=False):
+    suffix = '_multi_funder' if multi_funder else ''
+    path = os.path.join(work_dir, f"synthetic_{rows}_{seed}{suffix}.csv")
+    if not os.path.exists(path):
+        print(f"Generating {rows} rows to {path}")
+        tmp_path = path + '.tmp'
+        write_synthetic_results(tmp_path, rows, seed, multi_funder=multi_funder)
+        os.replace(tmp_path, path)
+    return path
+
+
+def ensure_funders_file(work_dir):
+    path = os.path.join(work_dir, 'funders.json')
+    funders = [{'doi': ANR_FUNDER_DOI, 'name': 'Agence Nationale de la Recherche', 'acronyms': ['ANR'],
+                'code_patterns': ['ANR-']}]
+    funders += [{'doi': funder_doi, 'name': name, 'code_patterns': [prefix]}
+                for funder_doi, name, prefix in OTHER_FUNDERS]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(funders, f, indent=2)
+    return path
+
+
+def run_measured(command):
+    """Run a command and return (wall seconds, peak RSS in MB) for that child alone."""
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    peak_rss = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return wall, peak_rss
+
+
+def stats_command(input_file, out_dir, backend, report, funders_file):
+    command = [sys.executable, STATS_SCRIPT, '-i', input_file,
+               '--aggregate-output', os.path.join(out_dir, 'aggregate_stats.csv'),
+               '--yearly-output', os.path.join(out_dir, 'yearly_stats.csv'),
+               '--publisher-output', os.path.join(out_dir, 'publisher_stats.csv'),
+               '--publisher-yearly-output', os.path.join(out_dir, 'publisher_yearly_stats.csv'),
+               '--group-by-dir', out_dir]
+    command += BACKENDS[backend]
+    command += [arg.format(out=out_dir, funders=funders_file) for arg in REPORTS[report]]
+    return command
+
+
+def load_history(history_file):
+    if not os.path.exists(history_file):
+        return []
+    with open(history_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def previous_results(history):
+    previous = {}
+    for run in history:
+        for result in run['results']:
+            previous[(result['rows'], result['backend'], result['report'])] = dict(result, label=run['label'])
+    return previous
+
+
+def main():
+    args = parse_arguments()
+    os.makedirs(args.work_dir, exist_ok=True)
+    history = load_history(args.history)
+    previous = previous_results(history)
+    funders_file = ensure_funders_file(args.work_dir) if 'multi_funder' in args.reports else None
+    out_dir = os.path.join(args.work_dir, 'output')
+    results = []
+    for rows in args.sizes:
+        inputs = {False: ensure_input(args.work_dir, rows, args.seed)}
+        if 'multi_funder' in args.reports:
+            inputs[True] = ensure_input(args.work_dir, rows, args.seed, multi_funder=True)
+        for backend in args.backends:
+            for report in args.reports:
+                input_file = inputs[report == 'multi_funder']
+                runs = []
+                for _ in range(args.repeat):
+                    shutil.rmtree(out_dir, ignore_errors=True)
+                    os.makedirs(out_dir)
+                    runs.append(run_measured(stats_command(input_file, out_dir, backend, report, funders_file)))
+                wall, peak_rss = min(runs)
+                result = {
+                    'rows': rows,
+                    'backend': backend,
+                    'report': report,
+                    'wall_seconds': round(wall, 3),
+                    'peak_rss_mb': round(peak_rss, 1),
+                    'rows_per_second': round(rows / wall, 1)
+                }
+                results.append(result)
+                line = (f"{rows:>10} {backend:<12} {report:<13} {wall:9.2f}s {peak_rss:9.1f} MB "
+                        f"{result['rows_per_second']:>12.0f} rows/s")
+                before = previous.get((rows, backend, report))
+                if before:
+                    change = (wall - before['wall_seconds']) / before['wall_seconds'] * 100
+                    line += f"  ({change:+.1f}% vs {before['label']})"
+                print(line)
+    shutil.rmtree(out_dir, ignore_errors=True)
+
+    history.append({
+        'label': args.label or git_label(),
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'results': results
+    })
+    with open(args.history, 'w', encoding='utf-8') as f:
+        json.dump(history, f, indent=2)
+    print(f"Results appended to {args.history}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import csv
+import random
+import argparse
+from itertools import accumulate
+
+ANR_FUNDER_DOI = '10.13039/501100001665'
+ANR_NAMES = ['Agence Nationale de la Recherche', 'ANR', 'French National Research Agency']
+OTHER_FUNDERS = [
+    ('10.13039/501100000780', 'European Commission', 'H2020-'),
+    ('10.13039/501100000781', 'European Research Council', 'ERC-'),
+    ('10.13039/501100004794', 'Centre National de la Recherche Scientifique', 'CNRS-'),
+    ('10.13039/501100001659', 'Deutsche Forschungsgemeinschaft', 'DFG-'),
+]
+# (name, member ID) of the largest publishers, in rank order; the long tail
+# is made up below.
+MAJOR_PUBLISHERS = [
+    ('Elsevier BV', '78'), ('Springer Science and Business Media LLC', '297'), ('Wiley', '311'),
+    ('American Chemical Society (ACS)', '316'), ('IOP Publishing', '266'), ('MDPI AG', '1968'),
+    ('Oxford University Press (OUP)', '286'), ('American Physical Society (APS)', '16'),
+    ('Royal Society of Chemistry (RSC)', '292'), ('EDP Sciences', '237'), ('Informa UK Limited', '301'),
+    ('Frontiers Media SA', '1965'), ('Public Library of Science (PLoS)', '340'), ('IEEE', '263'),
+    ('Cold Spring Harbor Laboratory', '246'), ('AIP Publishing', '317'),
+]
+PROGRAMMES = ['CE', 'LABX', 'IDEX', 'EQPX', 'BLAN', 'JCJC', 'PRCE', 'ASTR', 'EURE', 'IAHU']
+FIRST_YEAR = 2005
+LAST_YEAR = 2024
+NULL = 'NULL'
+HAL_FIELDS = ['anr_code', 'doi', 'title', 'hal_id', 'submitted_date']
+RESULT_FIELDS = HAL_FIELDS + [
+    'publisher', 'member', 'funder_names', 'award_ids',
+    'funder_dois', 'doi_asserted_by', 'has_anr_funder_doi',
+    'anr_code_in_awards', 'anr_name_in_funders', 'created_year', 'error'
+]
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Generate a synthetic get_crossref_funding_metadata results CSV for benchmarking.')
+    parser.add_argument('-n', '--rows', required=True,
+                        help='Number of rows to generate, e.g. 100000, 100k or 1M')
+    parser.add_argument('-o', '--output', default='synthetic_results.csv',
+                        help='Output CSV file (default: synthetic_results.csv)')
+    parser.add_argument('-s', '--seed', type=int, default=42,
+                        help='Random seed (default: 42)')
+    parser.add_argument('--publishers', type=int, default=2000,
+                        help='Number of distinct publishers (default: 2000)')
+    parser.add_argument('--multi-funder', action='store_true',
+                        help='Write one row per matched funder with a funder_id column, '
+                             'as get_crossref_funding_metadata --funders does')
+    return parser.parse_args()
+
+
+def parse_count(value):
+    value = str(value).strip().lower().replace('_', '')
+    multiplier = {'k': 1000, 'm': 1000000}.get(value[-1:], 1)
+    if multiplier > 1:
+        value = value[:-1]
+    return int(float(value) * multiplier)
+
+
+def zipf_cum_weights(n, exponent):
+    return list(accumulate(1.0 / (rank ** exponent) for rank in range(1, n + 1)))
+
+
+class SyntheticResults:
+    """Seeded generator of results rows shaped like the fetcher output.
+
+    Publishers follow a Zipf distribution, publication years grow towards the
+    recent end, a DOI is shared by one to several ANR codes (with the same
+    Crossref metadata on every row), and missing metadata is written as NULL
+    placeholders the way the fetcher writes it.
+    """
+
+    def __init__(self, seed=42, publishers=2000, multi_funder=False):
+        self.random = random.Random(seed)
+        self.multi_funder = multi_funder
+        self.publishers = MAJOR_PUBLISHERS + [
+            (f"Publisher {i}", str(20000 + i)) for i in range(max(publishers - len(MAJOR_PUBLISHERS), 0))]
+        self.publisher_weights = zipf_cum_weights(len(self.publishers), 1.1)
+        self.years = list(range(FIRST_YEAR, LAST_YEAR + 1))
+        self.year_weights = list(accumulate(i * i for i in range(1, len(self.years) + 1)))
+        self.doi_prefixes = {member: f"10.{1000 + i}" for i, (_, member) in enumerate(self.publishers)}
+        self.doi_count = 0
+
+    def anr_code(self):
+        rng = self.random
+        year = rng.randint(FIRST_YEAR, LAST_YEAR) % 100
+        programme = rng.choice(PROGRAMMES)
+        if programme == 'CE':
+            programme += str(rng.randint(1, 50)).zfill(2)
+        return f"ANR-{year:02d}-{programme}-{rng.randint(1, 9999):04d}"
+
+    def publication(self):
+        """Crossref metadata shared by every row of one DOI."""
+        rng = self.random
+        self.doi_count += 1
+        publisher, member = rng.choices(self.publishers, cum_weights=self.publisher_weights)[0]
+        doi = f"{self.doi_prefixes[member]}/synthetic.{self.doi_count}"
+        if rng.random() < 0.02:
+            publisher, member = NULL, NULL
+        created_year = NULL if rng.random() < 0.01 else str(
+            rng.choices(self.years, cum_weights=self.year_weights)[0])
+
+        funders = []
+        if rng.random() < 0.75:
+            if rng.random() < 0.8:
+                funders.append((ANR_FUNDER_DOI, rng.choice(ANR_NAMES),
+                                rng.choice(['crossref', 'crossref', 'publisher'])))
+            else:
+                # Funder named without a registry DOI.
+                funders.append((None, rng.choice(ANR_NAMES), None))
+            while rng.random() < 0.3:
+                funder_doi, name, _ = rng.choice(OTHER_FUNDERS)
+                funders.append((funder_doi, name, rng.choice(['crossref', 'publisher'])))
+        return {
+            'doi': doi,
+            'publisher': publisher,
+            'member': member,
+            'created_year': created_year,
+            'funders': funders
+        }
+
+    def rows_for(self, publication, code):
+        rng = self.random
+        funders = publication['funders']
+        award_ids = []
+        for funder_doi, _, _ in funders:
+            if funder_doi == ANR_FUNDER_DOI and rng.random() < 0.6:
+                award_ids.append(code if rng.random() < 0.8 else code.replace('ANR-', 'ANR '))
+            elif funder_doi and funder_doi != ANR_FUNDER_DOI:
+                award_ids.append(f"{rng.randint(100000, 999999)}")
+        row = {
+            'anr_code': code,
+            'doi': publication['doi'],
+            'title': f"Synthetic publication {publication['doi']}",
+            'hal_id': f"hal-{rng.randint(0, 4999999):08d}",
+            'submitted_date': f"{publication['created_year'] if publication['created_year'] != NULL else LAST_YEAR}-06-01",
+            'publisher': publication['publisher'],
+            'member': publication['member'],
+            'funder_names': ';'.join(name for _, name, _ in funders) or NULL,
+            'award_ids': ';'.join(award_ids) or NULL,
+            'funder_dois': ';'.join(funder_doi or NULL for funder_doi, _, _ in funders) or NULL,
+            'doi_asserted_by': ';'.join(asserter or NULL for _, _, asserter in funders) or NULL,
+            'has_anr_funder_doi': str(any(funder_doi == ANR_FUNDER_DOI for funder_doi, _, _ in funders)),
+            'anr_code_in_awards': str(code in award_ids),
+            'anr_name_in_funders': str(any(name in ANR_NAMES for _, name, _ in funders)),
+            'created_year': publication['created_year'],
+            'error': NULL
+        }
+        if not self.multi_funder:
+            return [row]
+        row['funder_id'] = ANR_FUNDER_DOI.split('/', 1)[-1]
+        rows = [row]
+        for funder_doi, name, _ in funders:
+            if funder_doi and funder_doi != ANR_FUNDER_DOI and rng.random() < 0.5:
+                extra = dict(row)
+                extra['funder_id'] = funder_doi.split('/', 1)[-1]
+                extra['has_anr_funder_doi'] = 'True'
+                extra['anr_code_in_awards'] = str(bool(award_ids) and rng.random() < 0.5)
+                extra['anr_name_in_funders'] = 'True'
+                rows.append(extra)
+        return rows
+
+    def rows(self, count):
+        """Yield exactly `count` rows."""
+        rng = self.random
+        emitted = 0
+        codes = [self.anr_code() for _ in range(max(count // 20, 1))]
+        while emitted < count:
+            publication = self.publication()
+            # Most DOIs come from one project, some are shared by several.
+            code_count = 1 if rng.random() < 0.8 else rng.randint(2, 4)
+            for code in rng.sample(codes, min(code_count, len(codes))):
+                for row in self.rows_for(publication, code):
+                    yield row
+                    emitted += 1
+                    if emitted == count:
+                        return
+
+    def fieldnames(self):
+        return RESULT_FIELDS + (['funder_id'] if self.multi_funder else [])
+
+
+def write_synthetic_results(output_path, rows, seed=42, publishers=2000, multi_funder=False):
+    generator = SyntheticResults(seed, publishers, multi_funder)
+    with open(output_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=generator.fieldnames())
+        writer.writeheader()
+        writer.writerows(generator.rows(rows))
+
+
+def main():
+    args = parse_arguments()
+    rows = parse_count(args.rows)
+    write_synthetic_results(args.output, rows, args.seed, args.publishers, args.multi_funder)
+    print(f"Wrote {rows} synthetic rows to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,31 @@
 import os
+import re
 import csv
 import sys
+import json
+import math
+import heapq
 import argparse
+from statistics import NormalDist
 from collections import defaultdict, Counter
+from hyperloglog import HyperLogLog, hash_value
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils', 'instrumentation'))
+from instrumentation import add_instrumentation_arguments, start_run, run_main
 
 
 def parse_arguments():
     parser = argparse.ArgumentParser(
         description='Calculate statistics for ANR data fields.')
-    parser.add_argument('-i', '--input_file', required=True,
+    parser.add_argument('-i', '--input_file',
                         help='Path to the input CSV file')
+    parser.add_argument('--crossref-json-dir',
+                        help='Read Crossref records from this directory (the get_crossref_funding_metadata '
+                             'output or --json-dir) instead of a results CSV; requires --hal-input')
+    parser.add_argument('--hal-input',
+                        help='CSV of anr_code and doi pairs (the HAL retriever output) to pair with --crossref-json-dir')
+    parser.add_argument('--members-file',
+                        help='Path to members.json for publisher names when reading --crossref-json-dir')
     parser.add_argument('--aggregate-output', default='aggregate_stats.csv',
                         help='Path to output file for aggregate stats (default: aggregate_stats.csv)')
     parser.add_argument('--publisher-output', default='publisher_stats.csv',
@@ -24,17 +40,63 @@ def parse_arguments():
                         help='Include missing values in the statistics')
     parser.add_argument('--anr-funder-doi', default='10.13039/501100001665',
                         help='ANR funder DOI to track (default: 10.13039/501100001665)')
-    return parser.parse_args()
-
-
-def read_csv_data(file_path):
-    data = []
+    parser.add_argument('--group-by', action='append', default=[],
+                        help='Comma-separated dimensions for an additional breakdown report, e.g. "anr_programme,year". '
+                             f'Can be repeated. Available dimensions: {", ".join(DIMENSIONS)}')
+    parser.add_argument('--group-by-dir', default='.',
+                        help='Directory for the additional breakdown reports (default: current directory)')
+    parser.add_argument('--api-data-dir',
+                        help='Also write funder.json, publisher.json and award.json for the dashboard API to this directory')
+    parser.add_argument('--funder-name', default='Agence Nationale de la Recherche',
+                        help='Funder name used in the dashboard API files (default: Agence Nationale de la Recherche)')
+    parser.add_argument('--index-dir',
+                        help='Also write sorted publisher index files (year x metric matrices, top-k rankings, '
+                             'name prefix index) for fast dashboard lookups to this directory')
+    parser.add_argument('--index-top-k', type=int, default=50,
+                        help='Number of publishers kept per metric and year in the rankings (default: 50)')
+    parser.add_argument('--index-min-publications', type=int, default=10,
+                        help='Minimum publications for a publisher to be ranked (default: 10)')
+    parser.add_argument('--funders',
+                        help='Funders JSON file (as used by get_crossref_funding_metadata --funders); '
+                             'reports are then broken down by the funder_id column in a single pass')
+    parser.add_argument('--approximate', action='store_true',
+                        help='Count distinct DOIs with fixed-size HyperLogLog sketches instead of per-DOI state '
+                             '(bounded memory; adds a relative_error column)')
+    parser.add_argument('--sample', type=int,
+                        help='Compute the reports on a reproducible sample of at most this many DOIs per '
+                             '(year, publisher) stratum, with confidence intervals on each percentage')
+    parser.add_argument('--sample-seed', type=int, default=0,
+                        help='Seed for --sample (default: 0)')
+    parser.add_argument('--confidence', type=float, default=0.95,
+                        help='Confidence level of the --sample intervals (default: 0.95)')
+    parser.add_argument('--hll-precision', type=int, default=12,
+                        help='HyperLogLog precision for --approximate: 2^p bytes per sketch, '
+                             'relative error 1.04/sqrt(2^p) (default: 12, ~1.6%%)')
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    if args.crossref_json_dir or args.hal_input:
+        if not (args.crossref_json_dir and args.hal_input):
+            parser.error('--crossref-json-dir and --hal-input must be given together')
+        if args.input_file:
+            parser.error('-i/--input_file cannot be combined with --crossref-json-dir')
+    elif not args.input_file:
+        parser.error('either -i/--input_file or --crossref-json-dir with --hal-input is required')
+    if args.sample is not None:
+        if args.sample < 2:
+            parser.error('--sample must be at least 2')
+        if args.approximate or args.api_data_dir or args.index_dir:
+            parser.error('--sample cannot be combined with --approximate, --api-data-dir or --index-dir')
+        if not 0 < args.confidence < 1:
+            parser.error('--confidence must be between 0 and 1')
+    return args
+
+
+def iter_csv_data(file_path):
     try:
         with open(file_path, 'r', encoding='utf-8') as csvfile:
             reader = csv.DictReader(csvfile)
             for row in reader:
-                data.append(row)
-        return data
+                yield row
     except Exception as e:
         print(f"Error reading CSV file: {e}")
         exit(1)
@@ -51,120 +113,479 @@ def parse_boolean_value(value):
         return 'invalid'
 
 
-def calculate_doi_asserted_by_stats(data, anr_funder_doi):
-    doi_counter = defaultdict(Counter)
-    unique_dois = set()
+def split_assertion_fields(funder_dois, doi_asserted_by):
+    if not funder_dois or funder_dois.strip() == '' or funder_dois.upper() == 'NULL':
+        return [], []
+    funder_doi_list = [d.strip() for d in funder_dois.split(';')]
+    asserter_list = []
+    if doi_asserted_by and doi_asserted_by.strip() != '' and doi_asserted_by.upper() != 'NULL':
+        asserter_list = [a.strip().lower() if a.strip().upper() != 'NULL' else 'missing'
+                         for a in doi_asserted_by.split(';')]
+    return funder_doi_list, asserter_list
+
+
+def classify_doi_assertion(funder_doi_list, asserter_list, anr_funder_doi):
+    for i, funder_doi in enumerate(funder_doi_list):
+        if funder_doi == anr_funder_doi:
+            asserter = asserter_list[i] if i < len(asserter_list) else 'missing'
+            if asserter in ('crossref', 'publisher', 'missing'):
+                return asserter
+            return 'other'
+    return 'not_asserted'
+
+
+# Columns of a results row that the dimensions read.
+RECORD_FIELDS = ('doi', 'anr_code', 'publisher', 'member', 'created_year')
+# Always parsed because the potential_state report depends on all three.
+FLAG_FIELDS = ('has_anr_funder_doi', 'anr_code_in_awards', 'anr_name_in_funders')
+
+
+def funder_id_from_doi(funder_doi):
+    return funder_doi.split('/', 1)[-1]
+
+
+def normalize_csv_row(row, boolean_fields, funder_dois, default_funder_id):
+    """Turn a results CSV row into the record consumed by build_cube.
+
+    `funder_dois` maps funder IDs to funder DOIs; rows without a funder_id
+    column (single-funder runs) belong to `default_funder_id`.
+    """
+    record = {name: row.get(name, '') for name in RECORD_FIELDS}
+    record['funder_id'] = row.get('funder_id') or default_funder_id
+    funder_doi_list, asserter_list = split_assertion_fields(
+        row.get('funder_dois', ''), row.get('doi_asserted_by', ''))
+    record['assertion'] = classify_doi_assertion(
+        funder_doi_list, asserter_list, funder_dois.get(record['funder_id'], ''))
+    record['values'] = {field: parse_boolean_value(row.get(field, ''))
+                        for field in FLAG_FIELDS + tuple(boolean_fields)}
+    return record
+
+
+def iter_csv_records(file_path, boolean_fields, funder_dois, default_funder_id):
+    for row in iter_csv_data(file_path):
+        yield normalize_csv_row(row, boolean_fields, funder_dois, default_funder_id)
+
+
+def import_crossref_module():
+    # The matching functions live with the Crossref fetcher; import them from
+    # there so both stages evaluate a record the same way.
+    fetcher_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               '..', 'get_crossref_funding_metadata')
+    if fetcher_dir not in sys.path:
+        sys.path.insert(0, fetcher_dir)
+    import get_crossref_funding_metadata
+    return get_crossref_funding_metadata
+
+
+def crossref_records(publication, crossref_data, crossref, funders, multi_funder=False,
+                     member_map=None, null_value='NULL'):
+    """Build build_cube records straight from a Crossref work, one per funder,
+    with the same values get_crossref_funding_metadata would write to its
+    results CSV (with or without --funders)."""
+    publisher, member = crossref.extract_publisher_info(crossref_data, member_map)
+    funder_names, award_ids, funder_dois, doi_asserted_by = crossref.extract_funder_info(crossref_data)
+    created_year = crossref.extract_created_year(crossref_data)
+    funder_doi_list = [(funder_doi or '').strip() for funder_doi in funder_dois]
+    asserter_list = [(asserter or '').strip().lower() or 'missing' for asserter in doi_asserted_by]
+    anr_code = publication.get('anr_code', '')
+    for funder in funders:
+        if multi_funder:
+            values = crossref.check_funder(funder, anr_code, funder_names, award_ids, funder_doi_list)
+        else:
+            values = {
+                'has_anr_funder_doi': funder['doi'] in funder_doi_list,
+                'anr_code_in_awards': crossref.check_anr_code_in_awards(anr_code, award_ids),
+                'anr_name_in_funders': crossref.check_anr_name_in_funders(funder_names)
+            }
+        yield {
+            'doi': publication.get('doi', ''),
+            'anr_code': anr_code,
+            'funder_id': funder['id'],
+            'publisher': publisher or null_value,
+            'member': member or null_value,
+            'created_year': str(created_year) if created_year else null_value,
+            'assertion': classify_doi_assertion(funder_doi_list, asserter_list, funder['doi']),
+            'values': values
+        }
 
-    for row in data:
-        doi = row.get('doi', '').lower().strip()
-        unique_dois.add(doi)
 
-        funder_dois = row.get('funder_dois', '')
-        doi_asserted_by = row.get('doi_asserted_by', '')
+def iter_crossref_records(hal_input, json_dir, funders, multi_funder=False, members_file=None):
+    """Stream records for every (anr_code, doi) in the HAL list that has a
+    stored Crossref record, skipping the intermediate results CSV."""
+    crossref = import_crossref_module()
+    member_map = crossref.load_member_map(members_file)
+    if members_file and not member_map:
+        print(f"Warning: Failed to load members file {members_file}")
+    read_count = 0
+    missing_count = 0
+    unmatched_count = 0
+    for publication in iter_csv_data(hal_input):
+        doi = publication.get('doi', '')
+        if not doi:
+            continue
+        publication_funders = funders
+        if multi_funder:
+            publication_funders = crossref.funders_for_publication(publication, funders)
+            if not publication_funders:
+                unmatched_count += 1
+                continue
+        file_path = os.path.join(json_dir, doi.replace('/', '_') + '.json')
+        try:
+            crossref_data = crossref.load_crossref_json(file_path)
+        except FileNotFoundError:
+            missing_count += 1
+            continue
+        except Exception as e:
+            print(f"Error reading JSON file {file_path}: {e}")
+            missing_count += 1
+            continue
+        read_count += 1
+        yield from crossref_records(publication, crossref_data, crossref, publication_funders,
+                                    multi_funder, member_map)
+    print(f"Read {read_count} Crossref records from {json_dir} ({missing_count} DOIs without a readable record skipped)")
+    if unmatched_count:
+        print(f"Skipped {unmatched_count} rows whose code matches no configured funder")
+
+
+def dimension_funder(row):
+    return row.get('funder_id') or None
+
+
+def dimension_year(row):
+    return row.get('created_year', '') or None
+
+
+def dimension_publisher(row):
+    return (row.get('publisher', ''), row.get('member', ''))
+
+
+def dimension_anr_code(row):
+    return row.get('anr_code', '').strip().upper() or None
+
+
+def dimension_anr_programme(row):
+    # ANR codes look like ANR-19-CE23-0001: the third segment without its
+    # committee number is the funding programme (CE, LABX, IDEX, BLAN, ...).
+    parts = row.get('anr_code', '').strip().upper().split('-')
+    if len(parts) < 3:
+        return None
+    return re.sub(r'\d+$', '', parts[2]) or None
+
+
+def dimension_doi_prefix(row):
+    doi = row.get('doi', '').lower().strip()
+    if '/' not in doi:
+        return None
+    return doi.split('/', 1)[0]
+
+
+# name -> (key function, output columns). A key function returns None when the
+# row has no value for the dimension; such rows are left out of any report
+# grouped by that dimension but still count towards coarser reports.
+DIMENSIONS = {
+    'funder': (dimension_funder, ['funder_id']),
+    'year': (dimension_year, ['year']),
+    'publisher': (dimension_publisher, ['publisher', 'member_id']),
+    'anr_code': (dimension_anr_code, ['anr_code']),
+    'anr_programme': (dimension_anr_programme, ['anr_programme']),
+    'doi_prefix': (dimension_doi_prefix, ['doi_prefix']),
+}
+
+ASSERTION_CATEGORIES = ('crossref', 'publisher', 'other', 'missing', 'not_asserted')
+ASSERTION_BITS = {category: 1 << i for i, category in enumerate(ASSERTION_CATEGORIES)}
+
+# Fields whose statistics count each DOI once; all other boolean fields are
+# counted per row.
+DOI_LEVEL_FIELDS = ('has_anr_funder_doi', 'anr_name_in_funders')
+
+
+class DoiState:
+    """Everything the reports need to know about one DOI within one group.
+
+    Values are ordered by row sequence number so that states built from
+    different groups merge to the same result a single scan would give:
+    has_anr_funder_doi keeps the last counted value, anr_name_in_funders
+    keeps True if seen and otherwise the first non-False value.
+    """
+    __slots__ = ('assertions', 'funder_doi', 'funder_doi_seq', 'funder_doi_true',
+                 'funder_name_seen', 'funder_name_true', 'funder_name_other',
+                 'funder_name_other_seq', 'has_award_id')
+
+    def __init__(self):
+        self.assertions = 0
+        self.funder_doi = None
+        self.funder_doi_seq = -1
+        self.funder_doi_true = False
+        self.funder_name_seen = False
+        self.funder_name_true = False
+        self.funder_name_other = None
+        self.funder_name_other_seq = -1
+        self.has_award_id = False
+
+    def update(self, seq, assertion, funder_doi, award_id, funder_name):
+        self.assertions |= ASSERTION_BITS[assertion]
+        if funder_doi is not None:
+            self.funder_doi = funder_doi
+            self.funder_doi_seq = seq
+            if funder_doi is True:
+                self.funder_doi_true = True
+        if funder_name is not None:
+            self.funder_name_seen = True
+            if funder_name is True:
+                self.funder_name_true = True
+            elif funder_name is not False and self.funder_name_other is None:
+                self.funder_name_other = funder_name
+                self.funder_name_other_seq = seq
+        if award_id is True:
+            self.has_award_id = True
+
+    def merge(self, other):
+        self.assertions |= other.assertions
+        if other.funder_doi_seq > self.funder_doi_seq:
+            self.funder_doi = other.funder_doi
+            self.funder_doi_seq = other.funder_doi_seq
+        self.funder_doi_true = self.funder_doi_true or other.funder_doi_true
+        self.funder_name_seen = self.funder_name_seen or other.funder_name_seen
+        self.funder_name_true = self.funder_name_true or other.funder_name_true
+        if other.funder_name_other is not None and (
+                self.funder_name_other is None or other.funder_name_other_seq < self.funder_name_other_seq):
+            self.funder_name_other = other.funder_name_other
+            self.funder_name_other_seq = other.funder_name_other_seq
+        self.has_award_id = self.has_award_id or other.has_award_id
+
+    def copy(self):
+        state = DoiState()
+        state.merge(self)
+        return state
+
+    def funder_name_value(self):
+        if not self.funder_name_seen:
+            return None
+        if self.funder_name_true:
+            return True
+        if self.funder_name_other is not None:
+            return self.funder_name_other
+        return False
 
-        if not funder_dois or funder_dois.strip() == '' or funder_dois.upper() == 'NULL':
-            doi_counter[doi]['not_asserted'] += 1
-        else:
-            funder_doi_list = [d.strip() for d in funder_dois.split(';')]
-            asserter_list = []
-
-            if doi_asserted_by and doi_asserted_by.strip() != '' and doi_asserted_by.upper() != 'NULL':
-                asserter_list = [a.strip().lower() if a.strip().upper() != 'NULL' else 'missing' 
-                               for a in doi_asserted_by.split(';')]
-
-            if len(asserter_list) < len(funder_doi_list):
-                asserter_list.extend(['missing'] * (len(funder_doi_list) - len(asserter_list)))
-
-            anr_found = False
-            for i, funder_doi in enumerate(funder_doi_list):
-                if funder_doi == anr_funder_doi:
-                    anr_found = True
-                    if i < len(asserter_list):
-                        asserter = asserter_list[i]
-                        if asserter == 'crossref':
-                            doi_counter[doi]['crossref'] += 1
-                        elif asserter == 'publisher':
-                            doi_counter[doi]['publisher'] += 1
-                        elif asserter == 'missing':
-                            doi_counter[doi]['missing'] += 1
-                        else:
-                            doi_counter[doi]['other'] += 1
-                    else:
-                        doi_counter[doi]['missing'] += 1
-                    break
-
-            if not anr_found:
-                doi_counter[doi]['not_asserted'] += 1
-
-    counter = Counter()
-    for doi, values in doi_counter.items():
-        for value, count in values.items():
-            counter[value] += 1
-
-    total = len(unique_dois)
-    if total == 0:
-        return {
-            'crossref_count': 0,
-            'publisher_count': 0,
-            'other_count': 0,
-            'missing_count': 0,
-            'not_asserted_count': 0,
-            'crossref_percentage': 0,
-            'publisher_percentage': 0,
-            'other_percentage': 0,
-            'missing_percentage': 0,
-            'not_asserted_percentage': 0,
-            'total': 0
-        }
+    def has_any_flag(self):
+        return self.funder_doi_true or self.has_award_id or self.funder_name_true
 
-    crossref_count = counter.get('crossref', 0)
-    publisher_count = counter.get('publisher', 0)
-    other_count = counter.get('other', 0)
-    missing_count = counter.get('missing', 0)
-    not_asserted_count = counter.get('not_asserted', 0)
+    def is_potential(self):
+        return not self.funder_doi_true and (self.has_award_id or self.funder_name_true)
 
-    return {
-        'crossref_count': crossref_count,
-        'publisher_count': publisher_count,
-        'other_count': other_count,
-        'missing_count': missing_count,
-        'not_asserted_count': not_asserted_count,
-        'crossref_percentage': (crossref_count / total) * 100 if total > 0 else 0,
-        'publisher_percentage': (publisher_count / total) * 100 if total > 0 else 0,
-        'other_percentage': (other_count / total) * 100 if total > 0 else 0,
-        'missing_percentage': (missing_count / total) * 100 if total > 0 else 0,
-        'not_asserted_percentage': (not_asserted_count / total) * 100 if total > 0 else 0,
-        'total': total
-    }
 
+class GroupState:
+    """Per-DOI states plus per-row field counters for one group of a cube."""
+    __slots__ = ('dois', 'row_counts')
 
-def calculate_boolean_field_stats(data, field_name, include_missing=False):
-    if field_name == 'has_anr_funder_doi':
-        return calculate_funder_doi_stats(data, include_missing)
-    elif field_name == 'anr_code_in_awards':
-        return calculate_anr_code_stats(data, include_missing)
-    elif field_name == 'anr_name_in_funders':
-        return calculate_funder_name_stats(data, include_missing)
-    else:
-        return calculate_generic_boolean_stats(data, field_name, include_missing)
+    def __init__(self):
+        self.dois = {}
+        self.row_counts = defaultdict(Counter)
 
+    def empty(self):
+        return GroupState()
 
-def calculate_funder_doi_stats(data, include_missing=False):
-    doi_values = {}
-    for row in data:
-        doi = row.get('doi', '').lower().strip()
-        value = parse_boolean_value(row.get('has_anr_funder_doi', ''))
-        if value == True or value == False or (include_missing and (value == 'missing' or value == 'invalid')):
-            doi_values[doi] = value
+    def add(self, seq, doi, assertion, funder_doi, award_id, funder_name):
+        state = self.dois.get(doi)
+        if state is None:
+            self.dois[doi] = state = DoiState()
+        state.update(seq, assertion, funder_doi, award_id, funder_name)
 
-    counter = Counter(doi_values.values())
+    def merge(self, other):
+        for doi, state in other.dois.items():
+            mine = self.dois.get(doi)
+            if mine is None:
+                self.dois[doi] = state.copy()
+            else:
+                mine.merge(state)
+        for field, counter in other.row_counts.items():
+            self.row_counts[field].update(counter)
+
+    def doi_count(self):
+        return len(self.dois)
+
+    def summary_counts(self):
+        counts = {
+            'doi_asserted_by': Counter(),
+            'has_anr_funder_doi': Counter(),
+            'anr_name_in_funders': Counter(),
+            'potential_count': 0,
+            'potential_total': 0
+        }
+        for state in self.dois.values():
+            for category in ASSERTION_CATEGORIES:
+                if state.assertions & ASSERTION_BITS[category]:
+                    counts['doi_asserted_by'][category] += 1
+            if state.funder_doi is not None:
+                counts['has_anr_funder_doi'][state.funder_doi] += 1
+            funder_name = state.funder_name_value()
+            if funder_name is not None:
+                counts['anr_name_in_funders'][funder_name] += 1
+            if state.has_any_flag():
+                counts['potential_total'] += 1
+                if state.is_potential():
+                    counts['potential_count'] += 1
+        return counts
+
+    def relative_errors(self):
+        return None
+
+
+class ApproxGroupState:
+    """Fixed-size stand-in for GroupState: one HyperLogLog sketch of DOIs per
+    (field, value) instead of a state per DOI.
+
+    DOI-level fields are assumed constant across a DOI's rows, which holds
+    for fetcher output since they all come from the same Crossref record; a
+    DOI whose rows disagree is counted under each value it has.
+    """
+    __slots__ = ('precision', 'dois', 'sketches', 'row_counts')
+
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.dois = HyperLogLog(precision)
+        self.sketches = {}
+        self.row_counts = defaultdict(Counter)
+
+    def empty(self):
+        return ApproxGroupState(self.precision)
+
+    def _sketch(self, field, value):
+        sketch = self.sketches.get((field, value))
+        if sketch is None:
+            self.sketches[(field, value)] = sketch = HyperLogLog(self.precision)
+        return sketch
+
+    def add(self, seq, doi, assertion, funder_doi, award_id, funder_name):
+        hashed = hash_value(doi)
+        self.dois.add(hashed)
+        self._sketch('doi_asserted_by', assertion).add(hashed)
+        if funder_doi is not None:
+            self._sketch('has_anr_funder_doi', funder_doi).add(hashed)
+        if funder_name is not None:
+            self._sketch('anr_name_in_funders', funder_name).add(hashed)
+        if funder_doi is True or award_id is True or funder_name is True:
+            self._sketch('potential', 'total').add(hashed)
+            if funder_doi is not True:
+                self._sketch('potential', 'count').add(hashed)
+
+    def merge(self, other):
+        self.dois.merge(other.dois)
+        for key, sketch in other.sketches.items():
+            mine = self.sketches.get(key)
+            if mine is None:
+                self.sketches[key] = sketch.copy()
+            else:
+                mine.merge(sketch)
+        for field, counter in other.row_counts.items():
+            self.row_counts[field].update(counter)
+
+    def doi_count(self):
+        return self.dois.count()
+
+    def summary_counts(self):
+        counts = {
+            'doi_asserted_by': Counter(),
+            'has_anr_funder_doi': Counter(),
+            'anr_name_in_funders': Counter(),
+            'potential_count': 0,
+            'potential_total': 0
+        }
+        for (field, value), sketch in self.sketches.items():
+            if field == 'potential':
+                counts[f'potential_{value}'] = sketch.count()
+            else:
+                counts[field][value] = sketch.count()
+        return counts
+
+    def relative_errors(self):
+        """Relative standard error of each count: {field: {value: error}},
+        with values named as in the report rows ('true', 'crossref', ...).
+        The potential count is under 'potential'."""
+        errors = defaultdict(dict)
+        for (field, value), sketch in self.sketches.items():
+            if field == 'potential':
+                if value == 'count':
+                    errors[field]['potential'] = sketch.relative_error()
+            else:
+                errors[field][str(value).lower() if isinstance(value, bool) else value] = sketch.relative_error()
+        return errors
+
+
+def is_counted(value, include_missing):
+    return value is True or value is False or include_missing
+
+
+def build_cube(records, dimensions, boolean_fields, include_missing=False, group_factory=GroupState):
+    """Single pass over normalized records, grouped by the full tuple of dimension values."""
+    key_funcs = [DIMENSIONS[name][0] for name in dimensions]
+    row_fields = [field for field in boolean_fields if field not in DOI_LEVEL_FIELDS]
+    cube = {}
+    for seq, record in enumerate(records):
+        key = tuple(func(record) for func in key_funcs)
+        group = cube.get(key)
+        if group is None:
+            cube[key] = group = group_factory()
+
+        values = record['values']
+        funder_doi = values['has_anr_funder_doi']
+        funder_name = values['anr_name_in_funders']
+        group.add(seq, record['doi'].lower().strip(), record['assertion'],
+                  funder_doi if is_counted(funder_doi, include_missing) else None,
+                  values['anr_code_in_awards'],
+                  funder_name if is_counted(funder_name, include_missing) else None)
+
+        for field in row_fields:
+            value = values.get(field, 'missing')
+            if is_counted(value, include_missing):
+                group.row_counts[field][value] += 1
+    return cube
+
+
+def rollup_cube(cube, dimensions, group_by):
+    """Merge a cuboid keyed by `dimensions` into one keyed by the subset `group_by`."""
+    if list(group_by) == list(dimensions):
+        return cube
+    indices = [dimensions.index(name) for name in group_by]
+    groups = {}
+    for key, state in cube.items():
+        coarse_key = tuple(key[i] for i in indices)
+        target = groups.get(coarse_key)
+        if target is None:
+            groups[coarse_key] = target = state.empty()
+        target.merge(state)
+    return groups
+
+
+def compute_rollups(cube, dimensions, groupings):
+    """Compute every requested grouping, finest first, each one rolled up from
+    the smallest already computed cuboid that contains its dimensions."""
+    cuboids = {tuple(dimensions): cube}
+    results = {}
+    for group_by in sorted(set(groupings), key=len, reverse=True):
+        candidates = [dims for dims in cuboids if set(group_by) <= set(dims)]
+        source = min(candidates, key=lambda dims: len(cuboids[dims]))
+        rolled = rollup_cube(cuboids[source], list(source), list(group_by))
+        cuboids[tuple(group_by)] = rolled
+        results[group_by] = rolled
+    return results
+
+
+def cube_dimensions(groupings):
+    dimensions = []
+    for group_by in groupings:
+        for name in group_by:
+            if name not in dimensions:
+                dimensions.append(name)
+    return dimensions
+
+
+def boolean_stats(counter):
     true_count = counter.get(True, 0)
     false_count = counter.get(False, 0)
     missing_count = counter.get('missing', 0)
     invalid_count = counter.get('invalid', 0)
-
-    total = len(doi_values)
-
+    total = sum(counter.values())
     return {
         'true_count': true_count,
         'false_count': false_count,
@@ -178,666 +599,641 @@ def calculate_funder_doi_stats(data, include_missing=False):
     }
 
 
-def calculate_anr_code_stats(data, include_missing=False):
-    counter = Counter()
-    for row in data:
-        value = parse_boolean_value(row.get('anr_code_in_awards', ''))
-        if value == True or value == False or (include_missing and (value == 'missing' or value == 'invalid')):
-            counter[value] += 1
-
-    total = sum(counter.values())
-    if total == 0:
-        return {
-            'true_count': 0,
-            'false_count': 0,
-            'missing_count': 0,
-            'invalid_count': 0,
-            'true_percentage': 0,
-            'false_percentage': 0,
-            'missing_percentage': 0,
-            'invalid_percentage': 0,
-            'total': total
-        }
-
+def doi_asserted_by_stats(counter, total):
+    crossref_count = counter.get('crossref', 0)
+    publisher_count = counter.get('publisher', 0)
+    other_count = counter.get('other', 0)
+    missing_count = counter.get('missing', 0)
+    not_asserted_count = counter.get('not_asserted', 0)
     return {
-        'true_count': counter.get(True, 0),
-        'false_count': counter.get(False, 0),
-        'missing_count': counter.get('missing', 0),
-        'invalid_count': counter.get('invalid', 0),
-        'true_percentage': (counter.get(True, 0) / total) * 100 if total > 0 else 0,
-        'false_percentage': (counter.get(False, 0) / total) * 100 if total > 0 else 0,
-        'missing_percentage': (counter.get('missing', 0) / total) * 100 if total > 0 else 0,
-        'invalid_percentage': (counter.get('invalid', 0) / total) * 100 if total > 0 else 0,
+        'crossref_count': crossref_count,
+        'publisher_count': publisher_count,
+        'other_count': other_count,
+        'missing_count': missing_count,
+        'not_asserted_count': not_asserted_count,
+        'crossref_percentage': (crossref_count / total) * 100 if total > 0 else 0,
+        'publisher_percentage': (publisher_count / total) * 100 if total > 0 else 0,
+        'other_percentage': (other_count / total) * 100 if total > 0 else 0,
+        'missing_percentage': (missing_count / total) * 100 if total > 0 else 0,
+        'not_asserted_percentage': (not_asserted_count / total) * 100 if total > 0 else 0,
         'total': total
     }
 
 
-def calculate_funder_name_stats(data, include_missing=False):
-    doi_values = {}
-    for row in data:
-        doi = row.get('doi', '').lower().strip()
-        value = parse_boolean_value(row.get('anr_name_in_funders', ''))
-        if value == True or value == False or (include_missing and (value == 'missing' or value == 'invalid')):
-            if doi in doi_values:
-                if doi_values[doi] == True:
-                    continue
-                elif value == True:
-                    doi_values[doi] = True
-                else:
-                    doi_values[doi] = doi_values[doi] or value
-            else:
-                doi_values[doi] = value
+def summarize_group(group, boolean_fields):
+    counts = group.summary_counts()
+    total = group.doi_count()
+    stats = {'doi_asserted_by': doi_asserted_by_stats(counts['doi_asserted_by'], total)}
+    for field in boolean_fields:
+        if field in DOI_LEVEL_FIELDS:
+            stats[field] = boolean_stats(counts[field])
+        else:
+            stats[field] = boolean_stats(group.row_counts.get(field, Counter()))
+    potential_count = counts['potential_count']
+    potential_total = counts['potential_total']
+    stats['potential'] = {
+        'potential_count': potential_count,
+        'potential_percentage': (potential_count / potential_total) * 100 if potential_total > 0 else 0,
+        'total_records': potential_total
+    }
+    errors = group.relative_errors()
+    if errors is not None:
+        for field, values in stats.items():
+            values['relative_error'] = errors.get(field, {})
+    return stats
 
-    counter = Counter(doi_values.values())
-    true_count = counter.get(True, 0)
-    false_count = counter.get(False, 0)
-    missing_count = counter.get('missing', 0)
-    invalid_count = counter.get('invalid', 0)
 
-    total = len(doi_values)
+def calculate_aggregate_stats(data, boolean_fields, include_missing=False, anr_funder_doi='10.13039/501100001665'):
+    funder_id = funder_id_from_doi(anr_funder_doi)
+    records = (normalize_csv_row(row, boolean_fields, {funder_id: anr_funder_doi}, funder_id) for row in data)
+    cube = build_cube(records, [], boolean_fields, include_missing)
+    return summarize_group(cube.get((), GroupState()), boolean_fields)
 
-    return {
-        'true_count': true_count,
-        'false_count': false_count,
-        'missing_count': missing_count,
-        'invalid_count': invalid_count,
-        'true_percentage': (true_count / total) * 100 if total > 0 else 0,
-        'false_percentage': (false_count / total) * 100 if total > 0 else 0,
-        'missing_percentage': (missing_count / total) * 100 if total > 0 else 0,
-        'invalid_percentage': (invalid_count / total) * 100 if total > 0 else 0,
-        'total': total
-    }
 
+def stats_to_rows(aggregate_stats, key_values, include_missing=False):
+    rows = []
 
-def calculate_generic_boolean_stats(data, field_name, include_missing=False):
-    counter = Counter()
-    for row in data:
-        value = parse_boolean_value(row.get(field_name, ''))
-        if value == True or value == False or (include_missing and (value == 'missing' or value == 'invalid')):
-            counter[value] += 1
+    def add_row(field, value_type, count, percentage, total_records, values, interval=None, error_key=None):
+        row = dict(key_values)
+        row.update({
+            'field': field,
+            'value_type': value_type,
+            'count': count,
+            'percentage': percentage,
+            'total_records': total_records
+        })
+        if 'relative_error' in values:
+            # Row-level fields have no sketches: their counts are exact.
+            row['relative_error'] = values['relative_error'].get(error_key or value_type, 0.0)
+        if interval is not None:
+            row['ci_lower'], row['ci_upper'] = interval
+        rows.append(row)
 
-    total = sum(counter.values())
-    if total == 0:
-        return {
-            'true_count': 0,
-            'false_count': 0,
-            'missing_count': 0,
-            'invalid_count': 0,
-            'true_percentage': 0,
-            'false_percentage': 0,
-            'missing_percentage': 0,
-            'invalid_percentage': 0,
-            'total': total
-        }
+    doi_stats = aggregate_stats['doi_asserted_by']
+    for value_type in ASSERTION_CATEGORIES:
+        count = doi_stats[f'{value_type}_count']
+        if value_type == 'other' and count == 0:
+            continue
+        if value_type == 'missing' and not (include_missing and count > 0):
+            continue
+        add_row('doi_asserted_by', value_type, count,
+                doi_stats[f'{value_type}_percentage'], doi_stats['total'], doi_stats,
+                doi_stats.get(f'{value_type}_interval'))
 
-    return {
-        'true_count': counter.get(True, 0),
-        'false_count': counter.get(False, 0),
-        'missing_count': counter.get('missing', 0),
-        'invalid_count': counter.get('invalid', 0),
-        'true_percentage': (counter.get(True, 0) / total) * 100 if total > 0 else 0,
-        'false_percentage': (counter.get(False, 0) / total) * 100 if total > 0 else 0,
-        'missing_percentage': (counter.get('missing', 0) / total) * 100 if total > 0 else 0,
-        'invalid_percentage': (counter.get('invalid', 0) / total) * 100 if total > 0 else 0,
-        'total': total
-    }
+    for field, values in aggregate_stats.items():
+        if field != 'doi_asserted_by' and field != 'potential':
+            for value_type in ('true', 'false', 'missing', 'invalid'):
+                count = values[f'{value_type}_count']
+                if value_type in ('missing', 'invalid') and not (include_missing and count > 0):
+                    continue
+                add_row(field, value_type, count,
+                        values[f'{value_type}_percentage'], values['total'], values,
+                        values.get(f'{value_type}_interval'))
 
+    potential = aggregate_stats['potential']
+    add_row('potential_state', 'has_award_id_or_funder_name_without_funder_doi',
+            potential['potential_count'], potential['potential_percentage'],
+            potential['total_records'], potential, potential.get('potential_interval'), 'potential')
+    return rows
+
+
+def group_key_values(group_by, key):
+    key_values = {}
+    for name, value in zip(group_by, key):
+        columns = DIMENSIONS[name][1]
+        if len(columns) == 1:
+            key_values[columns[0]] = value
+        else:
+            key_values.update(zip(columns, value))
+    return key_values
+
+
+def ordered_groups(groups, group_by):
+    """Groups with a value for every dimension, sorted by year when grouped by
+    year and otherwise in order of first appearance."""
+    items = [(key, state) for key, state in groups.items() if None not in key]
+    if not group_by:
+        return items or [((), GroupState())]
+    if 'year' in group_by:
+        year_index = list(group_by).index('year')
+        items.sort(key=lambda item: item[0][year_index])
+    return items
+
+
+def write_group_report(groups, group_by, output_path, boolean_fields, include_missing, label, approximate=False,
+                       summarize=None):
+    """Write one report. `summarize` turns a group into its stats (default:
+    summarize_group); sampled reports pass combine_strata and gain interval
+    columns."""
+    headers = [column for name in group_by for column in DIMENSIONS[name][1]]
+    headers += ['field', 'value_type', 'count', 'percentage', 'total_records']
+    if approximate:
+        headers.append('relative_error')
+    if summarize is not None:
+        headers += ['ci_lower', 'ci_upper']
+    else:
+        def summarize(state):
+            return summarize_group(state, boolean_fields)
 
-def calculate_potential_stats(data):
-    doi_metrics = defaultdict(
-        lambda: {'has_funder_doi': False, 'has_award_id': False, 'has_funder_name': False})
-    for row in data:
-        doi = row.get('doi', '').lower().strip()
-        has_funder_doi = parse_boolean_value(row.get('has_anr_funder_doi', ''))
-        has_award_id = parse_boolean_value(row.get('anr_code_in_awards', ''))
-        has_funder_name = parse_boolean_value(
-            row.get('anr_name_in_funders', ''))
+    try:
+        with open(output_path, 'w', encoding='utf-8') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=headers)
+            writer.writeheader()
+            for key, state in ordered_groups(groups, group_by):
+                aggregate_stats = summarize(state)
+                writer.writerows(stats_to_rows(
+                    aggregate_stats, group_key_values(group_by, key), include_missing))
+        print(f"{label} statistics written to {output_path}")
+    except Exception as e:
+        print(f"Error writing to {label.lower()} output file: {e}")
+
+
+class StratumReservoir:
+    """Bottom-k reservoir of one stratum: keeps the `size` DOIs with the
+    smallest seeded hashes, with all of their rows. Because the choice depends
+    only on the DOI, every row of a kept DOI is kept and the sample does not
+    depend on input order."""
+    __slots__ = ('size', 'heap', 'records', 'overflowed')
+
+    def __init__(self, size):
+        self.size = size
+        self.heap = []
+        self.records = {}
+        self.overflowed = False
+
+    def offer(self, hashed, doi, record):
+        kept = self.records.get(doi)
+        if kept is not None:
+            kept.append(record)
+            return
+        if len(self.records) < self.size:
+            heapq.heappush(self.heap, (-hashed, doi))
+            self.records[doi] = [record]
+            return
+        self.overflowed = True
+        if hashed < -self.heap[0][0]:
+            _, evicted = heapq.heapreplace(self.heap, (-hashed, doi))
+            del self.records[evicted]
+            self.records[doi] = [record]
+
+    def population(self):
+        """Distinct DOIs in the stratum: exact until the reservoir overflows,
+        then the bottom-k estimate (k - 1) / (k-th smallest hash in (0, 1])."""
+        if not self.overflowed:
+            return len(self.records)
+        kth_hash = (-self.heap[0][0] + 1) / 2 ** 64
+        return max((self.size - 1) / kth_hash, self.size + 1)
+
+
+def stratum_key(record):
+    return (record.get('created_year', ''), record.get('publisher', ''), record.get('member', ''))
+
+
+def sample_strata(records, size, seed=0):
+    """Single pass: a StratumReservoir per (year, publisher) stratum."""
+    strata = {}
+    for record in records:
+        doi = record['doi'].lower().strip()
+        key = stratum_key(record)
+        reservoir = strata.get(key)
+        if reservoir is None:
+            strata[key] = reservoir = StratumReservoir(size)
+        reservoir.offer(hash_value(f"{seed}:{doi}"), doi, record)
+    return strata
+
+
+def sampled_rollups(strata, dimensions, groupings, boolean_fields, include_missing=False):
+    """Compute every grouping on each stratum's sample separately and collect,
+    per group, the (weight, stats) of each stratum it contains; weight is the
+    number of stratum DOIs each sampled DOI stands for."""
+    results = {group_by: {} for group_by in groupings}
+    for reservoir in strata.values():
+        weight = reservoir.population() / len(reservoir.records)
+        records = [record for rows in reservoir.records.values() for record in rows]
+        cube = build_cube(records, dimensions, boolean_fields, include_missing)
+        for group_by, groups in compute_rollups(cube, dimensions, groupings).items():
+            for key, state in groups.items():
+                results[group_by].setdefault(key, []).append((weight, summarize_group(state, boolean_fields)))
+    for group_by, groups in results.items():
+        if not group_by and not groups:
+            groups[()] = []
+    return results
+
+
+def combine_strata(strata, boolean_fields, confidence=0.95):
+    """Stratified estimate of summarize_group() from per-stratum stats: counts
+    are weighted sums and each percentage gets a normal-approximation
+    interval, with the finite population correction of its stratum."""
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    layout = [('doi_asserted_by', ASSERTION_CATEGORIES, 'total')]
+    layout += [(field, ('true', 'false', 'missing', 'invalid'), 'total') for field in boolean_fields]
+    layout.append(('potential', ('potential',), 'total_records'))
+    stats = {}
+    for field, value_types, total_key in layout:
+        parts = [(weight, group_stats[field]) for weight, group_stats in strata]
+        total = sum(weight * values[total_key] for weight, values in parts)
+        combined = {total_key: int(round(total))}
+        for value_type in value_types:
+            count = sum(weight * values[f'{value_type}_count'] for weight, values in parts)
+            proportion = count / total if total > 0 else 0
+            variance = 0.0
+            for weight, values in parts:
+                n = values[total_key]
+                if n == 0 or weight <= 1:
+                    continue
+                p = values[f'{value_type}_count'] / n
+                share = weight * n / total
+                variance += share * share * (1 - 1 / weight) * p * (1 - p) / max(n - 1, 1)
+            margin = z * math.sqrt(variance)
+            combined[f'{value_type}_count'] = int(round(count))
+            combined[f'{value_type}_percentage'] = proportion * 100
+            combined[f'{value_type}_interval'] = (max(proportion - margin, 0) * 100,
+                                                  min(proportion + margin, 1) * 100)
+        stats[field] = combined
+    return stats
 
-        if has_funder_doi == True:
-            doi_metrics[doi]['has_funder_doi'] = True
-        if has_award_id == True:
-            doi_metrics[doi]['has_award_id'] = True
-        if has_funder_name == True:
-            doi_metrics[doi]['has_funder_name'] = True
 
-    potential_count = sum(1 for metrics in doi_metrics.values()
-                          if not metrics['has_funder_doi'] and
-                          (metrics['has_award_id'] or metrics['has_funder_name']))
+# Groupings needed to build the dashboard API files.
+API_GROUPINGS = [('funder',), ('funder', 'year'), ('funder', 'publisher'), ('funder', 'year', 'publisher'),
+                 ('publisher',), ('funder', 'anr_code'), ('funder', 'anr_code', 'year'),
+                 ('funder', 'anr_code', 'publisher')]
 
-    total_records = len(doi_metrics)
+INVALID_MEMBER_IDS = ('', 'NULL', 'ERROR')
 
-    return {
-        'potential_count': potential_count,
-        'potential_percentage': (potential_count / total_records) * 100 if total_records > 0 else 0,
-        'total_records': total_records
-    }
 
+def unwrap_key(key, indices):
+    values = tuple(key[i] for i in indices)
+    return values[0] if len(values) == 1 else values
 
-def calculate_aggregate_stats(data, boolean_fields, include_missing=False, anr_funder_doi='10.13039/501100001665'):
-    stats = {}
-    stats['doi_asserted_by'] = calculate_doi_asserted_by_stats(
-        data, anr_funder_doi)
-    for field in boolean_fields:
-        stats[field] = calculate_boolean_field_stats(
-            data, field, include_missing)
-    stats['potential'] = calculate_potential_stats(data)
-    return stats
 
+def nest_groups(groups, group_by, outer):
+    """Re-key a cuboid as {outer key: {remaining key: state}}; keys made of a
+    single dimension are unwrapped from their tuple."""
+    outer_indices = [list(group_by).index(name) for name in outer]
+    inner_indices = [i for i in range(len(group_by)) if i not in outer_indices]
+    nested = defaultdict(dict)
+    for key, state in ordered_groups(groups, group_by):
+        nested[unwrap_key(key, outer_indices)][unwrap_key(key, inner_indices)] = state
+    return nested
 
-def calculate_yearly_stats(data, boolean_fields, include_missing=False, anr_funder_doi='10.13039/501100001665'):
-    yearly_data = defaultdict(list)
-    for row in data:
-        year = row.get('created_year', '')
-        if year:
-            yearly_data[year].append(row)
-    
-    stats = {}
-    for year, year_data in yearly_data.items():
-        year_stats = calculate_aggregate_stats(year_data, boolean_fields, include_missing, anr_funder_doi)
-        stats[year] = year_stats
-    
-    return stats
 
+def yearly_stats_series(year_groups, boolean_fields):
+    return {year: summarize_group(state, boolean_fields)
+            for year, state in sorted(year_groups.items()) if str(year).isdigit()}
 
-def calculate_publisher_stats(data, boolean_fields, include_missing=False, anr_funder_doi='10.13039/501100001665'):
-    publisher_data = defaultdict(list)
-    for row in data:
-        key = (row.get('publisher', ''), row.get('member', ''))
-        publisher_data[key].append(row)
-
-    stats = []
-    for (publisher, member), pub_data in publisher_data.items():
-        aggregate_stats = calculate_aggregate_stats(pub_data, boolean_fields, include_missing, anr_funder_doi)
-        
-        doi_stats = aggregate_stats['doi_asserted_by']
-        stats.append({
-            'publisher': publisher,
-            'member_id': member,
-            'field': 'doi_asserted_by',
-            'value_type': 'crossref',
-            'count': doi_stats['crossref_count'],
-            'percentage': doi_stats['crossref_percentage'],
-            'total_records': doi_stats['total']
-        })
-        stats.append({
-            'publisher': publisher,
-            'member_id': member,
-            'field': 'doi_asserted_by',
-            'value_type': 'publisher',
-            'count': doi_stats['publisher_count'],
-            'percentage': doi_stats['publisher_percentage'],
-            'total_records': doi_stats['total']
-        })
-        if doi_stats['other_count'] > 0:
-            stats.append({
-                'publisher': publisher,
-                'member_id': member,
-                'field': 'doi_asserted_by',
-                'value_type': 'other',
-                'count': doi_stats['other_count'],
-                'percentage': doi_stats['other_percentage'],
-                'total_records': doi_stats['total']
-            })
-        if include_missing and doi_stats['missing_count'] > 0:
-            stats.append({
-                'publisher': publisher,
-                'member_id': member,
-                'field': 'doi_asserted_by',
-                'value_type': 'missing',
-                'count': doi_stats['missing_count'],
-                'percentage': doi_stats['missing_percentage'],
-                'total_records': doi_stats['total']
-            })
-        stats.append({
-            'publisher': publisher,
-            'member_id': member,
-            'field': 'doi_asserted_by',
-            'value_type': 'not_asserted',
-            'count': doi_stats['not_asserted_count'],
-            'percentage': doi_stats['not_asserted_percentage'],
-            'total_records': doi_stats['total']
-        })
-        
-        for field, values in aggregate_stats.items():
-            if field != 'doi_asserted_by' and field != 'potential':
-                stats.append({
-                    'publisher': publisher,
-                    'member_id': member,
-                    'field': field,
-                    'value_type': 'true',
-                    'count': values['true_count'],
-                    'percentage': values['true_percentage'],
-                    'total_records': values['total']
-                })
-                stats.append({
-                    'publisher': publisher,
-                    'member_id': member,
-                    'field': field,
-                    'value_type': 'false',
-                    'count': values['false_count'],
-                    'percentage': values['false_percentage'],
-                    'total_records': values['total']
-                })
-                if include_missing:
-                    if values['missing_count'] > 0:
-                        stats.append({
-                            'publisher': publisher,
-                            'member_id': member,
-                            'field': field,
-                            'value_type': 'missing',
-                            'count': values['missing_count'],
-                            'percentage': values['missing_percentage'],
-                            'total_records': values['total']
-                        })
-                    if values['invalid_count'] > 0:
-                        stats.append({
-                            'publisher': publisher,
-                            'member_id': member,
-                            'field': field,
-                            'value_type': 'invalid',
-                            'count': values['invalid_count'],
-                            'percentage': values['invalid_percentage'],
-                            'total_records': values['total']
-                        })
-        
-        potential = aggregate_stats['potential']
-        stats.append({
-            'publisher': publisher,
-            'member_id': member,
-            'field': 'potential_state',
-            'value_type': 'has_award_id_or_funder_name_without_funder_doi',
-            'count': potential['potential_count'],
-            'percentage': potential['potential_percentage'],
-            'total_records': potential['total_records']
-        })
 
-    return stats
+def publication_count(state):
+    return state.doi_count()
 
 
-def calculate_publisher_yearly_stats(data, boolean_fields, include_missing=False, anr_funder_doi='10.13039/501100001665'):
-    yearly_publisher_data = defaultdict(lambda: defaultdict(list))
-    for row in data:
-        year = row.get('created_year', '')
-        if year:
-            key = (row.get('publisher', ''), row.get('member', ''))
-            yearly_publisher_data[year][key].append(row)
-    
-    stats = []
-    for year in sorted(yearly_publisher_data.keys()):
-        for (publisher, member), pub_data in yearly_publisher_data[year].items():
-            aggregate_stats = calculate_aggregate_stats(pub_data, boolean_fields, include_missing, anr_funder_doi)
-            
-            doi_stats = aggregate_stats['doi_asserted_by']
-            stats.append({
-                'year': year,
-                'publisher': publisher,
-                'member_id': member,
-                'field': 'doi_asserted_by',
-                'value_type': 'crossref',
-                'count': doi_stats['crossref_count'],
-                'percentage': doi_stats['crossref_percentage'],
-                'total_records': doi_stats['total']
-            })
-            stats.append({
-                'year': year,
-                'publisher': publisher,
-                'member_id': member,
-                'field': 'doi_asserted_by',
-                'value_type': 'publisher',
-                'count': doi_stats['publisher_count'],
-                'percentage': doi_stats['publisher_percentage'],
-                'total_records': doi_stats['total']
-            })
-            if doi_stats['other_count'] > 0:
-                stats.append({
-                    'year': year,
-                    'publisher': publisher,
-                    'member_id': member,
-                    'field': 'doi_asserted_by',
-                    'value_type': 'other',
-                    'count': doi_stats['other_count'],
-                    'percentage': doi_stats['other_percentage'],
-                    'total_records': doi_stats['total']
-                })
-            if include_missing and doi_stats['missing_count'] > 0:
-                stats.append({
-                    'year': year,
-                    'publisher': publisher,
-                    'member_id': member,
-                    'field': 'doi_asserted_by',
-                    'value_type': 'missing',
-                    'count': doi_stats['missing_count'],
-                    'percentage': doi_stats['missing_percentage'],
-                    'total_records': doi_stats['total']
-                })
-            stats.append({
-                'year': year,
-                'publisher': publisher,
-                'member_id': member,
-                'field': 'doi_asserted_by',
-                'value_type': 'not_asserted',
-                'count': doi_stats['not_asserted_count'],
-                'percentage': doi_stats['not_asserted_percentage'],
-                'total_records': doi_stats['total']
-            })
-            
-            for field, values in aggregate_stats.items():
-                if field != 'doi_asserted_by' and field != 'potential':
-                    stats.append({
-                        'year': year,
-                        'publisher': publisher,
-                        'member_id': member,
-                        'field': field,
-                        'value_type': 'true',
-                        'count': values['true_count'],
-                        'percentage': values['true_percentage'],
-                        'total_records': values['total']
-                    })
-                    stats.append({
-                        'year': year,
-                        'publisher': publisher,
-                        'member_id': member,
-                        'field': field,
-                        'value_type': 'false',
-                        'count': values['false_count'],
-                        'percentage': values['false_percentage'],
-                        'total_records': values['total']
-                    })
-                    if include_missing:
-                        if values['missing_count'] > 0:
-                            stats.append({
-                                'year': year,
-                                'publisher': publisher,
-                                'member_id': member,
-                                'field': field,
-                                'value_type': 'missing',
-                                'count': values['missing_count'],
-                                'percentage': values['missing_percentage'],
-                                'total_records': values['total']
-                            })
-                        if values['invalid_count'] > 0:
-                            stats.append({
-                                'year': year,
-                                'publisher': publisher,
-                                'member_id': member,
-                                'field': field,
-                                'value_type': 'invalid',
-                                'count': values['invalid_count'],
-                                'percentage': values['invalid_percentage'],
-                                'total_records': values['total']
-                            })
-            
-            potential = aggregate_stats['potential']
-            stats.append({
-                'year': year,
-                'publisher': publisher,
-                'member_id': member,
-                'field': 'potential_state',
-                'value_type': 'has_award_id_or_funder_name_without_funder_doi',
-                'count': potential['potential_count'],
-                'percentage': potential['potential_percentage'],
-                'total_records': potential['total_records']
+def funder_entities(rollups, boolean_fields, funders):
+    aggregates = nest_groups(rollups[('funder',)], ('funder',), ('funder',))
+    yearly = nest_groups(rollups[('funder', 'year')], ('funder', 'year'), ('funder',))
+    by_publisher = nest_groups(rollups[('funder', 'publisher')], ('funder', 'publisher'), ('funder',))
+    for funder in funders:
+        if funder['id'] not in aggregates:
+            continue
+        aggregate_state = aggregates[funder['id']][()]
+        aggregate = summarize_group(aggregate_state, boolean_fields)
+        aggregate['records_in_funder_data'] = publication_count(aggregate_state)
+
+        publishers = []
+        publisher_stats = {}
+        for (publisher, member), state in by_publisher.get(funder['id'], {}).items():
+            if member in INVALID_MEMBER_IDS:
+                continue
+            publishers.append({
+                'id': member,
+                'publication_count': publication_count(state),
+                'attributes': {'name': publisher}
             })
+            publisher_stats[member] = summarize_group(state, boolean_fields)
+
+        yield {
+            'id': funder['id'],
+            'type': 'funder',
+            'attributes': {
+                'name': funder['name'],
+                'alternate_names': funder['alternate_names'],
+                'doi': funder['doi']
+            },
+            'relationships': {'publishers': publishers},
+            'stats': {
+                'aggregate': aggregate,
+                'yearly': yearly_stats_series(yearly.get(funder['id'], {}), boolean_fields),
+                'by_publisher': publisher_stats
+            }
+        }
 
-    return stats
 
+def publisher_entities(rollups, boolean_fields, funders):
+    by_funder = nest_groups(rollups[('funder', 'publisher')], ('funder', 'publisher'), ('publisher',))
+    yearly = nest_groups(rollups[('funder', 'year', 'publisher')], ('funder', 'year', 'publisher'),
+                         ('publisher', 'funder'))
+    for ((publisher, member),), state in ordered_groups(rollups[('publisher',)], ('publisher',)):
+        if member in INVALID_MEMBER_IDS:
+            continue
+        funder_states = by_funder.get((publisher, member), {})
+        yield {
+            'id': member,
+            'type': 'publisher',
+            'attributes': {'name': publisher, 'member_id': member},
+            'relationships': {
+                'publications': {'total': publication_count(state)},
+                'funders': [{'id': funder_id, 'publication_count': publication_count(funder_state)}
+                            for funder_id, funder_state in funder_states.items()]
+            },
+            'stats': {
+                'by_funder': {
+                    funder_id: {
+                        'aggregate': summarize_group(funder_state, boolean_fields),
+                        'yearly': yearly_stats_series(
+                            yearly.get(((publisher, member), funder_id), {}), boolean_fields)
+                    }
+                    for funder_id, funder_state in funder_states.items()
+                }
+            }
+        }
 
-def write_aggregate_csv(aggregate_stats, output_path, include_missing=False):
-    rows = []
-    doi_stats = aggregate_stats['doi_asserted_by']
-    rows.append({
-        'field': 'doi_asserted_by',
-        'value_type': 'crossref',
-        'count': doi_stats['crossref_count'],
-        'percentage': doi_stats['crossref_percentage'],
-        'total_records': doi_stats['total']
-    })
-    rows.append({
-        'field': 'doi_asserted_by',
-        'value_type': 'publisher',
-        'count': doi_stats['publisher_count'],
-        'percentage': doi_stats['publisher_percentage'],
-        'total_records': doi_stats['total']
-    })
-    if doi_stats['other_count'] > 0:
-        rows.append({
-            'field': 'doi_asserted_by',
-            'value_type': 'other',
-            'count': doi_stats['other_count'],
-            'percentage': doi_stats['other_percentage'],
-            'total_records': doi_stats['total']
-        })
-    if include_missing and doi_stats['missing_count'] > 0:
-        rows.append({
-            'field': 'doi_asserted_by',
-            'value_type': 'missing',
-            'count': doi_stats['missing_count'],
-            'percentage': doi_stats['missing_percentage'],
-            'total_records': doi_stats['total']
-        })
-    rows.append({
-        'field': 'doi_asserted_by',
-        'value_type': 'not_asserted',
-        'count': doi_stats['not_asserted_count'],
-        'percentage': doi_stats['not_asserted_percentage'],
-        'total_records': doi_stats['total']
-    })
 
-    for field, values in aggregate_stats.items():
-        if field != 'doi_asserted_by' and field != 'potential':
-            rows.append({
-                'field': field,
-                'value_type': 'true',
-                'count': values['true_count'],
-                'percentage': values['true_percentage'],
-                'total_records': values['total']
-            })
-            rows.append({
-                'field': field,
-                'value_type': 'false',
-                'count': values['false_count'],
-                'percentage': values['false_percentage'],
-                'total_records': values['total']
+def award_entities(rollups, boolean_fields, funders):
+    funder_names = {funder['id']: funder['name'] for funder in funders}
+    yearly = nest_groups(rollups[('funder', 'anr_code', 'year')], ('funder', 'anr_code', 'year'),
+                         ('funder', 'anr_code'))
+    publishers = nest_groups(rollups[('funder', 'anr_code', 'publisher')], ('funder', 'anr_code', 'publisher'),
+                             ('funder', 'anr_code'))
+    for (funder_id, anr_code), state in ordered_groups(rollups[('funder', 'anr_code')], ('funder', 'anr_code')):
+        publisher_breakdown = []
+        for (publisher, member), publisher_state in publishers.get((funder_id, anr_code), {}).items():
+            if member in INVALID_MEMBER_IDS:
+                continue
+            publisher_breakdown.append({
+                'id': member,
+                'name': publisher,
+                'publication_count': publication_count(publisher_state),
+                'stats': summarize_group(publisher_state, boolean_fields)
             })
-            if include_missing:
-                if values['missing_count'] > 0:
-                    rows.append({
-                        'field': field,
-                        'value_type': 'missing',
-                        'count': values['missing_count'],
-                        'percentage': values['missing_percentage'],
-                        'total_records': values['total']
-                    })
-                if values['invalid_count'] > 0:
-                    rows.append({
-                        'field': field,
-                        'value_type': 'invalid',
-                        'count': values['invalid_count'],
-                        'percentage': values['invalid_percentage'],
-                        'total_records': values['total']
-                    })
-
-    potential = aggregate_stats['potential']
-    rows.append({
-        'field': 'potential_state',
-        'value_type': 'has_award_id_or_funder_name_without_funder_doi',
-        'count': potential['potential_count'],
-        'percentage': potential['potential_percentage'],
-        'total_records': potential['total_records']
-    })
+        yield {
+            'id': anr_code,
+            'type': 'award',
+            'attributes': {
+                'award_number': anr_code,
+                'programme': dimension_anr_programme({'anr_code': anr_code})
+            },
+            'relationships': {
+                'funders': [{'id': funder_id, 'attributes': {'name': funder_names.get(funder_id, funder_id)}}],
+                'publications': {'total': publication_count(state)}
+            },
+            'stats': {
+                'aggregate': summarize_group(state, boolean_fields),
+                'yearly': yearly_stats_series(yearly.get((funder_id, anr_code), {}), boolean_fields),
+                'publisher_breakdown': publisher_breakdown
+            }
+        }
 
-    headers = ['field', 'value_type', 'count', 'percentage', 'total_records']
 
+def write_api_json(output_path, collection, entities):
+    """Stream entities into {"<collection>": [...]} one at a time."""
+    count = 0
     try:
-        with open(output_path, 'w', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=headers)
-            writer.writeheader()
-            writer.writerows(rows)
-        print(f"Aggregate statistics written to {output_path}")
+        with open(output_path, 'w', encoding='utf-8') as jsonfile:
+            jsonfile.write(f'{{"{collection}": [')
+            for entity in entities:
+                jsonfile.write(',\n' if count else '\n')
+                jsonfile.write(json.dumps(entity, ensure_ascii=False))
+                count += 1
+            jsonfile.write('\n]}\n')
+        print(f"{count} {collection} written to {output_path}")
     except Exception as e:
-        print(f"Error writing to aggregate output file: {e}")
+        print(f"Error writing to {collection} output file: {e}")
 
 
-def write_yearly_csv(yearly_stats, output_path, include_missing=False):
-    rows = []
-    
-    for year in sorted(yearly_stats.keys()):
-        aggregate_stats = yearly_stats[year]
-        doi_stats = aggregate_stats['doi_asserted_by']
-        rows.append({
-            'year': year,
-            'field': 'doi_asserted_by',
-            'value_type': 'crossref',
-            'count': doi_stats['crossref_count'],
-            'percentage': doi_stats['crossref_percentage'],
-            'total_records': doi_stats['total']
-        })
-        rows.append({
-            'year': year,
-            'field': 'doi_asserted_by',
-            'value_type': 'publisher',
-            'count': doi_stats['publisher_count'],
-            'percentage': doi_stats['publisher_percentage'],
-            'total_records': doi_stats['total']
-        })
-        if doi_stats['other_count'] > 0:
-            rows.append({
-                'year': year,
-                'field': 'doi_asserted_by',
-                'value_type': 'other',
-                'count': doi_stats['other_count'],
-                'percentage': doi_stats['other_percentage'],
-                'total_records': doi_stats['total']
-            })
-        if include_missing and doi_stats['missing_count'] > 0:
-            rows.append({
-                'year': year,
-                'field': 'doi_asserted_by',
-                'value_type': 'missing',
-                'count': doi_stats['missing_count'],
-                'percentage': doi_stats['missing_percentage'],
-                'total_records': doi_stats['total']
-            })
-        rows.append({
-            'year': year,
-            'field': 'doi_asserted_by',
-            'value_type': 'not_asserted',
-            'count': doi_stats['not_asserted_count'],
-            'percentage': doi_stats['not_asserted_percentage'],
-            'total_records': doi_stats['total']
-        })
+def write_api_files(rollups, output_dir, boolean_fields, funders):
+    os.makedirs(output_dir, exist_ok=True)
+    write_api_json(os.path.join(output_dir, 'funder.json'), 'funders',
+                   funder_entities(rollups, boolean_fields, funders))
+    write_api_json(os.path.join(output_dir, 'publisher.json'), 'publishers',
+                   publisher_entities(rollups, boolean_fields, funders))
+    write_api_json(os.path.join(output_dir, 'award.json'), 'awards',
+                   award_entities(rollups, boolean_fields, funders))
 
-        for field, values in aggregate_stats.items():
-            if field != 'doi_asserted_by' and field != 'potential':
-                rows.append({
-                    'year': year,
-                    'field': field,
-                    'value_type': 'true',
-                    'count': values['true_count'],
-                    'percentage': values['true_percentage'],
-                    'total_records': values['total']
-                })
-                rows.append({
-                    'year': year,
-                    'field': field,
-                    'value_type': 'false',
-                    'count': values['false_count'],
-                    'percentage': values['false_percentage'],
-                    'total_records': values['total']
-                })
-                if include_missing:
-                    if values['missing_count'] > 0:
-                        rows.append({
-                            'year': year,
-                            'field': field,
-                            'value_type': 'missing',
-                            'count': values['missing_count'],
-                            'percentage': values['missing_percentage'],
-                            'total_records': values['total']
-                        })
-                    if values['invalid_count'] > 0:
-                        rows.append({
-                            'year': year,
-                            'field': field,
-                            'value_type': 'invalid',
-                            'count': values['invalid_count'],
-                            'percentage': values['invalid_percentage'],
-                            'total_records': values['total']
-                        })
-
-        potential = aggregate_stats['potential']
-        rows.append({
-            'year': year,
-            'field': 'potential_state',
-            'value_type': 'has_award_id_or_funder_name_without_funder_doi',
-            'count': potential['potential_count'],
-            'percentage': potential['potential_percentage'],
-            'total_records': potential['total_records']
-        })
 
-    headers = ['year', 'field', 'value_type', 'count', 'percentage', 'total_records']
-
-    try:
-        with open(output_path, 'w', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=headers)
-            writer.writeheader()
-            writer.writerows(rows)
-        print(f"Yearly statistics written to {output_path}")
-    except Exception as e:
-        print(f"Error writing to yearly output file: {e}")
+# Metrics stored in the index files: (name, stats field, stats key).
+INDEX_METRICS = [
+    ('publication_count', None, None),
+    ('has_anr_funder_doi', 'has_anr_funder_doi', 'true_percentage'),
+    ('anr_code_in_awards', 'anr_code_in_awards', 'true_percentage'),
+    ('anr_name_in_funders', 'anr_name_in_funders', 'true_percentage'),
+    ('crossref_asserted', 'doi_asserted_by', 'crossref_percentage'),
+    ('publisher_asserted', 'doi_asserted_by', 'publisher_percentage'),
+    ('potential', 'potential', 'potential_percentage'),
+]
+INDEX_GROUPINGS = [('funder', 'publisher'), ('funder', 'year', 'publisher')]
 
 
-def write_publisher_csv(publisher_stats, output_path):
-    headers = ['publisher', 'member_id', 'field', 'value_type', 'count', 'percentage', 'total_records']
+def index_metrics(state, boolean_fields):
+    stats = summarize_group(state, boolean_fields)
+    return [publication_count(state) if field is None else round(stats[field][key], 4)
+            for _, field, key in INDEX_METRICS]
 
-    try:
-        with open(output_path, 'w', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=headers)
-            writer.writeheader()
-            writer.writerows(publisher_stats)
-        print(f"Publisher statistics written to {output_path}")
-    except Exception as e:
-        print(f"Error writing to publisher output file: {e}")
 
+def publisher_search_keys(name, member):
+    normalized = ' '.join(name.lower().split())
+    keys = {normalized, member}
+    keys.update(token for token in re.split(r'[^\w]+', normalized) if len(token) > 1)
+    return keys
 
-def write_publisher_yearly_csv(publisher_yearly_stats, output_path):
-    headers = ['year', 'publisher', 'member_id', 'field', 'value_type', 'count', 'percentage', 'total_records']
 
+def write_index_json(output_path, data, label):
     try:
-        with open(output_path, 'w', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=headers)
-            writer.writeheader()
-            writer.writerows(publisher_yearly_stats)
-        print(f"Publisher yearly statistics written to {output_path}")
+        with open(output_path, 'w', encoding='utf-8') as jsonfile:
+            json.dump(data, jsonfile, ensure_ascii=False, separators=(',', ':'))
+        print(f"{label} written to {output_path}")
     except Exception as e:
-        print(f"Error writing to publisher yearly output file: {e}")
+        print(f"Error writing {label.lower()} file: {e}")
+
+
+def write_index_files(rollups, output_dir, boolean_fields, funders, top_k=50, min_publications=10):
+    """Write the publisher index files derived from the funder x publisher and
+    funder x year x publisher cuboids:
+
+    - publisher_year_matrix.json: per publisher and funder, the INDEX_METRICS
+      row for all years and a dense year x metric matrix (null for years
+      without publications)
+    - publisher_rankings.json: per funder, metric and year (plus "all"), the
+      top publishers as [member_id, value, publication_count]
+    - publisher_search_index.json: sorted [key, member_id] pairs over the
+      lowercased name, its words and the member ID, for binary-search
+      prefix lookups
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    metric_names = [name for name, _, _ in INDEX_METRICS]
+    yearly = nest_groups(rollups[('funder', 'year', 'publisher')], ('funder', 'year', 'publisher'),
+                         ('publisher', 'funder'))
+    years = sorted({year for year_states in yearly.values() for year in year_states if str(year).isdigit()})
+    year_positions = {year: i for i, year in enumerate(years)}
+
+    publishers = {}
+    matrix = []
+    # (funder, period) -> [(metric values, member)] of publishers eligible for ranking
+    candidates = defaultdict(list)
+    for (funder_id, (publisher, member)), state in ordered_groups(rollups[('funder', 'publisher')],
+                                                                  ('funder', 'publisher')):
+        if member in INVALID_MEMBER_IDS:
+            continue
+        if member not in publishers:
+            publishers[member] = {'id': member, 'name': publisher, 'by_funder': {}}
+            matrix.append(publishers[member])
+        total_values = index_metrics(state, boolean_fields)
+        year_rows = [None] * len(years)
+        for year, year_state in yearly.get(((publisher, member), funder_id), {}).items():
+            if year in year_positions:
+                values = index_metrics(year_state, boolean_fields)
+                year_rows[year_positions[year]] = values
+                if values[0] >= min_publications:
+                    candidates[(funder_id, year)].append((values, member))
+        publishers[member]['by_funder'][funder_id] = {'total': total_values, 'yearly': year_rows}
+        if total_values[0] >= min_publications:
+            candidates[(funder_id, 'all')].append((total_values, member))
+
+    write_index_json(os.path.join(output_dir, 'publisher_year_matrix.json'),
+                     {'years': years, 'metrics': metric_names, 'publishers': matrix},
+                     'Publisher year matrix')
+
+    funder_ids = [funder['id'] for funder in funders]
+    rankings = {}
+    for funder_id in funder_ids:
+        periods = [period for period in ['all'] + years if (funder_id, period) in candidates]
+        if not periods:
+            continue
+        rankings[funder_id] = {}
+        for i, metric in enumerate(metric_names):
+            rankings[funder_id][metric] = {}
+            for period in periods:
+                # Ties are broken by publication count.
+                top = heapq.nlargest(top_k, candidates[(funder_id, period)],
+                                     key=lambda item: (item[0][i], item[0][0]))
+                rankings[funder_id][metric][period] = [[member, values[i], values[0]] for values, member in top]
+    write_index_json(os.path.join(output_dir, 'publisher_rankings.json'),
+                     {'metrics': metric_names, 'top_k': top_k, 'min_publications': min_publications,
+                      'by_funder': rankings},
+                     'Publisher rankings')
+
+    search_keys = sorted({(key, member) for member, entry in publishers.items()
+                          for key in publisher_search_keys(entry['name'], member)})
+    write_index_json(os.path.join(output_dir, 'publisher_search_index.json'),
+                     {'keys': [list(pair) for pair in search_keys]},
+                     'Publisher search index')
+
+
+def counted(records, stage, input_path=None):
+    """Pass records through, adding their number (and the input file size)
+    to an instrumentation stage once the stream ends."""
+    count = 0
+    try:
+        for record in records:
+            count += 1
+            yield record
+    finally:
+        stage.add(rows=count, bytes=os.path.getsize(input_path) if input_path else 0)
+
+
+def parse_group_by(value):
+    group_by = tuple(name.strip() for name in value.split(',') if name.strip())
+    unknown = [name for name in group_by if name not in DIMENSIONS]
+    if unknown:
+        print(f"Unknown dimension(s) in --group-by {value!r}: {', '.join(unknown)}. "
+              f"Available dimensions: {', '.join(DIMENSIONS)}")
+        sys.exit(1)
+    return group_by
 
 
 def main():
     args = parse_arguments()
+    run = start_run('create_stats_files', args)
     boolean_fields = ['has_anr_funder_doi',
                       'anr_code_in_awards', 'anr_name_in_funders']
-    data = read_csv_data(args.input_file)
-
-    aggregate_stats = calculate_aggregate_stats(
-        data, boolean_fields, args.include_missing, args.anr_funder_doi)
-    write_aggregate_csv(
-        aggregate_stats, args.aggregate_output, args.include_missing)
-
-    yearly_stats = calculate_yearly_stats(
-        data, boolean_fields, args.include_missing, args.anr_funder_doi)
-    write_yearly_csv(
-        yearly_stats, args.yearly_output, args.include_missing)
 
+    reports = [
+        ((), args.aggregate_output, 'Aggregate'),
+        (('year',), args.yearly_output, 'Yearly'),
+    ]
     if not args.aggregate_only:
-        publisher_stats = calculate_publisher_stats(
-            data, boolean_fields, args.include_missing, args.anr_funder_doi)
-        write_publisher_csv(publisher_stats, args.publisher_output)
-        
-        publisher_yearly_stats = calculate_publisher_yearly_stats(
-            data, boolean_fields, args.include_missing, args.anr_funder_doi)
-        write_publisher_yearly_csv(publisher_yearly_stats, args.publisher_yearly_output)
+        reports.append((('publisher',), args.publisher_output, 'Publisher'))
+        reports.append((('year', 'publisher'), args.publisher_yearly_output, 'Publisher yearly'))
+    if args.group_by:
+        os.makedirs(args.group_by_dir, exist_ok=True)
+    for value in args.group_by:
+        group_by = parse_group_by(value)
+        output_path = os.path.join(args.group_by_dir, f"{'_'.join(group_by)}_stats.csv")
+        reports.append((group_by, output_path, ' x '.join(group_by).capitalize()))
+
+    crossref = import_crossref_module() if args.funders or args.crossref_json_dir else None
+    if args.funders:
+        try:
+            funders = crossref.load_funders(args.funders)
+        except Exception as e:
+            print(f"Error loading funders file: {str(e)}")
+            sys.exit(1)
+        # Every report is split by funder so one pass serves all of them.
+        reports = [(('funder',) + group_by, output_path, label) for group_by, output_path, label in reports]
+    else:
+        funders = [{
+            'id': funder_id_from_doi(args.anr_funder_doi),
+            'doi': args.anr_funder_doi,
+            'name': args.funder_name,
+            'alternate_names': ['ANR', 'French National Research Agency']
+        }]
+
+    groupings = [group_by for group_by, _, _ in reports]
+    if args.api_data_dir:
+        groupings += API_GROUPINGS
+    if args.index_dir:
+        groupings += INDEX_GROUPINGS
+    dimensions = cube_dimensions(groupings)
+    if args.approximate:
+        def group_factory():
+            return ApproxGroupState(args.hll_precision)
+    else:
+        group_factory = GroupState
+    if args.crossref_json_dir:
+        records = iter_crossref_records(args.hal_input, args.crossref_json_dir, funders,
+                                        bool(args.funders), args.members_file)
+    else:
+        funder_dois = {funder['id']: funder['doi'] for funder in funders}
+        records = iter_csv_records(args.input_file, boolean_fields, funder_dois, funders[0]['id'])
+    if args.sample:
+        with run.stage('read_and_sample') as stage:
+            strata = sample_strata(counted(records, stage, args.input_file), args.sample, args.sample_seed)
+        sampled = sum(len(reservoir.records) for reservoir in strata.values())
+        population = sum(reservoir.population() for reservoir in strata.values())
+        print(f"Sampled {sampled} of about {int(round(population))} DOIs across {len(strata)} (year, publisher) strata")
+        with run.stage('rollups'):
+            rollups = sampled_rollups(strata, dimensions, groupings, boolean_fields, args.include_missing)
+
+        def summarize(strata_stats):
+            return combine_strata(strata_stats, boolean_fields, args.confidence)
+    else:
+        with run.stage('read_and_build_cube') as stage:
+            cube = build_cube(counted(records, stage, args.input_file), dimensions, boolean_fields,
+                              args.include_missing, group_factory)
+        with run.stage('rollups'):
+            rollups = compute_rollups(cube, dimensions, groupings)
+        summarize = None
+
+    with run.stage('write_reports'):
+        for group_by, output_path, label in reports:
+            write_group_report(rollups[group_by], group_by, output_path,
+                               boolean_fields, args.include_missing, label, args.approximate, summarize)
+
+    if args.api_data_dir:
+        with run.stage('write_api_files'):
+            write_api_files(rollups, args.api_data_dir, boolean_fields, funders)
+    if args.index_dir:
+        with run.stage('write_index_files'):
+            write_index_files(rollups, args.index_dir, boolean_fields, funders,
+                              args.index_top_k, args.index_min_publications)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run_main(main)
@@ -0,0 +1,91 @@
+import math
+import hashlib
+
+
+def hash_value(value):
+    """64-bit hash of a string, stable across runs and processes."""
+    return int.from_bytes(
+        hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+    """Mergeable distinct counter with a fixed memory ceiling of 2**precision bytes.
+
+    Small sets are kept as exact sets of hashes and only switch to registers
+    once they would take more memory than the registers do, so groups with few
+    DOIs are counted exactly. Callers hash once with hash_value() and pass the
+    hash to add(), so one row can feed several sketches.
+    """
+    __slots__ = ('precision', 'hashes', 'registers')
+
+    def __init__(self, precision=12):
+        if not 4 <= precision <= 18:
+            raise ValueError(f"HyperLogLog precision must be between 4 and 18, got {precision}")
+        self.precision = precision
+        self.hashes = set()
+        self.registers = None
+
+    @property
+    def size(self):
+        return 1 << self.precision
+
+    def _sparse_limit(self):
+        # A set entry costs roughly 64 bytes against one byte per register.
+        return self.size // 64
+
+    def _to_dense(self):
+        self.registers = bytearray(self.size)
+        for hashed in self.hashes:
+            self._add_to_registers(hashed)
+        self.hashes = None
+
+    def _add_to_registers(self, hashed):
+        index = hashed >> (64 - self.precision)
+        remainder = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remainder.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def add(self, hashed):
+        if self.registers is None:
+            self.hashes.add(hashed)
+            if len(self.hashes) > self._sparse_limit():
+                self._to_dense()
+        else:
+            self._add_to_registers(hashed)
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches with different precision")
+        if other.registers is None:
+            for hashed in other.hashes:
+                self.add(hashed)
+            return
+        if self.registers is None:
+            self._to_dense()
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def copy(self):
+        sketch = HyperLogLog(self.precision)
+        sketch.merge(self)
+        return sketch
+
+    def is_exact(self):
+        return self.registers is None
+
+    def count(self):
+        if self.registers is None:
+            return len(self.hashes)
+        m = self.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def relative_error(self):
+        """Relative standard error of count(): 0 while the set is still exact."""
+        if self.registers is None:
+            return 0.0
+        return 1.04 / math.sqrt(self.size)
@@ -1,20 +1,79 @@
+import os
+import re
+import csv
 import sys
+import math
+import heapq
+import shutil
 import argparse
+import tempfile
 from pathlib import Path
-import pandas as pd
+from collections import Counter
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils', 'instrumentation'))
+from instrumentation import add_instrumentation_arguments, start_run, run_main
+
+# Values pandas.read_csv reads as missing, which the in-memory comparison
+# drops; the external one skips them too so both give the same result.
+NA_VALUES = frozenset([
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+])
+# Rough bytes of memory per byte of input CSV once its DOIs are held in a
+# Python set (string objects plus hash table slots).
+SET_MEMORY_FACTOR = 6
+# Every combination of inputs gets a region file, so keep their number sane.
+MAX_INPUTS = 8
 
 def parse_args():
-    parser = argparse.ArgumentParser(description='Compare two DOI CSV files.')
-    parser.add_argument('-f1', '--file1', required=True,
+    parser = argparse.ArgumentParser(description='Compare two DOI CSV files, or several with --inputs.')
+    parser.add_argument('-f1', '--file1',
                         help='Path to the first input CSV file.')
-    parser.add_argument('-f2', '--file2', required=True,
+    parser.add_argument('-f2', '--file2',
                         help='Path to the second input CSV file.')
+    parser.add_argument('-i', '--inputs', nargs='+',
+                        help=f'Compare 2 to {MAX_INPUTS} CSV files at once and write the DOIs of every Venn region '
+                             f'plus a region summary.')
+    parser.add_argument('-l', '--labels',
+                        help='Comma-separated names for the --inputs files (default: the file names).')
+    parser.add_argument('--summary-only', action='store_true',
+                        help='With --inputs, only write the region summary, not the DOIs of each region.')
     parser.add_argument('-o', '--output', default='file_comparison_results',
                         help='Directory to save output files (default: file_comparison_results).')
-    return parser.parse_args()
+    parser.add_argument('-m', '--memory-limit', type=int, default=2048,
+                        help='Approximate memory budget in MB. Inputs whose DOI sets fit are compared in memory; '
+                             'larger ones are partitioned on disk and compared bucket by bucket (default: 2048).')
+    parser.add_argument('--external', action='store_true',
+                        help='Always use the on-disk comparison.')
+    parser.add_argument('-p', '--partitions', type=int,
+                        help='Number of on-disk buckets (default: from the input size and --memory-limit).')
+    parser.add_argument('-t', '--temp-dir',
+                        help='Directory for the on-disk buckets (default: system temp directory).')
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    if args.inputs:
+        if args.file1 or args.file2:
+            parser.error('Give either -f1/-f2 or --inputs')
+        if not 2 <= len(args.inputs) <= MAX_INPUTS:
+            parser.error(f'--inputs takes 2 to {MAX_INPUTS} files')
+        if args.labels:
+            args.labels = [safe_label(label) for label in args.labels.split(',')]
+            if len(args.labels) != len(args.inputs) or len(set(args.labels)) != len(args.labels) \
+                    or not all(args.labels):
+                parser.error('--labels needs one distinct, non-empty name per input file (after replacing '
+                             'characters other than letters, digits, ".", "_" and "-" with "_")')
+    elif not (args.file1 and args.file2):
+        parser.error('Give -f1 and -f2, or --inputs')
+    return args
 
 
-def compare_doi_csvs(file1_path, file2_path, output_dir):
+def compare_doi_csvs(file1_path, file2_path, output_dir, run, memory_limit=2048, external=False, partitions=None,
+                     temp_dir=None):
     file1 = Path(file1_path)
     file2 = Path(file2_path)
     output_path = Path(output_dir)
@@ -38,11 +97,32 @@ def compare_doi_csvs(file1_path, file2_path, output_dir):
     in_f1_not_in_f2_file = output_path / f"in_{file1.stem}_not_in_{file2.stem}.csv"
     in_f2_not_in_f1_file = output_path / f"in_{file2.stem}_not_in_{file1.stem}.csv"
 
+    outputs = (overlap_file, non_overlap_file, in_f1_not_in_f2_file, in_f2_not_in_f1_file)
+    input_bytes = file1.stat().st_size + file2.stat().st_size
+    fits_in_memory = input_bytes * SET_MEMORY_FACTOR <= memory_limit * 1024 * 1024
+    if pd is not None and fits_in_memory and not external and not partitions:
+        compare_in_memory(file1, file2, outputs, run)
+    else:
+        if not partitions:
+            # Half the budget per bucket pair leaves room for the results.
+            partitions = max(2 if external else 1,
+                             math.ceil(input_bytes * SET_MEMORY_FACTOR / (memory_limit * 1024 * 1024 / 2)))
+        compare_external(file1, file2, outputs, partitions, temp_dir, run)
+
+    print("\nProcessing complete.")
+    print(f"Output files generated in: {output_path.resolve()}")
+
+
+def compare_in_memory(file1, file2, outputs, run):
+    """Load both files with pandas and compare Python sets of their DOIs."""
+    overlap_file, non_overlap_file, in_f1_not_in_f2_file, in_f2_not_in_f1_file = outputs
     try:
-        print(f"\nReading {file1}...")
-        df1 = pd.read_csv(file1, dtype={'doi': str})
-        print(f"Reading {file2}...")
-        df2 = pd.read_csv(file2, dtype={'doi': str})
+        with run.stage('read') as stage:
+            print(f"\nReading {file1}...")
+            df1 = pd.read_csv(file1, dtype={'doi': str})
+            print(f"Reading {file2}...")
+            df2 = pd.read_csv(file2, dtype={'doi': str})
+            stage.add(rows=len(df1) + len(df2), bytes=file1.stat().st_size + file2.stat().st_size)
 
         if 'doi' not in df1.columns:
             print(f"Error: 'doi' column not found in {file1}")
@@ -51,8 +131,13 @@ def compare_doi_csvs(file1_path, file2_path, output_dir):
             print(f"Error: 'doi' column not found in {file2}")
             sys.exit(1)
 
-        dois1 = set(df1['doi'].str.strip().str.lower().dropna().unique())
-        dois2 = set(df2['doi'].str.strip().str.lower().dropna().unique())
+        with run.stage('normalize') as stage:
+            dois1 = set(df1['doi'].str.strip().str.lower().dropna().unique())
+            dois2 = set(df2['doi'].str.strip().str.lower().dropna().unique())
+            # Whitespace-only cells strip to '', which is not a DOI.
+            dois1.discard('')
+            dois2.discard('')
+            stage.add(rows=len(df1) + len(df2))
 
         print(f"Found {len(dois1)} unique, non-empty DOIs in {file1.name}")
         print(f"Found {len(dois2)} unique, non-empty DOIs in {file2.name}")
@@ -63,10 +148,12 @@ def compare_doi_csvs(file1_path, file2_path, output_dir):
             print(f"Warning: No valid DOIs found in {file2.name}.")
 
         print("\nCalculating overlap and differences...")
-        overlap_dois = dois1.intersection(dois2)
-        in_f1_not_in_f2_dois = dois1.difference(dois2)
-        in_f2_not_in_f1_dois = dois2.difference(dois1)
-        non_overlap_dois = dois1.symmetric_difference(dois2)
+        with run.stage('set_operations') as stage:
+            overlap_dois = dois1.intersection(dois2)
+            in_f1_not_in_f2_dois = dois1.difference(dois2)
+            in_f2_not_in_f1_dois = dois2.difference(dois1)
+            non_overlap_dois = dois1.symmetric_difference(dois2)
+            stage.add(rows=len(dois1) + len(dois2))
 
         overlap_df = pd.DataFrame(sorted(list(overlap_dois)), columns=['doi'])
         non_overlap_df = pd.DataFrame(
@@ -76,20 +163,19 @@ def compare_doi_csvs(file1_path, file2_path, output_dir):
         in_f2_not_in_f1_df = pd.DataFrame(
             sorted(list(in_f2_not_in_f1_dois)), columns=['doi'])
 
-        print(f"\nWriting {len(overlap_df)} overlapping DOIs to: {overlap_file}")
-        overlap_df.to_csv(overlap_file, index=False)
-
-        print(f"Writing {len(non_overlap_df)} non-overlapping DOIs to: {non_overlap_file}")
-        non_overlap_df.to_csv(non_overlap_file, index=False)
+        with run.stage('write') as stage:
+            print(f"\nWriting {len(overlap_df)} overlapping DOIs to: {overlap_file}")
+            overlap_df.to_csv(overlap_file, index=False)
 
-        print(f"Writing {len(in_f1_not_in_f2_df)} DOIs in {file1.name} only to: {in_f1_not_in_f2_file}")
-        in_f1_not_in_f2_df.to_csv(in_f1_not_in_f2_file, index=False)
+            print(f"Writing {len(non_overlap_df)} non-overlapping DOIs to: {non_overlap_file}")
+            non_overlap_df.to_csv(non_overlap_file, index=False)
 
-        print(f"Writing {len(in_f2_not_in_f1_df)} DOIs in {file2.name} only to: {in_f2_not_in_f1_file}")
-        in_f2_not_in_f1_df.to_csv(in_f2_not_in_f1_file, index=False)
+            print(f"Writing {len(in_f1_not_in_f2_df)} DOIs in {file1.name} only to: {in_f1_not_in_f2_file}")
+            in_f1_not_in_f2_df.to_csv(in_f1_not_in_f2_file, index=False)
 
-        print("\nProcessing complete.")
-        print(f"Output files generated in: {output_path.resolve()}")
+            print(f"Writing {len(in_f2_not_in_f1_df)} DOIs in {file2.name} only to: {in_f2_not_in_f1_file}")
+            in_f2_not_in_f1_df.to_csv(in_f2_not_in_f1_file, index=False)
+            stage.add(rows=len(overlap_df) + len(non_overlap_df) + len(in_f1_not_in_f2_df) + len(in_f2_not_in_f1_df))
 
     except pd.errors.EmptyDataError:
         print(f"Error: One of the input files is empty or invalid.")
@@ -99,10 +185,295 @@ def compare_doi_csvs(file1_path, file2_path, output_dir):
         sys.exit(1)
 
 
+def doi_column(reader, file_path):
+    header = next(reader, None)
+    if header is None:
+        print("Error: One of the input files is empty or invalid.")
+        sys.exit(1)
+    if 'doi' not in header:
+        print(f"Error: 'doi' column not found in {file_path}")
+        sys.exit(1)
+    return header.index('doi')
+
+
+def iter_normalized_dois(file_path, stage=None):
+    """Yield the stripped, lowercased DOIs of a CSV file. Values pandas reads
+    as missing are skipped, and so are values that are empty once stripped,
+    as in compare_in_memory."""
+    rows = 0
+    with open(file_path, 'r', encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f)
+        index = doi_column(reader, file_path)
+        for row in reader:
+            rows += 1
+            if index >= len(row) or row[index] in NA_VALUES:
+                continue
+            doi = row[index].strip().lower()
+            if doi:
+                yield doi
+    if stage is not None:
+        stage.add(rows=rows, bytes=os.path.getsize(file_path))
+
+
+def partition_dois(file_path, bucket_dir, prefix, partitions, stage=None):
+    """Hash-partition the DOIs of a file into `partitions` bucket files, so
+    that equal DOIs of both inputs land in buckets with the same number."""
+    paths = [os.path.join(bucket_dir, f"{prefix}_{i}.csv") for i in range(partitions)]
+    files = [open(path, 'w', encoding='utf-8', newline='') for path in paths]
+    try:
+        writers = [csv.writer(f) for f in files]
+        for doi in iter_normalized_dois(file_path, stage):
+            writers[hash(doi) % partitions].writerow([doi])
+    finally:
+        for f in files:
+            f.close()
+    return paths
+
+
+def read_dois(path, header=False):
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        if header:
+            next(reader, None)
+        for row in reader:
+            yield row[0]
+
+
+def write_dois(path, dois):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        for doi in dois:
+            writer.writerow([doi])
+
+
+def write_doi_file(output_file, dois):
+    """Write a one-column 'doi' CSV like DataFrame.to_csv(index=False)."""
+    with open(output_file, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(['doi'])
+        for doi in dois:
+            writer.writerow([doi])
+
+
+def compare_external(file1, file2, outputs, partitions, temp_dir, run):
+    """Compare the DOI sets with bounded memory. Both files are streamed
+    into hash buckets on disk; each pair of buckets is compared in memory,
+    its sorted results are written as runs, and the runs are merged into
+    the sorted output files. With one partition the files are read straight
+    into memory instead."""
+    overlap_file, non_overlap_file, in_f1_not_in_f2_file, in_f2_not_in_f1_file = outputs
+    bucket_dir = tempfile.mkdtemp(prefix='doi_overlap_', dir=temp_dir)
+    try:
+        if partitions > 1:
+            print(f"\nPartitioning both files into {partitions} buckets in {bucket_dir}...")
+            with run.stage('partition') as stage:
+                print(f"Reading {file1}...")
+                paths1 = partition_dois(file1, bucket_dir, 'f1', partitions, stage)
+                print(f"Reading {file2}...")
+                paths2 = partition_dois(file2, bucket_dir, 'f2', partitions, stage)
+            buckets = ((set(read_dois(path1)), set(read_dois(path2))) for path1, path2 in zip(paths1, paths2))
+        else:
+            with run.stage('read') as stage:
+                print(f"\nReading {file1}...")
+                dois1 = set(iter_normalized_dois(file1, stage))
+                print(f"Reading {file2}...")
+                dois2 = set(iter_normalized_dois(file2, stage))
+            buckets = [(dois1, dois2)]
+
+        print("\nCalculating overlap and differences...")
+        counts = {'dois1': 0, 'dois2': 0, 'overlap': 0, 'in_f1_not_in_f2': 0, 'in_f2_not_in_f1': 0}
+        runs = {'overlap': [], 'in_f1_not_in_f2': [], 'in_f2_not_in_f1': []}
+        for i, (dois1, dois2) in enumerate(buckets):
+            with run.stage('set_operations') as stage:
+                results = {
+                    'overlap': dois1.intersection(dois2),
+                    'in_f1_not_in_f2': dois1.difference(dois2),
+                    'in_f2_not_in_f1': dois2.difference(dois1)
+                }
+                counts['dois1'] += len(dois1)
+                counts['dois2'] += len(dois2)
+                stage.add(rows=len(dois1) + len(dois2))
+            for name, dois in results.items():
+                counts[name] += len(dois)
+                if partitions > 1:
+                    run_path = os.path.join(bucket_dir, f"{name}_{i}.csv")
+                    write_dois(run_path, sorted(dois))
+                    runs[name].append(read_dois(run_path))
+                else:
+                    runs[name].append(sorted(dois))
+
+        print(f"Found {counts['dois1']} unique, non-empty DOIs in {file1.name}")
+        print(f"Found {counts['dois2']} unique, non-empty DOIs in {file2.name}")
+        if not counts['dois1']:
+            print(f"Warning: No valid DOIs found in {file1.name}.")
+        if not counts['dois2']:
+            print(f"Warning: No valid DOIs found in {file2.name}.")
+
+        with run.stage('write') as stage:
+            print(f"\nWriting {counts['overlap']} overlapping DOIs to: {overlap_file}")
+            write_doi_file(overlap_file, heapq.merge(*runs['overlap']))
+
+            print(f"Writing {counts['in_f1_not_in_f2']} DOIs in {file1.name} only to: {in_f1_not_in_f2_file}")
+            write_doi_file(in_f1_not_in_f2_file, heapq.merge(*runs['in_f1_not_in_f2']))
+
+            print(f"Writing {counts['in_f2_not_in_f1']} DOIs in {file2.name} only to: {in_f2_not_in_f1_file}")
+            write_doi_file(in_f2_not_in_f1_file, heapq.merge(*runs['in_f2_not_in_f1']))
+
+            # The symmetric difference is the merge of the two disjoint
+            # one-sided files.
+            non_overlap_count = counts['in_f1_not_in_f2'] + counts['in_f2_not_in_f1']
+            print(f"Writing {non_overlap_count} non-overlapping DOIs to: {non_overlap_file}")
+            write_doi_file(non_overlap_file, heapq.merge(read_dois(in_f1_not_in_f2_file, header=True),
+                                                         read_dois(in_f2_not_in_f1_file, header=True)))
+            stage.add(rows=counts['overlap'] + non_overlap_count * 2)
+    except OSError as e:
+        print(f"An unexpected error occurred: {e}")
+        sys.exit(1)
+    finally:
+        shutil.rmtree(bucket_dir, ignore_errors=True)
+
+
+def safe_label(label):
+    """A label usable in a file name: anything but letters, digits, '.', '_'
+    and '-' becomes '_'."""
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', label.strip())
+
+
+def default_labels(files):
+    """File stems, made unique by appending the input number if needed."""
+    stems = [safe_label(Path(file).stem) for file in files]
+    return [stem if stems.count(stem) == 1 else f"{stem}_{i + 1}" for i, stem in enumerate(stems)]
+
+
+def region_name(mask, labels):
+    return '+'.join(label for i, label in enumerate(labels) if mask & (1 << i))
+
+
+def compare_n_way(files, labels, output_dir, summary_only, run, memory_limit=2048, external=False, partitions=None,
+                  temp_dir=None):
+    """Compare any number of DOI files at once.
+
+    Every distinct DOI belongs to the Venn region of the exact set of files
+    it appears in. As in compare_external, the files are hash-partitioned
+    into buckets on disk unless they fit in `memory_limit`. Each bucket is
+    read into a dict of DOI -> bitmask of the files holding it, which gives
+    the region counts and a sorted run of each region's DOIs. The runs are
+    merged into sorted region files (skipped with --summary-only).
+    """
+    files = [Path(file) for file in files]
+    for file in files:
+        if not file.is_file():
+            print(f"Error: Input file not found: {file}")
+            sys.exit(1)
+    labels = labels or default_labels(files)
+    output_path = Path(output_dir)
+    try:
+        output_path.mkdir(parents=True, exist_ok=True)
+        print(f"Output directory: {output_path.resolve()}")
+    except OSError as e:
+        print(f"Error creating output directory '{output_path}': {e}")
+        sys.exit(1)
+
+    if not partitions:
+        input_bytes = sum(file.stat().st_size for file in files)
+        partitions = max(2 if external else 1,
+                         math.ceil(input_bytes * SET_MEMORY_FACTOR / (memory_limit * 1024 * 1024 / 2)))
+    bucket_dir = tempfile.mkdtemp(prefix='doi_regions_', dir=temp_dir)
+    try:
+        if partitions > 1:
+            print(f"\nPartitioning {len(files)} files into {partitions} buckets in {bucket_dir}...")
+            with run.stage('partition') as stage:
+                bucket_paths = []
+                for i, file in enumerate(files):
+                    print(f"Reading {file}...")
+                    bucket_paths.append(partition_dois(file, bucket_dir, f"f{i}", partitions, stage))
+
+        region_counts = Counter()
+        runs = {}
+        for b in range(partitions):
+            with run.stage('membership') as stage:
+                masks = {}
+                get = masks.get
+                for i, file in enumerate(files):
+                    if partitions > 1:
+                        dois = read_dois(bucket_paths[i][b])
+                    else:
+                        print(f"Reading {file}...")
+                        dois = iter_normalized_dois(file, stage)
+                    bit = 1 << i
+                    for doi in dois:
+                        masks[doi] = get(doi, 0) | bit
+                region_counts.update(masks.values())
+                if partitions > 1:
+                    stage.add(rows=len(masks))
+            if summary_only:
+                continue
+            with run.stage('set_operations') as stage:
+                regions = {}
+                for doi, mask in masks.items():
+                    regions.setdefault(mask, []).append(doi)
+                for mask, dois in regions.items():
+                    dois.sort()
+                    if partitions > 1:
+                        run_path = os.path.join(bucket_dir, f"region{mask}_{b}.csv")
+                        write_dois(run_path, dois)
+                        runs.setdefault(mask, []).append(read_dois(run_path))
+                    else:
+                        runs.setdefault(mask, []).append(dois)
+                stage.add(rows=len(masks))
+            del masks, regions
+
+        total = sum(region_counts.values())
+        input_counts = [sum(count for mask, count in region_counts.items() if mask & (1 << i))
+                        for i in range(len(files))]
+        for file, count in zip(files, input_counts):
+            print(f"Found {count} unique, non-empty DOIs in {file.name}")
+        print(f"\n{total} distinct DOIs across {len(files)} files in {len(region_counts)} non-empty regions")
+
+        summary_file = output_path / 'summary.csv'
+        region_files = {mask: output_path / f"region_{region_name(mask, labels)}.csv" for mask in region_counts}
+        with run.stage('write') as stage:
+            with open(summary_file, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f, lineterminator='\n')
+                writer.writerow(['region'] + labels + ['input_count', 'doi_count', 'share', 'file'])
+                for mask in sorted(region_counts, key=lambda m: (-bin(m).count('1'), m)):
+                    writer.writerow([region_name(mask, labels)] +
+                                    [int(bool(mask & (1 << i))) for i in range(len(files))] +
+                                    [bin(mask).count('1'), region_counts[mask],
+                                     f"{region_counts[mask] / total:.4f}",
+                                     '' if summary_only else region_files[mask].name])
+                writer.writerow(['total'] + input_counts + ['', total, '1.0000' if total else '', ''])
+            print(f"Region summary written to: {summary_file}")
+
+            if not summary_only:
+                for mask, region_file in sorted(region_files.items()):
+                    print(f"Writing {region_counts[mask]} DOIs in {region_name(mask, labels)} only to: "
+                          f"{region_file}")
+                    write_doi_file(region_file, heapq.merge(*runs[mask]))
+                stage.add(rows=total)
+    except OSError as e:
+        print(f"An unexpected error occurred: {e}")
+        sys.exit(1)
+    finally:
+        shutil.rmtree(bucket_dir, ignore_errors=True)
+
+    print("\nProcessing complete.")
+    print(f"Output files generated in: {output_path.resolve()}")
+
+
 def main():
     args = parse_args()
-    compare_doi_csvs(args.file1, args.file2, args.output)
+    run = start_run('find_anr_osm_overlap', args)
+    if args.memory_limit < 1 or (args.partitions is not None and args.partitions < 1):
+        print("Error: --memory-limit and --partitions must be at least 1")
+        sys.exit(1)
+    if args.inputs:
+        compare_n_way(args.inputs, args.labels, args.output, args.summary_only, run, args.memory_limit,
+                      args.external, args.partitions, args.temp_dir)
+        return
+    compare_doi_csvs(args.file1, args.file2, args.output, run, args.memory_limit, args.external,
+                     args.partitions, args.temp_dir)
 
 
 if __name__ == "__main__":
-    main()
+    run_main(main)
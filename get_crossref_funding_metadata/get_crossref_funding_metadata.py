@@ -1,6 +1,7 @@
 import os
 import re
 import csv
+import sys
 import json
 import time
 import argparse
@@ -13,6 +14,11 @@ from datetime import datetime
 from threading import Lock, Semaphore, Thread
 from queue import Queue, Empty
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils', 'instrumentation'))
+from instrumentation import add_instrumentation_arguments, start_run, run_main
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils', 'fast_json'))
+import fast_json
+
 
 def parse_arguments():
     parser = argparse.ArgumentParser(
@@ -45,12 +51,57 @@ def parse_arguments():
                         help='Output CSV file for failed entries (default: failed_entries.csv)')
     parser.add_argument('-p', '--members-file', type=str,
                         help='Path to members.json file for publisher names')
+    parser.add_argument('--funders', type=str,
+                        help='Path to a funders JSON file to check several funders in one pass '
+                             '(default: ANR only)')
+    fast_json.add_json_decoder_argument(parser)
+    add_instrumentation_arguments(parser)
     return parser.parse_args()
 
 
 log_lock = Lock()
 
 
+ANR_FUNDER = {
+    'id': '501100001665',
+    'name': 'Agence Nationale de la Recherche',
+    'doi': '10.13039/501100001665',
+    'acronyms': ['anr'],
+    'name_variants': [
+        "agence nationale de la recherche",
+        "french national agency for research",
+        "french national research agency",
+        "national agency for research"
+    ],
+    'alternate_names': ['ANR', 'French National Research Agency'],
+    'code_patterns': [re.compile(r'ANR-', re.IGNORECASE)]
+}
+
+
+def load_funders(funders_file):
+    """Read a JSON list of funders. Each entry needs a `doi`; `id` defaults to
+    the DOI suffix, and `name`, `acronyms`, `name_variants`,
+    `alternate_names` and `code_patterns` (regular expressions matched
+    against the start of a grant code) are optional."""
+    with open(funders_file, 'r', encoding='utf-8') as f:
+        funders_data = json.load(f)
+    funders = []
+    for entry in funders_data:
+        if not entry.get('doi'):
+            raise ValueError(f"Funder entry without a 'doi': {entry}")
+        acronyms = [a.lower() for a in entry.get('acronyms', [])]
+        funders.append({
+            'id': str(entry.get('id') or entry['doi'].split('/', 1)[-1]),
+            'name': entry.get('name', entry['doi']),
+            'doi': entry['doi'],
+            'acronyms': acronyms,
+            'name_variants': [v.lower() for v in entry.get('name_variants', [])],
+            'alternate_names': entry.get('alternate_names', [a.upper() for a in acronyms]),
+            'code_patterns': [re.compile(p, re.IGNORECASE) for p in entry.get('code_patterns', [])]
+        })
+    return funders
+
+
 def log_error(log_file, doi, error_message):
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     with log_lock:
@@ -70,14 +121,20 @@ def tokenize_text(text):
     return re.split(r'[\s\-_.,;:()\[\]{}]+', text.lower())
 
 
+def load_crossref_json(file_path):
+    """Read a stored Crossref work. With msgspec only the fields used for
+    the funding checks are decoded."""
+    with open(file_path, 'rb') as f:
+        return fast_json.loads_crossref_work(f.read())
+
+
 def fetch_from_crossref(doi, headers, json_dir=None):
     if json_dir:
         safe_filename = doi.replace('/', '_') + '.json'
         file_path = os.path.join(json_dir, safe_filename)
         try:
             if os.path.exists(file_path):
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    return json.load(f), None
+                return load_crossref_json(file_path), None
             else:
                 return None, f"JSON file not found: {file_path}"
         except Exception as e:
@@ -87,7 +144,7 @@ def fetch_from_crossref(doi, headers, json_dir=None):
         try:
             response = requests.get(url, headers=headers)
             response.raise_for_status()
-            return response.json(), None
+            return fast_json.loads(response.content), None
         except requests.exceptions.RequestException as e:
             return None, f"Request failed: {str(e)}"
 
@@ -131,9 +188,12 @@ def extract_funder_info(crossref_data):
     return names, award_ids, funder_dois, doi_asserted_by
 
 
+def check_funder_doi(funder_dois, funder_doi):
+    return funder_doi in funder_dois
+
+
 def check_anr_funder_doi(funder_dois):
-    anr_doi = "10.13039/501100001665"
-    return anr_doi in funder_dois
+    return check_funder_doi(funder_dois, ANR_FUNDER['doi'])
 
 
 def is_discrete_match(needle, haystack):
@@ -163,24 +223,52 @@ def check_anr_code_in_awards(anr_code, award_ids):
     return False
 
 
-def check_anr_name_in_funders(funder_names):
-    anr_variations = [
-        "agence nationale de la recherche",
-        "french national agency for research",
-        "anr",
-        "french national research agency",
-        "national agency for research"
-    ]
+def check_funder_name_in_funders(funder_names, acronyms, name_variants):
     for name in funder_names:
-        if re.search(r'\banr\b', name.lower()):
-            return True
+        for acronym in acronyms:
+            if re.search(rf'\b{re.escape(acronym)}\b', name.lower()):
+                return True
     for name in funder_names:
-        for variation in anr_variations:
-            if variation != "anr" and is_discrete_match(variation, name):
+        for variation in name_variants:
+            if is_discrete_match(variation, name):
                 return True
     return False
 
 
+def check_anr_name_in_funders(funder_names):
+    return check_funder_name_in_funders(
+        funder_names, ANR_FUNDER['acronyms'], ANR_FUNDER['name_variants'])
+
+
+def is_funder_code(code, funder):
+    return bool(code) and any(p.match(code.strip()) for p in funder['code_patterns'])
+
+
+def funders_for_publication(publication, funders):
+    # An explicit funder_id column wins; otherwise the grant code decides.
+    funder_id = publication.get('funder_id')
+    if funder_id:
+        return [f for f in funders if f['id'] == funder_id]
+    return [f for f in funders if is_funder_code(publication.get('anr_code', ''), f)]
+
+
+def check_funder_code_in_awards(code, award_ids, funder):
+    if is_funder_code(code, funder):
+        return check_anr_code_in_awards(code, award_ids)
+    # No code of this funder on the input row: accept any award that looks
+    # like one of its grant numbers.
+    return any(p.search(award) for award in award_ids if award for p in funder['code_patterns'])
+
+
+def check_funder(funder, code, funder_names, award_ids, funder_dois):
+    return {
+        'has_anr_funder_doi': check_funder_doi(funder_dois, funder['doi']),
+        'anr_code_in_awards': check_funder_code_in_awards(code, award_ids, funder),
+        'anr_name_in_funders': check_funder_name_in_funders(
+            funder_names, funder['acronyms'], funder['name_variants'])
+    }
+
+
 def join_with_null_placeholder(items, separator=';', null_value='NULL'):
     if not items:
         return null_value
@@ -200,33 +288,45 @@ def process_publication_data(publication, crossref_data, output_dir, args, membe
         funder_names, award_ids, funder_dois, doi_asserted_by = extract_funder_info(
             crossref_data)
         created_year = extract_created_year(crossref_data)
-        has_anr_funder_doi = check_anr_funder_doi(funder_dois)
-        anr_code_in_awards = check_anr_code_in_awards(anr_code, award_ids)
-        anr_name_in_funders = check_anr_name_in_funders(funder_names)
         publisher = publisher or args.null_value
         member = member or args.null_value
         created_year = created_year or args.null_value
-        result = publication.copy()
-        result.update({
+        base_result = publication.copy()
+        base_result.update({
             'publisher': publisher,
             'member': member,
             'funder_names': join_with_null_placeholder(funder_names, null_value=args.null_value),
             'award_ids': join_with_null_placeholder(award_ids, null_value=args.null_value),
             'funder_dois': join_with_null_placeholder(funder_dois, null_value=args.null_value),
             'doi_asserted_by': join_with_null_placeholder(doi_asserted_by, null_value=args.null_value),
-            'has_anr_funder_doi': has_anr_funder_doi,
-            'anr_code_in_awards': anr_code_in_awards,
-            'anr_name_in_funders': anr_name_in_funders,
             'created_year': created_year,
             'error': args.null_value
         })
-        return result, True
+        if not args.funders:
+            base_result.update({
+                'has_anr_funder_doi': check_anr_funder_doi(funder_dois),
+                'anr_code_in_awards': check_anr_code_in_awards(anr_code, award_ids),
+                'anr_name_in_funders': check_anr_name_in_funders(funder_names)
+            })
+            return [base_result], True
+        matched_funders = funders_for_publication(publication, args.funders)
+        if not matched_funders:
+            error_msg = f"No configured funder matches code {anr_code}"
+            log_error(args.log_file, doi, error_msg)
+            return [create_error_result(publication, args, error_msg)], False
+        results = []
+        for funder in matched_funders:
+            result = base_result.copy()
+            result['funder_id'] = funder['id']
+            result.update(check_funder(funder, anr_code, funder_names, award_ids, funder_dois))
+            results.append(result)
+        return results, True
     except Exception as e:
         error_msg = f"Data processing error: {str(e)}"
         log_error(args.log_file, doi, error_msg)
         print(f"Error processing data for DOI {doi}: {str(e)}")
         traceback.print_exc()
-        return create_error_result(publication, args, error_msg), False
+        return [create_error_result(publication, args, error_msg)], False
 
 
 def create_error_result(publication, args, error_message):
@@ -251,9 +351,9 @@ csv_lock = Lock()
 failed_lock = Lock()
 
 
-def write_result(writer, result):
+def write_results(writer, results):
     with csv_lock:
-        writer.writerow(result)
+        writer.writerows(results)
 
 
 def write_failed_entry(writer, result):
@@ -261,22 +361,31 @@ def write_failed_entry(writer, result):
         writer.writerow(result)
 
 
-def process_from_local_json(publication, args, writer, failed_writer, member_map=None):
+def write_failed_entries(writer, results):
+    with failed_lock:
+        writer.writerows(results)
+
+
+def process_from_local_json(publication, args, writer, failed_writer, run, member_map=None):
     doi = publication['doi']
     safe_filename = doi.replace('/', '_') + '.json'
     file_path = os.path.join(args.json_dir, safe_filename)
     try:
         if os.path.exists(file_path):
-            with open(file_path, 'r', encoding='utf-8') as f:
-                crossref_data = json.load(f)
-                result, success = process_publication_data(
-                    publication, crossref_data, args.output_dir, args, member_map)
-                if success:
-                    write_result(writer, result)
-                    return True
-                else:
-                    write_failed_entry(failed_writer, result)
-                    return False
+            with open(file_path, 'rb') as f:
+                with run.stage('read_json') as stage:
+                    crossref_data = fast_json.loads_crossref_work(f.read())
+                    stage.add(rows=1, bytes=f.tell())
+                with run.stage('process'):
+                    results, success = process_publication_data(
+                        publication, crossref_data, args.output_dir, args, member_map)
+                with run.stage('write') as stage:
+                    if success:
+                        write_results(writer, results)
+                    else:
+                        write_failed_entries(failed_writer, results)
+                    stage.add(rows=len(results))
+                return success
         else:
             error_msg = f"JSON file not found: {file_path}"
             log_error(args.log_file, doi, error_msg)
@@ -310,8 +419,9 @@ class RateLimiter:
 
 
 class RequestManager:
-    def __init__(self, args, writer, failed_writer, member_map=None):
+    def __init__(self, args, writer, failed_writer, run, member_map=None):
         self.args = args
+        self.run = run
         self.writer = writer
         self.failed_writer = failed_writer
         self.output_dir = args.output_dir
@@ -375,19 +485,25 @@ class RequestManager:
             headers['Crossref-Plus-API-Token'] = self.args.token
         self.request_semaphore.acquire()
         try:
-            self.rate_limiter.wait()
+            with self.run.stage('rate_limit_wait'):
+                self.rate_limiter.wait()
             print(f"Processing DOI: {doi}")
-            crossref_data, error_msg = fetch_from_crossref(
-                doi, headers, json_dir=self.args.json_dir)
+            with self.run.stage('crossref_request') as stage:
+                crossref_data, error_msg = fetch_from_crossref(
+                    doi, headers, json_dir=self.args.json_dir)
+                stage.add(rows=1)
             if crossref_data:
-                result, success = process_publication_data(
-                    publication, crossref_data, self.output_dir, self.args, self.member_map)
+                with self.run.stage('process'):
+                    results, success = process_publication_data(
+                        publication, crossref_data, self.output_dir, self.args, self.member_map)
                 with self.processed_dois_lock:
                     self.processed_dois.add(doi)
-                if success:
-                    write_result(self.writer, result)
-                else:
-                    write_failed_entry(self.failed_writer, result)
+                with self.run.stage('write') as stage:
+                    if success:
+                        write_results(self.writer, results)
+                    else:
+                        write_failed_entries(self.failed_writer, results)
+                    stage.add(rows=len(results))
                 with self.counter_lock:
                     self.processed_count += 1
                     if success:
@@ -468,22 +584,28 @@ class RequestManager:
             time.sleep(wait_time)
         self.request_semaphore.acquire()
         try:
-            self.rate_limiter.wait()
+            with self.run.stage('rate_limit_wait'):
+                self.rate_limiter.wait()
             print(f"Retrying DOI: {doi} (Attempt {retry_count}/{self.max_retries})")
             headers = {'User-Agent': self.args.user_agent}
             if self.args.token:
                 headers['Crossref-Plus-API-Token'] = self.args.token
-            crossref_data, error_msg = fetch_from_crossref(
-                doi, headers, json_dir=self.args.json_dir)
+            with self.run.stage('crossref_retry_request') as stage:
+                crossref_data, error_msg = fetch_from_crossref(
+                    doi, headers, json_dir=self.args.json_dir)
+                stage.add(rows=1)
             if crossref_data:
                 with self.processed_dois_lock:
                     self.processed_dois.add(doi)
-                result, success = process_publication_data(
-                    publication, crossref_data, self.output_dir, self.args, self.member_map)
-                if success:
-                    write_result(self.writer, result)
-                else:
-                    write_failed_entry(self.failed_writer, result)
+                with self.run.stage('process'):
+                    results, success = process_publication_data(
+                        publication, crossref_data, self.output_dir, self.args, self.member_map)
+                with self.run.stage('write') as stage:
+                    if success:
+                        write_results(self.writer, results)
+                    else:
+                        write_failed_entries(self.failed_writer, results)
+                    stage.add(rows=len(results))
                 with self.counter_lock:
                     self.processed_count += 1
                     if success:
@@ -524,8 +646,8 @@ def load_member_map(members_file):
     if not members_file or not os.path.exists(members_file):
         return None
     try:
-        with open(members_file, 'r', encoding='utf-8') as f:
-            members_data = json.load(f)
+        with open(members_file, 'rb') as f:
+            members_data = fast_json.loads_members(f.read())
         member_map = {}
         for member in members_data:
             if 'id' in member and 'name' in member:
@@ -537,15 +659,34 @@ def load_member_map(members_file):
         return None
 
 
+def read_csv_header(file_path):
+    """Return the header row of a CSV file, or None if the file is empty."""
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        return next(csv.reader(f), None)
+
+
 def main():
     args = parse_arguments()
+    run = start_run('get_crossref_funding_metadata', args)
+    try:
+        fast_json.set_decoder(args.json_decoder)
+    except ValueError as e:
+        print(f"Error: {e}")
+        run.mark_failed("json decoder not installed")
+        sys.exit(1)
     if not os.path.exists(args.output_dir):
         os.makedirs(args.output_dir)
     member_map = load_member_map(args.members_file)
     if args.members_file and not member_map:
         print(f"Warning: Failed to load members file {args.members_file}")
-    file_exists = os.path.exists(args.results)
-    failed_exists = os.path.exists(args.failed_output)
+    if args.funders:
+        try:
+            args.funders = load_funders(args.funders)
+        except Exception as e:
+            print(f"Error loading funders file: {str(e)}")
+            run.mark_failed("could not load funders file")
+            sys.exit(1)
+        print(f"Checking {len(args.funders)} funders: {', '.join(f['name'] for f in args.funders)}")
     with open(args.input, 'r', encoding='utf-8') as f_in:
         reader = csv.DictReader(f_in)
         fieldnames = list(reader.fieldnames) + [
@@ -553,7 +694,22 @@ def main():
             'funder_dois', 'doi_asserted_by', 'has_anr_funder_doi',
             'anr_code_in_awards', 'anr_name_in_funders', 'created_year', 'error'
         ]
-        publications = list(reader)
+        if args.funders:
+            fieldnames.append('funder_id')
+        # An input that already has a funder_id column (or other result
+        # columns) keeps a single copy of each.
+        fieldnames = list(dict.fromkeys(fieldnames))
+        file_exists = os.path.exists(args.results) and read_csv_header(args.results) is not None
+        failed_exists = os.path.exists(args.failed_output) and read_csv_header(args.failed_output) is not None
+        for exists, file_path in ((file_exists, args.results), (failed_exists, args.failed_output)):
+            if exists and read_csv_header(file_path) != fieldnames:
+                print(f"Error: {file_path} has different columns than this run would write; "
+                      f"use another output file or remove it")
+                run.mark_failed("existing output has different columns")
+                sys.exit(1)
+        with run.stage('read_input') as stage:
+            publications = list(reader)
+            stage.add(rows=len(publications), bytes=os.path.getsize(args.input))
         with open(args.results, 'a' if file_exists else 'w', encoding='utf-8', newline='') as f_out, \
                 open(args.failed_output, 'a' if failed_exists else 'w', encoding='utf-8', newline='') as f_failed:
             writer = csv.DictWriter(f_out, fieldnames=fieldnames)
@@ -570,7 +726,7 @@ def main():
                     futures = []
                     for publication in publications:
                         future = executor.submit(
-                            process_from_local_json, publication, args, writer, failed_writer, member_map
+                            process_from_local_json, publication, args, writer, failed_writer, run, member_map
                         )
                         futures.append(future)
                     for i, future in enumerate(concurrent.futures.as_completed(futures)):
@@ -597,7 +753,7 @@ def main():
                 print(f"Error log saved to: {args.log_file}")
             else:
                 manager = RequestManager(
-                    args, writer, failed_writer, member_map)
+                    args, writer, failed_writer, run, member_map)
                 manager.start_retry_workers(max(1, args.workers // 2))
                 workers = args.workers if args.token else 1
                 max_concurrent = 3 if args.token else 1
@@ -660,4 +816,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    run_main(main)
@@ -0,0 +1,371 @@
+import os
+import csv
+import sys
+import json
+import time
+import gzip
+import zlib
+import heapq
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils', 'instrumentation'))
+from instrumentation import add_instrumentation_arguments, start_run, run_main
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils', 'fast_json'))
+import fast_json
+
+INDEX_FORMAT = 'osm-doi-index'
+INDEX_VERSION = 1
+DEFAULT_BLOCK_SIZE_KB = 256
+DEFAULT_SORT_CHUNK = 1000000
+# Lines are binary searched until the remaining range is this small, then
+# scanned.
+SCAN_THRESHOLD = 4096
+READ_SIZE = 64 * 1024
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Build a DOI index over a gzipped OSM JSONL file, or fetch records through one.')
+    parser.add_argument('-x', '--index-file', required=True,
+                        help='Index file to build (with -i) or to look DOIs up in')
+    parser.add_argument('-i', '--input-file',
+                        help='Gzipped OSM JSONL file to index')
+    parser.add_argument('-b', '--blocked-file',
+                        help='Blocked gzip copy of the input written while indexing, which records are read '
+                             'from (default: <input>.blocked.jsonl.gz)')
+    parser.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE_KB,
+                        help=f'Uncompressed kilobytes per gzip block of the copy; smaller blocks make lookups '
+                             f'faster and the copy larger (default: {DEFAULT_BLOCK_SIZE_KB})')
+    parser.add_argument('--sort-chunk', type=int, default=DEFAULT_SORT_CHUNK,
+                        help=f'Index entries sorted in memory at a time; larger inputs are sorted externally '
+                             f'in runs of this size (default: {DEFAULT_SORT_CHUNK})')
+    parser.add_argument('-t', '--temp-dir',
+                        help='Directory for the external sort runs (default: system temp directory)')
+    parser.add_argument('-l', '--lookup', nargs='+', metavar='DOI',
+                        help='Print the records of these DOIs as JSON lines')
+    parser.add_argument('-f', '--lookup-file',
+                        help="CSV file with a 'doi' column whose records to fetch")
+    parser.add_argument('-o', '--output-file',
+                        help='Write fetched records to this JSONL file instead of stdout')
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    if bool(args.input_file) == bool(args.lookup or args.lookup_file):
+        parser.error('Give either -i to build an index or --lookup/--lookup-file to use one')
+    if args.block_size < 1 or args.sort_chunk < 1:
+        parser.error('--block-size and --sort-chunk must be at least 1')
+    return args
+
+
+def normalize_doi(doi):
+    """Index key of a DOI, or None if it cannot be indexed."""
+    if not isinstance(doi, str):
+        return None
+    doi = doi.strip().lower()
+    if not doi or '\t' in doi or '\n' in doi or '\r' in doi:
+        return None
+    return doi.encode('utf-8')
+
+
+def default_blocked_path(input_file):
+    base = input_file[:-3] if input_file.endswith('.gz') else input_file
+    base = base[:-6] if base.endswith('.jsonl') else base
+    return f"{base}.blocked.jsonl.gz"
+
+
+class BlockWriter:
+    """Write lines to a gzip file as a series of independent gzip members of
+    about `block_size` uncompressed bytes, each starting on a line boundary.
+    The result is a regular (multi-member) gzip file whose members can be
+    decompressed on their own: they are the index checkpoints."""
+
+    def __init__(self, path, block_size):
+        self.file = open(path, 'wb')
+        self.block_size = block_size
+        self.buffer = []
+        self.buffered = 0
+        self.block_offset = 0
+        self.blocks = 0
+
+    def add(self, line):
+        """Buffer a line and return its (block offset, offset in block)."""
+        if self.buffered >= self.block_size:
+            self.flush()
+        position = (self.block_offset, self.buffered)
+        self.buffer.append(line)
+        self.buffered += len(line)
+        return position
+
+    def flush(self):
+        if not self.buffer:
+            return
+        member = gzip.compress(b''.join(self.buffer), mtime=0)
+        self.file.write(member)
+        self.block_offset += len(member)
+        self.blocks += 1
+        self.buffer = []
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def write_run(entries, temp_dir):
+    entries.sort()
+    fd, run_path = tempfile.mkstemp(suffix='.idx', prefix='osm_index_run_', dir=temp_dir)
+    with os.fdopen(fd, 'wb') as f:
+        for entry in entries:
+            f.write(format_entry(*entry))
+    return run_path
+
+
+def format_entry(key, block_offset, line_offset, length):
+    return b'%s\t%d\t%d\t%d\n' % (key, block_offset, line_offset, length)
+
+
+def parse_entry(line):
+    key, block_offset, line_offset, length = line.rstrip(b'\n').split(b'\t')
+    return key, int(block_offset), int(line_offset), int(length)
+
+
+def iter_run(run_path):
+    with open(run_path, 'rb') as f:
+        for line in f:
+            yield parse_entry(line)
+
+
+def build_index(input_file, index_file, blocked_file, block_size, sort_chunk, temp_dir, run):
+    """Copy the input into a blocked gzip file in one pass, noting where each
+    DOI's line lands, then write the entries sorted by DOI to the index."""
+    entries = []
+    run_paths = []
+    line_count = 0
+    indexed = 0
+    blocks = BlockWriter(blocked_file, block_size)
+    try:
+        with run.stage('scan') as stage:
+            with gzip.open(input_file, 'rb') as infile:
+                for line in infile:
+                    line_count += 1
+                    if line_count % 100000 == 0:
+                        print(f"Indexed {indexed} DOIs in {line_count} lines...")
+                    block_offset, line_offset = blocks.add(line)
+                    try:
+                        record = fast_json.loads(line)
+                    except ValueError:
+                        continue
+                    key = normalize_doi(record.get('doi')) if isinstance(record, dict) else None
+                    if key is None:
+                        continue
+                    entries.append((key, block_offset, line_offset, len(line)))
+                    indexed += 1
+                    if len(entries) >= sort_chunk:
+                        run_paths.append(write_run(entries, temp_dir))
+                        entries = []
+            blocks.close()
+            stage.add(rows=line_count, bytes=os.path.getsize(input_file))
+
+        with run.stage('sort') as stage:
+            header = {
+                'format': INDEX_FORMAT,
+                'version': INDEX_VERSION,
+                'blocked_file': os.path.relpath(os.path.abspath(blocked_file),
+                                                os.path.dirname(os.path.abspath(index_file))),
+                'blocked_file_size': os.path.getsize(blocked_file),
+                'source_file': os.path.abspath(input_file),
+                'block_size': block_size,
+                'blocks': blocks.blocks,
+                'entries': indexed
+            }
+            entries.sort()
+            if run_paths:
+                if entries:
+                    run_paths.append(write_run(entries, temp_dir))
+                sorted_entries = heapq.merge(*(iter_run(path) for path in run_paths))
+            else:
+                sorted_entries = entries
+            with open(index_file, 'wb') as f:
+                f.write(b'#' + json.dumps(header, sort_keys=True).encode('utf-8') + b'\n')
+                for entry in sorted_entries:
+                    f.write(format_entry(*entry))
+            stage.add(rows=indexed)
+    finally:
+        for path in run_paths:
+            os.remove(path)
+    print(f"Indexed {indexed} DOIs from {line_count} lines into {index_file}")
+    print(f"Blocked copy with {blocks.blocks} blocks written to {blocked_file}")
+    return indexed
+
+
+class OsmIndex:
+    """Look DOIs up in an index built by this script and read their records
+    from the blocked copy, decompressing only the block holding each one.
+
+        with OsmIndex('osm.index') as index:
+            records = index.get('10.1234/abc')
+    """
+
+    def __init__(self, index_file):
+        self.index = open(index_file, 'rb')
+        header_line = self.index.readline()
+        try:
+            header = json.loads(header_line[1:]) if header_line.startswith(b'#') else {}
+        except ValueError:
+            header = {}
+        if header.get('format') != INDEX_FORMAT or header.get('version') != INDEX_VERSION:
+            self.index.close()
+            raise ValueError(f"{index_file} is not an {INDEX_FORMAT} file of version {INDEX_VERSION}")
+        self.header = header
+        self.data_start = len(header_line)
+        self.index_size = os.fstat(self.index.fileno()).st_size
+        blocked_file = os.path.join(os.path.dirname(os.path.abspath(index_file)), header['blocked_file'])
+        self.blocked = open(blocked_file, 'rb')
+        if os.fstat(self.blocked.fileno()).st_size != header['blocked_file_size']:
+            self.close()
+            raise ValueError(f"{blocked_file} has changed since {index_file} was built")
+        self.cached_block = (None, b'')
+
+    def lookup(self, doi):
+        """Return the (block offset, offset in block, length) of every line
+        of this DOI, in file order."""
+        key = normalize_doi(doi)
+        if key is None:
+            return []
+        f = self.index
+        lo, hi = self.data_start, self.index_size
+        # Invariant: the first line with a key >= `key` starts after `lo`
+        # (or at data_start).
+        while hi - lo > SCAN_THRESHOLD:
+            mid = (lo + hi) // 2
+            f.seek(mid)
+            f.readline()
+            line = f.readline()
+            if not line or line.split(b'\t', 1)[0] >= key:
+                hi = mid
+            else:
+                lo = mid
+        f.seek(lo)
+        if lo != self.data_start:
+            f.readline()
+        positions = []
+        for line in f:
+            line_key, block_offset, line_offset, length = parse_entry(line)
+            if line_key > key:
+                break
+            if line_key == key:
+                positions.append((block_offset, line_offset, length))
+        return sorted(positions)
+
+    def read_block(self, block_offset, size):
+        """Decompress at least `size` bytes of the block at `block_offset`."""
+        cached_offset, data = self.cached_block
+        if cached_offset == block_offset and len(data) >= size:
+            return data
+        self.blocked.seek(block_offset)
+        decompressor = zlib.decompressobj(wbits=31)
+        parts = []
+        total = 0
+        while total < size and not decompressor.eof:
+            compressed = decompressor.unconsumed_tail or self.blocked.read(READ_SIZE)
+            if not compressed:
+                break
+            part = decompressor.decompress(compressed, size - total)
+            parts.append(part)
+            total += len(part)
+        data = b''.join(parts)
+        self.cached_block = (block_offset, data)
+        return data
+
+    def read_line(self, block_offset, line_offset, length):
+        data = self.read_block(block_offset, line_offset + length)
+        return data[line_offset:line_offset + length]
+
+    def get(self, doi):
+        """Return the decoded records of a DOI (empty if it is not indexed)."""
+        return [fast_json.loads(self.read_line(*position)) for position in self.lookup(doi)]
+
+    def close(self):
+        self.index.close()
+        if getattr(self, 'blocked', None) is not None:
+            self.blocked.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_lookup_file(lookup_file):
+    with open(lookup_file, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.DictReader(f)
+        if 'doi' not in (reader.fieldnames or []):
+            raise ValueError(f"'doi' column not found in {lookup_file}")
+        return [row['doi'] for row in reader if row['doi']]
+
+
+def fetch_records(index_file, dois, output_file, run):
+    found = 0
+    missing = 0
+    start = time.perf_counter()
+    out = open(output_file, 'wb') if output_file else sys.stdout.buffer
+    try:
+        with OsmIndex(index_file) as index, run.stage('lookup') as stage:
+            for doi in dois:
+                positions = index.lookup(doi)
+                if not positions:
+                    missing += 1
+                    print(f"DOI not found: {doi}", file=sys.stderr)
+                    continue
+                for position in positions:
+                    line = index.read_line(*position)
+                    out.write(line if line.endswith(b'\n') else line + b'\n')
+                    found += 1
+            stage.add(rows=len(dois))
+    finally:
+        if output_file:
+            out.close()
+        else:
+            out.flush()
+    elapsed = time.perf_counter() - start
+    print(f"Fetched {found} records for {len(dois) - missing}/{len(dois)} DOIs in {elapsed * 1000:.1f} ms",
+          file=sys.stderr)
+    return found
+
+
+def main():
+    args = parse_arguments()
+    run = start_run('index_osm_file', args)
+    if args.input_file:
+        blocked_file = args.blocked_file or default_blocked_path(args.input_file)
+        if os.path.abspath(blocked_file) == os.path.abspath(args.input_file):
+            print("The blocked copy cannot overwrite the input file", file=sys.stderr)
+            run.mark_failed("invalid arguments")
+            sys.exit(1)
+        try:
+            build_index(args.input_file, args.index_file, blocked_file, args.block_size * 1024,
+                        args.sort_chunk, args.temp_dir, run)
+        except FileNotFoundError:
+            print(f"Error: Input file not found at {args.input_file}", file=sys.stderr)
+            run.mark_failed("input file not found")
+            sys.exit(1)
+        except gzip.BadGzipFile:
+            print(f"Error: Input file {args.input_file} is not a valid gzip file.", file=sys.stderr)
+            run.mark_failed("invalid gzip input")
+            sys.exit(1)
+        return
+
+    dois = list(args.lookup or [])
+    try:
+        if args.lookup_file:
+            dois += read_lookup_file(args.lookup_file)
+        fetch_records(args.index_file, dois, args.output_file, run)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        run.mark_failed("lookup error")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run_main(main)
@@ -1,9 +1,39 @@
+import os
 import csv
 import sys
 import json
+import io
 import gzip
 import argparse
-from collections import OrderedDict
+import shutil
+import tempfile
+import subprocess
+from itertools import islice
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils', 'instrumentation'))
+from instrumentation import add_instrumentation_arguments, start_run, run_main
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils', 'fast_json'))
+import fast_json
+
+OUTPUT_FORMATS = ('csv', 'jsonl', 'parquet')
+PARQUET_BATCH_ROWS = 100000
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+DECOMPRESSORS = ('auto', 'gzip', 'isal', 'igzip', 'pigz')
+# External decompressors, run in their own process and read from a pipe.
+DECOMPRESSOR_COMMANDS = {
+    'igzip': ['igzip', '-dc'],
+    'pigz': ['pigz', '-dc'],
+}
+# Agency names and grantid prefixes of the funders --funder knows by name;
+# any other name matches that agency and grantids starting with '<name>-'.
+KNOWN_FUNDERS = {
+    'ANR': {
+        'agencies': ['ANR', 'Agence Nationale de la Recherche', 'French National Research Agency'],
+        'grantid_prefixes': ['ANR-']
+    }
+}
 
 def parse_arguments():
     parser = argparse.ArgumentParser(
@@ -17,11 +47,54 @@ def parse_arguments():
     parser.add_argument(
         "-o", "--output-file",
         required=True,
-        help="Path to the output CSV file"
+        help="Path to the output file (CSV, JSONL or Parquet; see --format)"
+    )
+    parser.add_argument(
+        "-f", "--format",
+        choices=OUTPUT_FORMATS,
+        help="Output format (default: from the output file extension, .jsonl/.jsonl.gz for JSONL, "
+             ".parquet for Parquet, CSV otherwise)"
+    )
+    parser.add_argument(
+        "--two-pass",
+        action="store_true",
+        help="Scan the input twice (once for the CSV header, once for the rows) instead of spooling rows "
+             "to a temporary file; needs no extra disk space"
+    )
+    parser.add_argument(
+        "-t", "--temp-dir",
+        help="Directory for the single-pass spool file (default: system temp directory)"
+    )
+    parser.add_argument(
+        "-w", "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Worker processes parsing the input in single-pass mode (default: number of CPUs)"
+    )
+    parser.add_argument(
+        "-c", "--chunk-size",
+        type=float,
+        default=DEFAULT_CHUNK_SIZE / (1024 * 1024),
+        help="Megabytes of decompressed input handed to a worker at a time (default: 8)"
     )
+    parser.add_argument(
+        "-d", "--decompressor",
+        choices=DECOMPRESSORS,
+        default='auto',
+        help="gzip decompression: the python-isal module, the igzip or pigz command, or the standard "
+             "library; 'auto' picks the first one available in that order (default: auto)"
+    )
+    parser.add_argument(
+        "--funder",
+        action="append",
+        help="Only write grants of this funder (e.g. ANR), matched on the grant's agency or grantid "
+             "prefix; lines not mentioning it are skipped before JSON decoding. Can be repeated"
+    )
+    fast_json.add_json_decoder_argument(parser)
+    add_instrumentation_arguments(parser)
     return parser.parse_args()
 
-def determine_headers(input_file):
+def determine_headers(input_file, stage=None, grant_filter=None):
     print("Starting Pass 1: Determining all grant fields...")
     grant_keys = set()
     line_count = 0
@@ -29,13 +102,16 @@ def determine_headers(input_file):
         with gzip.open(input_file, 'rt', encoding='utf-8') as infile:
             for line in infile:
                 line_count += 1
+                if grant_filter is not None and not grant_filter.accepts_line(line):
+                    continue
                 try:
-                    record = json.loads(line)
+                    record = fast_json.loads(line)
                     grants = record.get('grants')
                     if isinstance(grants, list):
                         for grant_dict in grants:
                             if isinstance(grant_dict, dict):
-                                grant_keys.update(grant_dict.keys())
+                                if grant_filter is None or grant_filter.matches_grant(grant_dict):
+                                    grant_keys.update(grant_dict.keys())
                 except json.JSONDecodeError:
                     continue
 
@@ -52,12 +128,96 @@ def determine_headers(input_file):
         print(f"An unexpected error occurred during Pass 1 at line {line_count}: {e}", file=sys.stderr)
         return None
 
+    if stage is not None:
+        stage.add(rows=line_count, bytes=os.path.getsize(input_file))
     sorted_grant_keys = sorted(list(grant_keys))
     final_headers = ['doi'] + sorted_grant_keys
     print(f"Pass 1 Complete: Found {len(grant_keys)} unique grant fields.")
     return final_headers
 
-def process_and_write_data(input_file, output_file, headers):
+class GrantFilter:
+    """Keep the grants of some funders. A grant row matches when its agency
+    is one of the funders' names (ignoring case) or its grantid starts with
+    one of their prefixes.
+
+    accepts_line() is a cheap prefilter on the raw JSON line: a line that
+    contains none of the names or prefixes (ignoring ASCII case) cannot
+    hold a matching grant and need not be decoded. Names with non-ASCII
+    characters may be escaped or differently cased in the raw line, so they
+    turn the prefilter off.
+    """
+
+    def __init__(self, funders):
+        agencies = set()
+        prefixes = set()
+        for funder in funders:
+            known = KNOWN_FUNDERS.get(funder.upper(), {'agencies': [funder], 'grantid_prefixes': [f"{funder}-"]})
+            agencies.update(name.casefold() for name in known['agencies'])
+            prefixes.update(prefix.upper() for prefix in known['grantid_prefixes'])
+        self.agencies = agencies
+        self.prefixes = tuple(prefixes)
+        needles = agencies | {prefix.lower() for prefix in prefixes}
+        if all(needle.isascii() for needle in needles):
+            self.text_needles = tuple(needles)
+            self.byte_needles = tuple(needle.encode('ascii') for needle in needles)
+        else:
+            self.text_needles = self.byte_needles = None
+
+    def accepts_line(self, line):
+        needles = self.byte_needles if isinstance(line, bytes) else self.text_needles
+        if needles is None:
+            return True
+        line = line.lower()
+        return any(needle in line for needle in needles)
+
+    def matches(self, grant_dict, grant_id):
+        agency = grant_dict.get('agency')
+        if isinstance(agency, str) and agency.strip().casefold() in self.agencies:
+            return True
+        return isinstance(grant_id, str) and grant_id.strip().upper().startswith(self.prefixes)
+
+    def matches_grant(self, grant_dict):
+        """Whether any row of the grant matches, after splitting its grantid."""
+        grant_id_value = grant_dict.get('grantid')
+        if isinstance(grant_id_value, str) and ';' in grant_id_value:
+            return any(self.matches(grant_dict, individual_id) for individual_id in grant_id_value.split(';')
+                       if individual_id.strip())
+        return self.matches(grant_dict, grant_id_value)
+
+
+def explode_grants(record, grant_filter=None):
+    """Yield one output row per grant of a record, with ';'-separated
+    grantids split into one row each. With a GrantFilter, only matching
+    rows are yielded."""
+    doi = record.get('doi')
+    grants = record.get('grants')
+
+    if not doi:
+        return
+
+    if not isinstance(grants, list):
+        return
+
+    for grant_dict in grants:
+        if isinstance(grant_dict, dict):
+            grant_id_value = grant_dict.get('grantid')
+            if isinstance(grant_id_value, str) and ';' in grant_id_value:
+                split_ids = grant_id_value.split(';')
+                for individual_id in split_ids:
+                    cleaned_id = individual_id.strip()
+                    if cleaned_id and (grant_filter is None or grant_filter.matches(grant_dict, cleaned_id)):
+                        split_grant_data = grant_dict.copy()
+                        split_grant_data['grantid'] = cleaned_id
+                        row_data = {'doi': doi}
+                        row_data.update(split_grant_data)
+                        yield row_data
+            elif grant_filter is None or grant_filter.matches(grant_dict, grant_id_value):
+                row_data = {'doi': doi}
+                row_data.update(grant_dict)
+                yield row_data
+
+
+def process_and_write_data(input_file, output_file, headers, stage=None, grant_filter=None):
     print("Starting Pass 2: Processing data and writing CSV...")
     line_count = 0
     rows_written = 0
@@ -71,40 +231,19 @@ def process_and_write_data(input_file, output_file, headers):
 
             for line in infile:
                 line_count += 1
+                if grant_filter is not None and not grant_filter.accepts_line(line):
+                    if line_count % 1000 == 0:
+                        print(f"Pass 2: Processed {line_count} lines, written {rows_written} grant records...")
+                    continue
                 try:
-                    record = json.loads(line)
+                    record = fast_json.loads(line)
                 except json.JSONDecodeError as e:
                     print(f"Warning (Pass 2): Skipping line {line_count} due to JSON decode error: {e}", file=sys.stderr)
                     continue
 
-                doi = record.get('doi')
-                grants = record.get('grants')
-
-                if not doi:
-                    continue
-
-                if not isinstance(grants, list):
-                    continue
-
-                for grant_dict in grants:
-                    if isinstance(grant_dict, dict):
-                        grant_id_value = grant_dict.get('grantid')
-                        if isinstance(grant_id_value, str) and ';' in grant_id_value:
-                            split_ids = grant_id_value.split(';')
-                            for individual_id in split_ids:
-                                cleaned_id = individual_id.strip()
-                                if cleaned_id:
-                                    split_grant_data = grant_dict.copy()
-                                    split_grant_data['grantid'] = cleaned_id
-                                    row_data = {'doi': doi}
-                                    row_data.update(split_grant_data)
-                                    writer.writerow(row_data)
-                                    rows_written += 1
-                        else:
-                            row_data = {'doi': doi}
-                            row_data.update(grant_dict)
-                            writer.writerow(row_data)
-                            rows_written += 1
+                for row_data in explode_grants(record, grant_filter):
+                    writer.writerow(row_data)
+                    rows_written += 1
 
                 if line_count % 1000 == 0:
                      print(f"Pass 2: Processed {line_count} lines, written {rows_written} grant records...")
@@ -120,15 +259,374 @@ def process_and_write_data(input_file, output_file, headers):
     except Exception as e:
         print(f"An unexpected error occurred during Pass 2 at line {line_count}: {e}", file=sys.stderr)
 
+    if stage is not None:
+        stage.add(rows=line_count, bytes=os.path.getsize(input_file))
     print(f"Pass 2 Complete: Processed {line_count} lines. Total grant records written: {rows_written}.")
 
 
+def infer_format(output_file):
+    lower = output_file.lower()
+    if lower.endswith(('.jsonl', '.jsonl.gz', '.ndjson', '.ndjson.gz')):
+        return 'jsonl'
+    if lower.endswith('.parquet'):
+        return 'parquet'
+    return 'csv'
+
+
+def open_output(output_file):
+    if output_file.lower().endswith('.gz'):
+        return gzip.open(output_file, 'wt', encoding='utf-8')
+    return open(output_file, 'w', encoding='utf-8')
+
+
+class CommandReader:
+    """Binary reader over the stdout of an external decompressor."""
+
+    def __init__(self, command, input_file):
+        if not os.path.isfile(input_file):
+            raise FileNotFoundError(input_file)
+        self.input_file = input_file
+        self.process = subprocess.Popen(command + [input_file], stdout=subprocess.PIPE)
+
+    def read(self, size=-1):
+        return self.process.stdout.read(size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.process.kill()
+        self.process.stdout.close()
+        returncode = self.process.wait()
+        if exc_type is None and returncode != 0:
+            raise gzip.BadGzipFile(f"decompressor exited with status {returncode}")
+
+
+def resolve_decompressor(decompressor):
+    """Return the decompressor to use for 'auto', or None if the requested one
+    is not available."""
+    if decompressor == 'auto':
+        for candidate in ('isal', 'igzip', 'pigz'):
+            if resolve_decompressor(candidate):
+                return candidate
+        return 'gzip'
+    if decompressor == 'isal':
+        try:
+            from isal import igzip
+        except ImportError:
+            return None
+        return decompressor
+    if decompressor in DECOMPRESSOR_COMMANDS:
+        return decompressor if shutil.which(DECOMPRESSOR_COMMANDS[decompressor][0]) else None
+    return decompressor
+
+
+def open_input(input_file, decompressor='gzip'):
+    if decompressor in DECOMPRESSOR_COMMANDS:
+        return CommandReader(DECOMPRESSOR_COMMANDS[decompressor], input_file)
+    if decompressor == 'isal':
+        from isal import igzip
+        return igzip.open(input_file, 'rb')
+    return gzip.open(input_file, 'rb')
+
+
+def iter_chunks(input_file, chunk_size, decompressor='gzip'):
+    """Yield the decompressed input in blocks of about `chunk_size` bytes that
+    end on a line boundary, with the number of lines in each."""
+    with open_input(input_file, decompressor) as infile:
+        remainder = b''
+        while True:
+            block = infile.read(chunk_size)
+            if not block:
+                break
+            block = remainder + block
+            cut = block.rfind(b'\n') + 1
+            if cut == 0:
+                remainder = block
+                continue
+            remainder = block[cut:]
+            yield block[:cut], block.count(b'\n', 0, cut)
+        if remainder:
+            yield remainder, 1
+
+
+def explode_chunk(chunk, first_line, output_format, grant_filter=None):
+    """Parse and explode one block of input lines (run in a worker process).
+
+    Returns (grant_keys, columns, text, rows, warnings). grant_keys are the
+    grant fields of every record in the block, including those without a
+    DOI, in the order first seen. For JSONL, text holds the rows as JSON
+    lines; otherwise it holds them as CSV with the values in `columns`
+    order, i.e. 'doi' followed by the block's grant fields. With a
+    GrantFilter, lines failing its prefilter are not decoded and only
+    matching grants count.
+    """
+    grant_keys = {}
+    columns = {'doi': 0}
+    rows = 0
+    warnings = []
+    out = io.StringIO()
+    writer = csv.writer(out)
+    lines = chunk.split(b'\n')
+    if chunk.endswith(b'\n'):
+        lines.pop()
+    for line_number, line in enumerate(lines, first_line):
+        if grant_filter is not None and not grant_filter.accepts_line(line):
+            continue
+        try:
+            record = fast_json.loads(line)
+        except ValueError as e:
+            warnings.append(f"Warning: Skipping line {line_number} due to JSON decode error: {e}")
+            continue
+        if not isinstance(record, dict):
+            continue
+
+        grants = record.get('grants')
+        if isinstance(grants, list):
+            for grant_dict in grants:
+                if isinstance(grant_dict, dict):
+                    if grant_filter is not None and not grant_filter.matches_grant(grant_dict):
+                        continue
+                    for key in grant_dict:
+                        if key not in grant_keys:
+                            grant_keys[key] = None
+                            columns.setdefault(key, len(columns))
+
+        for row_data in explode_grants(record, grant_filter):
+            if output_format == 'jsonl':
+                out.write(json.dumps(row_data, ensure_ascii=False))
+                out.write('\n')
+            else:
+                values = [''] * len(columns)
+                for key, value in row_data.items():
+                    values[columns[key]] = '' if value is None else value
+                writer.writerow(values)
+            rows += 1
+    return list(grant_keys), list(columns), out.getvalue(), rows, warnings
+
+
+def iter_exploded_chunks(input_file, output_format, workers=1, chunk_size=DEFAULT_CHUNK_SIZE,
+                         decompressor='gzip', stage=None, grant_filter=None):
+    """Yield explode_chunk results in input order. One reader decompresses
+    and cuts the input into blocks; with more than one worker the blocks are
+    parsed by a process pool, from a bounded window of in-flight blocks."""
+    line_count = 0
+    chunks = iter_chunks(input_file, chunk_size, decompressor)
+
+    def report(result, lines):
+        nonlocal line_count
+        for warning in result[4]:
+            print(warning, file=sys.stderr)
+        previous = line_count
+        line_count += lines
+        if line_count // 10000 > previous // 10000:
+            print(f"Processed {line_count} lines...")
+        return result
+
+    if workers <= 1:
+        for chunk, lines in chunks:
+            yield report(explode_chunk(chunk, line_count + 1, output_format, grant_filter), lines)
+    else:
+        pending = deque()
+        next_line = 1
+        with ProcessPoolExecutor(max_workers=workers, initializer=fast_json.set_decoder,
+                                 initargs=(fast_json.decoder.name,)) as executor:
+            try:
+                while True:
+                    while len(pending) < workers * 2:
+                        item = next(chunks, None)
+                        if item is None:
+                            break
+                        chunk, lines = item
+                        pending.append((executor.submit(explode_chunk, chunk, next_line, output_format,
+                                                                grant_filter), lines))
+                        next_line += lines
+                    if not pending:
+                        break
+                    future, lines = pending.popleft()
+                    yield report(future.result(), lines)
+            finally:
+                for future, _ in pending:
+                    future.cancel()
+
+    if stage is not None:
+        stage.add(rows=line_count, bytes=os.path.getsize(input_file))
+
+
+def write_jsonl(input_file, output_file, workers=1, chunk_size=DEFAULT_CHUNK_SIZE, decompressor='gzip',
+                stage=None, grant_filter=None):
+    """Single pass to JSONL: every row carries its own keys, so no header is
+    needed and grant values keep their JSON types."""
+    rows_written = 0
+    with open_output(output_file) as outfile:
+        for _, _, text, rows, _ in iter_exploded_chunks(input_file, 'jsonl', workers, chunk_size,
+                                                        decompressor, stage, grant_filter):
+            outfile.write(text)
+            rows_written += rows
+    print(f"Complete: Total grant records written: {rows_written}.")
+
+
+def spool_rows(input_file, spool, workers=1, chunk_size=DEFAULT_CHUNK_SIZE, decompressor='gzip', stage=None,
+               grant_filter=None):
+    """Single pass over the input: write every row to `spool` while
+    collecting the grant keys the way determine_headers does. Return the
+    keys and the spool segments as [row count, columns] pairs, since each
+    block's rows are spooled in that block's own column order."""
+    grant_keys = set()
+    segments = []
+    rows_written = 0
+    for keys, columns, text, rows, _ in iter_exploded_chunks(input_file, 'csv', workers, chunk_size,
+                                                             decompressor, stage, grant_filter):
+        grant_keys.update(keys)
+        if not rows:
+            continue
+        spool.write(text)
+        rows_written += rows
+        if segments and segments[-1][1] == columns:
+            segments[-1][0] += rows
+        else:
+            segments.append([rows, columns])
+    print(f"Spooled {rows_written} grant records with {len(grant_keys)} unique grant fields.")
+    return grant_keys, segments
+
+
+def iter_spooled_rows(spool, segments, headers):
+    """Read the spool back as value lists in `headers` order."""
+    spool.seek(0)
+    reader = csv.reader(spool)
+    for rows, columns in segments:
+        width = len(columns)
+        positions = {}
+        for i, column in enumerate(columns):
+            positions.setdefault(column, i)
+        indices = [positions.get(header, width) for header in headers]
+        for values in islice(reader, rows):
+            values += [''] * (width + 1 - len(values))
+            yield [values[i] for i in indices]
+
+
+def write_parquet(output_file, headers, rows):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    # A grant key named 'doi' would repeat the column name.
+    names = [name if name not in headers[:i] else f"{name}_{i}" for i, name in enumerate(headers)]
+    schema = pa.schema([(name, pa.string()) for name in names])
+    with pq.ParquetWriter(output_file, schema) as writer:
+        batch = []
+        for values in rows:
+            batch.append(values)
+            if len(batch) >= PARQUET_BATCH_ROWS:
+                writer.write_table(parquet_table(pa, schema, batch))
+                batch = []
+        writer.write_table(parquet_table(pa, schema, batch))
+
+
+def parquet_table(pa, schema, batch):
+    return pa.table([[values[i] or None for values in batch] for i in range(len(schema.names))], schema=schema)
+
+
+def process_single_pass(input_file, output_file, output_format, temp_dir=None, workers=1,
+                        chunk_size=DEFAULT_CHUNK_SIZE, decompressor='gzip', run=None, grant_filter=None):
+    """Decompress and parse the input once. Rows are spooled to a temporary
+    CSV while grant keys are collected; the final header (identical to the
+    two-pass one) is only known at the end, when the spool is copied to the
+    output with each segment's columns rearranged."""
+    with tempfile.TemporaryFile('w+', encoding='utf-8', newline='', dir=temp_dir,
+                                prefix='osm_spool_') as spool:
+        with run.stage('single_pass') as stage:
+            grant_keys, segments = spool_rows(input_file, spool, workers, chunk_size, decompressor, stage,
+                                                  grant_filter)
+
+        headers = ['doi'] + sorted(grant_keys)
+        if output_format == 'csv' and not grant_keys:
+            print("Warning: No grant fields found in the input file.")
+            with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
+                csv.DictWriter(csvfile, fieldnames=['doi']).writeheader()
+            print(f"Created empty CSV {output_file} with only 'doi' header as no grant fields were found.")
+            return
+
+        with run.stage('write_output') as stage:
+            rows = iter_spooled_rows(spool, segments, headers)
+            if output_format == 'parquet':
+                write_parquet(output_file, headers, rows)
+            else:
+                rows_written = 0
+                with open_output(output_file) as csvfile:
+                    writer = csv.writer(csvfile)
+                    writer.writerow(headers)
+                    for values in rows:
+                        writer.writerow(values)
+                        rows_written += 1
+                stage.add(rows=rows_written)
+    print(f"Complete: Output written to {output_file}.")
+
+
 def main():
     args = parse_arguments()
+    run = start_run('parse_funding_from_osm_file', args)
     input_file = args.input_file
     output_file = args.output_file
+    output_format = args.format or infer_format(output_file)
+
+    if output_format == 'parquet':
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            print("Writing Parquet output requires pyarrow: pip install pyarrow", file=sys.stderr)
+            run.mark_failed("pyarrow not installed")
+            sys.exit(1)
+
+    if args.workers < 1 or args.chunk_size <= 0:
+        print("--workers must be at least 1 and --chunk-size positive", file=sys.stderr)
+        run.mark_failed("invalid arguments")
+        sys.exit(1)
+    decompressor = resolve_decompressor(args.decompressor)
+    if decompressor is None:
+        print(f"Decompressor {args.decompressor} is not available", file=sys.stderr)
+        run.mark_failed("decompressor not available")
+        sys.exit(1)
+    chunk_size = max(int(args.chunk_size * 1024 * 1024), 1)
+    try:
+        json_decoder = fast_json.set_decoder(args.json_decoder)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        run.mark_failed("json decoder not installed")
+        sys.exit(1)
+    grant_filter = GrantFilter(args.funder) if args.funder else None
+    if grant_filter is not None:
+        print(f"Keeping grants with agency {', '.join(sorted(grant_filter.agencies))} "
+              f"or a grantid starting with {', '.join(sorted(grant_filter.prefixes))}")
+
+    if not args.two_pass:
+        print(f"Reading {input_file} with {decompressor} decompression, {json_decoder} JSON decoding "
+              f"and {args.workers} worker(s)")
+        try:
+            if output_format == 'jsonl':
+                with run.stage('single_pass') as stage:
+                    write_jsonl(input_file, output_file, args.workers, chunk_size, decompressor, stage,
+                                grant_filter)
+            else:
+                process_single_pass(input_file, output_file, output_format, args.temp_dir, args.workers,
+                                    chunk_size, decompressor, run, grant_filter)
+        except FileNotFoundError:
+            print(f"Error: Input file not found at {input_file}", file=sys.stderr)
+            run.mark_failed("input file not found")
+        except gzip.BadGzipFile:
+            print(f"Error: Input file {input_file} is not a valid gzip file.", file=sys.stderr)
+            run.mark_failed("invalid gzip input")
+        except IOError as e:
+            print(f"Error writing to output file {output_file}: {e}", file=sys.stderr)
+            run.mark_failed("write error")
+        return
+
+    if output_format != 'csv':
+        print("--two-pass only writes CSV output", file=sys.stderr)
+        run.mark_failed("unsupported format for --two-pass")
+        sys.exit(1)
 
-    headers = determine_headers(input_file)
+    with run.stage('pass1_headers') as stage:
+        headers = determine_headers(input_file, stage, grant_filter)
 
     if headers is None:
         print("Could not determine headers. Exiting.")
@@ -145,8 +643,9 @@ def main():
             print(f"Error writing empty CSV file {output_file}: {e}", file=sys.stderr)
         return
 
-    process_and_write_data(input_file, output_file, headers)
+    with run.stage('pass2_write') as stage:
+        process_and_write_data(input_file, output_file, headers, stage, grant_filter)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run_main(main)
\ No newline at end of file
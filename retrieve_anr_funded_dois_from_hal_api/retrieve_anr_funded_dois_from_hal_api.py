@@ -1,20 +1,43 @@
 import os
+import re
+import io
 import csv
 import sys
+import gzip
 import json
 import time
+import hashlib
 import signal
 import logging
 import argparse
 import requests
+from urllib.parse import quote_plus
+from threading import Lock, get_ident
+from datetime import datetime, timezone
+from collections import deque, Counter
+from itertools import chain, islice
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException, HTTPError, ConnectionError, Timeout
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils', 'instrumentation'))
+from instrumentation import add_instrumentation_arguments, start_run, run_main
+
 logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
 logger = logging.getLogger(__name__)
 shutdown_requested = False
+response_cache = None
+HAL_SEARCH_URL = "http://api.archives-ouvertes.fr/search/"
+HAL_FIELDS = 'doiId_s,title_s,halId_s,submittedDate_s,anrProjectReference_s'
+# docid is HAL's unique key, which cursorMark paging needs as a tie-breaker.
+HAL_SORT = 'docid asc'
+# HAL caps rows per response; longer URLs are rejected by some proxies.
+MAX_ROWS = 10000
+MAX_QUERY_LENGTH = 4000
+EXPORT_QUERY = 'anrProjectReference_s:*'
 
 
 def signal_handler(sig, frame):
@@ -30,17 +53,51 @@ def setup_argument_parser():
     parser.add_argument('-i', '--input', required=True,
                         help='Input CSV file with ANR project codes')
     parser.add_argument('-o', '--output', default='anr_dois.csv',
-                        help='Output CSV file (default: anr_dois.csv)')
+                        help='Output file; a .gz name writes gzip-compressed CSV and .parquet writes Parquet '
+                             '(default: anr_dois.csv)')
     parser.add_argument('-c', '--code-column', default='Code Projet ANR',
                         help='Column name that contains ANR project codes (default: "Code Projet ANR")')
     parser.add_argument('--delay', type=float, default=0.5,
-                        help='Delay between API requests in seconds (default: 0.5)')
-    parser.add_argument('--max-results', type=int, default=1000,
-                        help='Maximum number of results to retrieve per project (default: 1000)')
+                        help='Minimum delay between the starts of API requests in seconds, shared by all '
+                             'workers (default: 0.5)')
+    parser.add_argument('-w', '--workers', type=int, default=4,
+                        help='Number of concurrent HAL queries (default: 4)')
+    parser.add_argument('-b', '--batch-size', type=int, default=50,
+                        help='Maximum number of ANR codes per OR query; batches are shortened to keep URLs short '
+                             'and split when their matches exceed one response (default: 50)')
+    parser.add_argument('--export', action='store_true',
+                        help='Page through every HAL document with an ANR project reference and match the '
+                             'references against the input codes locally, instead of querying code by code')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only fetch documents added or modified in HAL since the last completed run and merge '
+                             'them into the existing output')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue an interrupted run from the checkpoint next to the output file instead of '
+                             'starting over')
+    parser.add_argument('--cache-dir',
+                        help='Directory for an on-disk cache of HAL responses (default: no cache)')
+    parser.add_argument('--cache-ttl', type=float, default=86400,
+                        help='Seconds a newly cached response stays fresh (default: 86400)')
+    parser.add_argument('--max-age', type=float,
+                        help='Only use cached responses at most this many seconds old, overriding the TTL '
+                             'they were stored with')
+    parser.add_argument('--cache-size-mb', type=float, default=1024,
+                        help='Size cap of the cache; least recently used entries are evicted beyond it '
+                             '(default: 1024)')
+    parser.add_argument('--keep-duplicates', action='store_true',
+                        help='Write every (anr_code, doi) row, including repeats; by default repeats are skipped')
+    parser.add_argument('--flush-interval', type=float, default=5.0,
+                        help='Seconds between flushes of buffered output rows and the checkpoint (default: 5)')
+    parser.add_argument('--max-results', type=int,
+                        help='Maximum number of results to retrieve per project (default: no limit)')
+    parser.add_argument('--page-size', type=int, default=1000,
+                        help=f'Documents per HAL response; larger result sets are paged with cursorMark '
+                             f'(default: 1000, maximum: {MAX_ROWS})')
     parser.add_argument('--max-retries', type=int, default=2,
                         help='Maximum number of retries for failed API requests (default: 2)')
     parser.add_argument('-v', '--verbose', action='store_true',
                         help='Enable verbose output')
+    add_instrumentation_arguments(parser)
     return parser
 
 
@@ -67,34 +124,231 @@ def read_anr_codes_from_csv(filepath, code_column):
         return []
 
 
-def query_hal_api(anr_code, max_results=1000, max_retries=2):
-    query = f'anrProjectReference_s:"{anr_code}"'
-    base_url = "http://api.archives-ouvertes.fr/search/"
-    params = {
-        'q': query,
-        'fl': 'doiId_s,title_s,halId_s,submittedDate_s',
-        'rows': max_results,
-        'wt': 'json'
-    }
+class QueryCancelled(Exception):
+    pass
+
+
+class QueryFailed(Exception):
+    pass
+
+
+class RateLimiter:
+    """Spaces request starts at least `interval` seconds apart across all
+    worker threads."""
+
+    def __init__(self, interval, run=None):
+        self.interval = interval
+        self.run = run
+        self.next_time = 0.0
+        self.lock = Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            if self.run:
+                with self.run.stage('rate_limit_wait'):
+                    time.sleep(start - now)
+            else:
+                time.sleep(start - now)
+
+
+class ResponseCache:
+    """On-disk cache keyed by the normalized request: HAL responses, or the
+    documents of one ANR code (see code_cache_params).
+
+    Each entry is a gzipped JSON file holding the response, when it was
+    fetched and how long it stays fresh. `max_age` overrides the stored TTL
+    when reading. A hit touches the file's modification time, so once the
+    cache grows past `max_bytes` removing the oldest files first evicts the
+    least recently used entries.
+    """
+
+    def __init__(self, cache_dir, ttl=86400, max_bytes=1024 * 1024 * 1024, max_age=None, run=None):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.run = run
+        self.lock = Lock()
+        self.sizes = {name: os.path.getsize(os.path.join(cache_dir, name))
+                      for name in os.listdir(cache_dir) if name.endswith('.json.gz')}
+        self.total_bytes = sum(self.sizes.values())
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def cache_key(params):
+        normalized = {}
+        for name, value in params.items():
+            if name == 'wt':
+                continue
+            if name == 'fl':
+                value = ','.join(sorted(field.strip() for field in value.split(',') if field.strip()))
+            elif name == 'q':
+                value = ' '.join(str(value).split())
+            normalized[name] = value
+        payload = json.dumps([HAL_SEARCH_URL, normalized], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def count(self, stage, size=0):
+        if self.run:
+            self.run.count(stage, rows=1, bytes=size)
+
+    def get(self, params):
+        path = os.path.join(self.cache_dir, f"{self.cache_key(params)}.json.gz")
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as file:
+                entry = json.load(file)
+            max_age = self.max_age if self.max_age is not None else entry['ttl']
+            if time.time() - entry['fetched_at'] > max_age:
+                raise ValueError('stale entry')
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            with self.lock:
+                self.misses += 1
+            self.count('cache_miss')
+            return None
+        with self.lock:
+            self.hits += 1
+        self.count('cache_hit', self.sizes.get(os.path.basename(path), 0))
+        return entry['response']
+
+    def put(self, params, response):
+        name = f"{self.cache_key(params)}.json.gz"
+        path = os.path.join(self.cache_dir, name)
+        temp_path = f"{path}.{get_ident()}.tmp"
+        try:
+            with gzip.open(temp_path, 'wt', encoding='utf-8') as file:
+                json.dump({'fetched_at': time.time(), 'ttl': self.ttl, 'params': params, 'response': response}, file)
+            size = os.path.getsize(temp_path)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write HAL cache entry {path}: {e}")
+            return
+        with self.lock:
+            self.total_bytes += size - self.sizes.get(name, 0)
+            self.sizes[name] = size
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache is back under
+        90% of its cap. Called with the lock held."""
+        entries = []
+        for name in self.sizes:
+            try:
+                entries.append((os.path.getmtime(os.path.join(self.cache_dir, name)), name))
+            except OSError:
+                entries.append((0, name))
+        entries.sort()
+        removed = 0
+        for _, name in entries:
+            if self.total_bytes <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+            self.total_bytes -= self.sizes.pop(name)
+            removed += 1
+        logger.debug(f"Evicted {removed} HAL cache entries")
+
+
+def create_session(workers):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def quote_code(anr_code):
+    return '"' + anr_code.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def build_query(anr_codes):
+    if len(anr_codes) == 1:
+        return f'anrProjectReference_s:{quote_code(anr_codes[0])}'
+    return 'anrProjectReference_s:(' + ' OR '.join(quote_code(code) for code in anr_codes) + ')'
+
+
+class BatchSizer:
+    """Batch size shared by the workers: halved whenever a batch has more
+    matches than one response holds, grown back gradually after batches
+    that fit."""
+
+    def __init__(self, maximum):
+        self.maximum = maximum
+        self.size = maximum
+        self.lock = Lock()
+
+    def shrink(self, batch_length):
+        with self.lock:
+            self.size = max(1, min(self.size, batch_length // 2))
+
+    def grow(self):
+        with self.lock:
+            self.size = min(self.maximum, self.size + max(1, self.size // 4))
+
 
+def make_batches(anr_codes, batch_sizer, max_query_length=MAX_QUERY_LENGTH):
+    """Cut the input codes into consecutive batches of at most
+    `batch_sizer.size` codes whose URL-encoded OR query stays under
+    `max_query_length`."""
+    batch = []
+    length = len(quote_plus('anrProjectReference_s:()'))
+    for code in anr_codes:
+        code_length = len(quote_plus(quote_code(code))) + len(quote_plus(' OR '))
+        if batch and (len(batch) >= batch_sizer.size or length + code_length > max_query_length):
+            yield batch
+            batch = []
+            length = len(quote_plus('anrProjectReference_s:()'))
+        batch.append(code)
+        length += code_length
+    if batch:
+        yield batch
+
+
+def describe_codes(anr_codes):
+    if len(anr_codes) == 1:
+        return f"ANR code {anr_codes[0]}"
+    return f"{len(anr_codes)} ANR codes ({anr_codes[0]} to {anr_codes[-1]})"
+
+
+def request_hal(params, label, max_retries=2, session=None, rate_limiter=None, use_cache=True):
+    """Send one HAL search request with retries. Return the decoded response,
+    an empty dict if the request failed, or None if it was cancelled by a
+    shutdown request. With `use_cache` the response cache is read and
+    written for this request."""
     retry_count = 0
     base_delay = 1.0
+    use_cache = use_cache and response_cache is not None
+
+    if use_cache and not shutdown_requested:
+        data = response_cache.get(params)
+        if data is not None:
+            logger.debug(f"Serving {label} from the HAL cache")
+            return data
 
     while retry_count <= max_retries:
         if shutdown_requested:
-            logger.warning(f"Query cancelled for ANR code {anr_code} due to shutdown request")
-            return []
+            logger.warning(f"Query cancelled for {label} due to shutdown request")
+            return None
 
         try:
-            logger.debug(f"Querying HAL API for ANR code {anr_code} (attempt {retry_count + 1})")
-            response = requests.get(base_url, params=params, timeout=30)
+            if rate_limiter:
+                rate_limiter.wait()
+            logger.debug(f"Querying HAL API for {label} (attempt {retry_count + 1})")
+            response = (session or requests).get(HAL_SEARCH_URL, params=params, timeout=30)
             response.raise_for_status()
-
             data = response.json()
-            num_found = data.get('response', {}).get('numFound', 0)
-            documents = data.get('response', {}).get('docs', [])
-            logger.debug(f"Found {num_found} documents for ANR code {anr_code}")
-            return documents
+            if use_cache:
+                response_cache.put(params, data)
+            return data
 
         except HTTPError as e:
             status_code = e.response.status_code
@@ -102,147 +356,830 @@ def query_hal_api(anr_code, max_results=1000, max_retries=2):
                 retry_count += 1
                 if retry_count <= max_retries:
                     delay = base_delay * (2 ** (retry_count - 1))
-                    logger.warning(f"Rate limit or server error for ANR code {anr_code}: {status_code}. Retrying in {delay}s...")
+                    logger.warning(f"Rate limit or server error for {label}: {status_code}. Retrying in {delay}s...")
                     time.sleep(delay)
                 else:
-                    logger.error(f"Maximum retries reached for ANR code {anr_code}: {status_code}")
-                    return []
+                    logger.error(f"Maximum retries reached for {label}: {status_code}")
+                    return {}
             else:
-                logger.error(f"HTTP Error for ANR code {anr_code}: {status_code}")
-                return []
+                logger.error(f"HTTP Error for {label}: {status_code}")
+                return {}
 
         except (ConnectionError, Timeout) as e:
             retry_count += 1
             if retry_count <= max_retries:
                 delay = base_delay * (2 ** (retry_count - 1))
-                logger.warning(f"Connection Error for ANR code {anr_code}: {e}. Retrying in {delay}s...")
+                logger.warning(f"Connection Error for {label}: {e}. Retrying in {delay}s...")
                 time.sleep(delay)
             else:
-                logger.error(f"Maximum retries reached for ANR code {anr_code}: {e}")
-                return []
+                logger.error(f"Maximum retries reached for {label}: {e}")
+                return {}
 
         except RequestException as e:
-            logger.error(f"Request Error for ANR code {anr_code}: {e}")
-            return []
+            logger.error(f"Request Error for {label}: {e}")
+            return {}
 
         except Exception as e:
-            logger.error(f"Error querying HAL API for ANR code {anr_code}: {e}")
-            return []
+            logger.error(f"Error querying HAL API for {label}: {e}")
+            return {}
+
+    return {}
+
+
+def iter_hal_pages(params, label, max_retries=2, session=None, rate_limiter=None, cursor='*', use_cache=True):
+    """Page through a HAL query with cursorMark from `cursor`, yielding each
+    decoded response. Stops when the cursor stops moving. Raises QueryFailed
+    when a request fails, so a failure is never mistaken for the last page,
+    and QueryCancelled on a shutdown request."""
+    page = 1
+    while True:
+        page_label = label if page == 1 else f"{label}, page {page}"
+        data = request_hal(dict(params, cursorMark=cursor), page_label, max_retries, session, rate_limiter,
+                           use_cache)
+        if data is None:
+            raise QueryCancelled(label)
+        if not data:
+            raise QueryFailed(page_label)
+        yield data
+        next_cursor = data.get('nextCursorMark')
+        if not next_cursor or next_cursor == cursor or not data.get('response', {}).get('docs'):
+            return
+        cursor = next_cursor
+        page += 1
+
+
+def document_references(doc):
+    references = doc.get('anrProjectReference_s', [])
+    return [references] if isinstance(references, str) else list(dict.fromkeys(references))
+
+
+def attribute_documents(anr_codes, documents, max_results):
+    """Assign each returned document to every input code it references,
+    keeping HAL's order and at most `max_results` documents per code."""
+    by_code = {code: [] for code in anr_codes}
+    for doc in documents:
+        for code in document_references(doc):
+            code_documents = by_code.get(code)
+            if code_documents is not None and (max_results is None or len(code_documents) < max_results):
+                code_documents.append(doc)
+    return by_code
+
+
+def code_cache_params(anr_code, max_results=None, filters=None):
+    """Cache key of one code's documents. Batch boundaries change from run to
+    run as the batch size adapts, so batched queries are cached per code
+    rather than per request."""
+    return {'anr_code': anr_code, 'fl': HAL_FIELDS, 'sort': HAL_SORT, 'fq': filters, 'max_results': max_results}
 
-    return []
 
+def cached_code_documents(anr_code, max_results=None, filters=None):
+    """Return the cached documents of a code, or None on a miss."""
+    if not response_cache or shutdown_requested:
+        return None
+    return response_cache.get(code_cache_params(anr_code, max_results, filters))
 
-def initialize_output_file(output_filepath):
-    fieldnames = ['anr_code', 'doi', 'title', 'hal_id', 'submitted_date']
+
+def cache_code_documents(anr_code, documents, max_results=None, filters=None):
+    """Pass the documents of a paged code through and cache them once the
+    caller has read them all."""
+    collected = []
+    for doc in documents:
+        collected.append(doc)
+        yield doc
+    response_cache.put(code_cache_params(anr_code, max_results, filters), collected)
+
+
+def query_hal_api(anr_codes, max_results=None, max_retries=2, session=None, rate_limiter=None, batch_sizer=None,
+                  page_size=1000, filters=None):
+    """Query HAL for a batch of ANR codes with one OR query and return
+    {code: documents}. A batch with more matches than one page is split in
+    half and each half queried again, so a batch never holds more than one
+    page. A single code keeps paging with cursorMark instead: its documents
+    come back as an iterator that fetches the remaining pages while the
+    caller consumes it, and raises QueryFailed if one of them fails. Codes
+    whose query failed map to None. The documents of every code are stored
+    in the response cache, if any, once complete. Raises QueryCancelled on
+    a shutdown request."""
+    anr_codes = list(dict.fromkeys(anr_codes))
+    label = describe_codes(anr_codes)
+    params = {
+        'q': build_query(anr_codes),
+        'fl': HAL_FIELDS,
+        'rows': page_size,
+        'sort': HAL_SORT,
+        'wt': 'json'
+    }
+    if filters:
+        params['fq'] = filters
+    pages = iter_hal_pages(params, label, max_retries, session, rate_limiter, use_cache=False)
     try:
-        with open(output_filepath, 'w', encoding='utf-8') as file:
-            writer = csv.DictWriter(file, fieldnames=fieldnames)
+        data = next(pages)
+    except QueryFailed:
+        return {code: None for code in anr_codes}
+
+    num_found = data.get('response', {}).get('numFound', 0)
+    documents = data.get('response', {}).get('docs', [])
+    logger.debug(f"Found {num_found} documents for {label}")
+    if num_found > len(documents):
+        if len(anr_codes) > 1:
+            half = len(anr_codes) // 2
+            logger.debug(f"{num_found} documents exceed one page of {page_size}; splitting {label}")
+            if batch_sizer:
+                batch_sizer.shrink(len(anr_codes))
+            by_code = {}
+            for part in (anr_codes[:half], anr_codes[half:]):
+                by_code.update(query_hal_api(part, max_results, max_retries, session, rate_limiter, batch_sizer,
+                                             page_size, filters))
+            return by_code
+        documents = chain(documents, (doc for page in pages for doc in page.get('response', {}).get('docs', [])))
+        documents = islice(documents, max_results)
+        if response_cache:
+            documents = cache_code_documents(anr_codes[0], documents, max_results, filters)
+        return {anr_codes[0]: documents}
+    if batch_sizer:
+        batch_sizer.grow()
+    by_code = attribute_documents(anr_codes, documents, max_results)
+    if response_cache:
+        for anr_code, code_documents in by_code.items():
+            response_cache.put(code_cache_params(anr_code, max_results, filters), code_documents)
+    return by_code
+
+
+OUTPUT_FIELDS = ['anr_code', 'doi', 'title', 'hal_id', 'submitted_date']
+
+
+def output_format(output_filepath):
+    lower = output_filepath.lower()
+    if lower.endswith('.parquet'):
+        return 'parquet'
+    if lower.endswith('.gz'):
+        return 'gzip'
+    return 'csv'
+
+
+def split_output_path(output_filepath):
+    """Split a path into its root and its full extension, keeping compound
+    extensions such as .csv.gz together."""
+    root, extension = os.path.splitext(output_filepath)
+    if extension.lower() == '.gz':
+        root, inner = os.path.splitext(root)
+        extension = inner + extension
+    return root, extension
+
+
+def iter_output_rows(output_filepath):
+    if output_format(output_filepath) == 'gzip':
+        file = gzip.open(output_filepath, 'rt', encoding='utf-8', newline='')
+    else:
+        file = open(output_filepath, 'r', encoding='utf-8', newline='')
+    with file:
+        yield from csv.DictReader(file)
+
+
+def result_key(row):
+    return row['anr_code'], row['doi'].strip().lower()
+
+
+class Checkpoint:
+    """Append-only record of finished work next to the output file: one key
+    per line (an ANR code, or a cursorMark in export mode) with the size of
+    the output once that key's rows were flushed. Resuming truncates the
+    output back to the last recorded size, which drops the partial rows of
+    whatever was in flight when the run stopped."""
+
+    def __init__(self, output_filepath, key_column):
+        self.output_filepath = output_filepath
+        self.path = f"{output_filepath}.checkpoint"
+        self.key_column = key_column
+        self.file = None
+        self.writer = None
+
+    def load(self):
+        """Return the recorded keys, or None if there is nothing to resume."""
+        if not os.path.exists(self.path) or not os.path.exists(self.output_filepath):
+            return None
+        with open(self.path, 'r', encoding='utf-8', newline='') as file:
+            # A line cut off by a crash has no newline and is ignored.
+            lines = file.read().split('\n')[:-1]
+        rows = list(csv.reader(lines))
+        if not rows or rows[0] != [self.key_column, 'output_bytes']:
+            raise ValueError(f"{self.path} was not written by a run in this mode")
+        entries = [row for row in rows[1:] if len(row) == 2]
+        if not entries:
+            return None
+        os.truncate(self.output_filepath, int(entries[-1][1]))
+        return [key for key, _ in entries]
+
+    def start(self, resume):
+        self.file = open(self.path, 'a' if resume else 'w', encoding='utf-8', newline='')
+        self.writer = csv.writer(self.file, lineterminator='\n')
+        if not resume:
+            self.writer.writerow([self.key_column, 'output_bytes'])
+            self.file.flush()
+
+    def commit(self, keys, output_bytes):
+        self.writer.writerows([key, output_bytes] for key in keys)
+        self.file.flush()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+
+class ResultWriter:
+    """Output file kept open for the whole run.
+
+    Rows are buffered and written every `flush_interval` seconds, whenever
+    `buffer_rows` rows are pending, and on close. The format follows the
+    extension: CSV, gzip-compressed CSV (.gz, one gzip member per write, so
+    the file stays valid when truncated at a checkpoint and appended to) or
+    Parquet (.parquet, one row group per write). Unless `dedupe` is off,
+    (anr_code, doi) pairs already written are skipped.
+
+    Callers mark the end of each checkpoint key with end_key(); the
+    checkpoint only records sizes at those boundaries. discard_key() drops
+    the rows written since the last boundary instead.
+    """
+
+    def __init__(self, output_filepath, append=False, dedupe=True, flush_interval=5.0, buffer_rows=10000,
+                 checkpoint=None):
+        self.output_filepath = output_filepath
+        self.format = output_format(output_filepath)
+        self.dedupe = dedupe
+        self.flush_interval = flush_interval
+        self.buffer_rows = buffer_rows
+        self.checkpoint = checkpoint
+        self.buffer = []
+        self.boundary = 0
+        self.pending_keys = []
+        self.key_rows = []
+        self.key_offset = None
+        self.seen = set()
+        self.code_counts = Counter()
+        self.duplicates = 0
+        self.last_flush = time.monotonic()
+        self.parquet_writer = None
+        if append:
+            for row in iter_output_rows(output_filepath):
+                self.seen.add(result_key(row))
+                self.code_counts[row['anr_code']] += 1
+        if not self.dedupe:
+            self.seen = None
+        if self.format == 'parquet':
+            self.file = None
+            return
+        self.file = open(output_filepath, 'ab' if append else 'wb')
+        if not append:
+            self.write_rows([], header=True)
+
+    def write(self, rows):
+        """Buffer rows and return how many were new."""
+        accepted = 0
+        for row in rows:
+            if self.seen is not None:
+                key = result_key(row)
+                if key in self.seen:
+                    self.duplicates += 1
+                    continue
+                self.seen.add(key)
+            self.buffer.append(row)
+            self.key_rows.append(row)
+            self.code_counts[row['anr_code']] += 1
+            accepted += 1
+        if len(self.buffer) >= self.buffer_rows:
+            self.flush()
+        return accepted
+
+    def end_key(self, key):
+        self.pending_keys.append(key)
+        self.boundary = len(self.buffer)
+        self.key_rows = []
+        self.key_offset = None
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def discard_key(self):
+        """Drop the rows written since the last end_key(), e.g. those of a
+        query that failed part way. Rows already flushed to a CSV file are
+        truncated away again; a Parquet row group cannot be taken back."""
+        del self.buffer[self.boundary:]
+        for row in self.key_rows:
+            if self.seen is not None:
+                self.seen.discard(result_key(row))
+            self.code_counts[row['anr_code']] -= 1
+        if self.key_offset is not None:
+            if self.file:
+                self.file.truncate(self.key_offset)
+                self.file.seek(self.key_offset)
+            else:
+                logger.warning(f"{len(self.key_rows)} rows of a failed query were already written to "
+                               f"{self.output_filepath}")
+        self.key_rows = []
+        self.key_offset = None
+
+    def encode_rows(self, rows, header=False):
+        text = io.StringIO()
+        writer = csv.DictWriter(text, fieldnames=OUTPUT_FIELDS)
+        if header:
             writer.writeheader()
-        logger.debug(f"Initialized output file: {output_filepath}")
-        return True
-    except Exception as e:
-        logger.error(f"Error initializing output file: {e}")
-        return False
+        writer.writerows(rows)
+        return text.getvalue().encode('utf-8')
 
+    def write_rows(self, rows, header=False):
+        if self.format == 'parquet':
+            if rows:
+                self.write_parquet(rows)
+            return
+        data = self.encode_rows(rows, header)
+        if self.format == 'gzip':
+            with gzip.GzipFile(fileobj=self.file, mode='wb') as member:
+                member.write(data)
+        else:
+            self.file.write(data)
+        self.file.flush()
+
+    def write_parquet(self, rows):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Writing Parquet output requires pyarrow: pip install pyarrow")
+        table = pa.table({field: [row.get(field, '') for row in rows] for field in OUTPUT_FIELDS},
+                         schema=pa.schema([(field, pa.string()) for field in OUTPUT_FIELDS]))
+        if self.parquet_writer is None:
+            self.parquet_writer = pq.ParquetWriter(self.output_filepath, table.schema)
+        self.parquet_writer.write_table(table)
 
-def append_results_to_csv(results, output_filepath):
-    if not results:
-        return
+    def flush(self):
+        # Rows of finished keys go out first so the checkpoint can record the
+        # size right after them; rows of a key still in flight follow.
+        if self.pending_keys:
+            self.write_rows(self.buffer[:self.boundary])
+            if self.checkpoint and self.file:
+                self.checkpoint.commit(self.pending_keys, self.file.tell())
+            self.pending_keys = []
+            del self.buffer[:self.boundary]
+        if self.buffer:
+            if self.key_offset is None:
+                self.key_offset = self.file.tell() if self.file else 0
+            self.write_rows(self.buffer)
+            self.buffer = []
+        self.boundary = 0
+        self.last_flush = time.monotonic()
 
-    fieldnames = ['anr_code', 'doi', 'title', 'hal_id', 'submitted_date']
+    def close(self):
+        self.flush()
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+        elif self.format == 'parquet':
+            # No rows at all: still leave a valid, empty file.
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            pq.write_table(pa.table({field: pa.array([], pa.string()) for field in OUTPUT_FIELDS}),
+                           self.output_filepath)
+        if self.file:
+            self.file.close()
+        if self.checkpoint:
+            self.checkpoint.close()
+
+
+def start_output(output_filepath, key_column, resume, dedupe=True, flush_interval=5.0):
+    """Open the output and its checkpoint. Return (writer, keys finished by
+    an earlier run or None), or (None, None) on error."""
+    checkpoint = Checkpoint(output_filepath, key_column)
+    completed = None
+    if resume:
+        try:
+            completed = checkpoint.load()
+        except (OSError, ValueError) as e:
+            logger.error(f"Cannot resume from {checkpoint.path}: {e}")
+            return None, None
+        if completed is None:
+            logger.info(f"Nothing to resume in {checkpoint.path}; starting from the beginning")
     try:
-        file_exists = os.path.isfile(output_filepath)
+        if output_format(output_filepath) != 'parquet':
+            checkpoint.start(completed is not None)
+        else:
+            checkpoint = None
+        writer = ResultWriter(output_filepath, append=completed is not None, dedupe=dedupe,
+                              flush_interval=flush_interval, checkpoint=checkpoint)
+    except OSError as e:
+        logger.error(f"Error initializing output file: {e}")
+        return None, None
+    logger.debug(f"Initialized output file: {output_filepath}")
+    return writer, completed
 
-        with open(output_filepath, 'a', encoding='utf-8') as file:
-            writer = csv.DictWriter(file, fieldnames=fieldnames)
-            if not file_exists:
-                writer.writeheader()
-            writer.writerows(results)
 
-        logger.debug(f"Appended {len(results)} results to {output_filepath}")
-    except Exception as e:
-        logger.error(f"Error appending results to CSV: {e}")
+def documents_to_results(anr_code, documents):
+    for doc in documents:
+        doi = doc.get('doiId_s', '')
+        if doi:
+            yield {
+                'anr_code': anr_code,
+                'doi': doi,
+                'title': doc.get('title_s', [''])[0] if isinstance(doc.get('title_s'), list) else doc.get('title_s', ''),
+                'hal_id': doc.get('halId_s', ''),
+                'submitted_date': doc.get('submittedDate_s', '')
+            }
+
 
+def write_code_results(anr_code, documents, writer, run, chunk_size):
+    """Write the results of one code in chunks, fetching further pages of a
+    paged query as they are needed."""
+    written = 0
+    results = documents_to_results(anr_code, documents)
+    while True:
+        if isinstance(documents, list):
+            chunk = list(islice(results, chunk_size))
+        else:
+            with run.stage('hal_query') as stage:
+                chunk = list(islice(results, chunk_size))
+                stage.add(rows=len(chunk))
+        if not chunk:
+            return written
+        with run.stage('write') as stage:
+            written += writer.write(chunk)
+            stage.add(rows=len(chunk))
 
-def process_anr_projects(anr_codes, output_filepath, max_results=1000, delay=0.5, max_retries=2):
+
+def process_anr_projects(anr_codes, output_filepath, run, max_results=None, delay=0.5, max_retries=2, workers=4,
+                         batch_size=50, page_size=1000, resume=False, filters=None, dedupe=True, flush_interval=5.0):
+    """Query HAL for every code and write the results in input order. Return
+    the number of DOIs found, or None on error, including when the queries
+    of some codes failed: their partial results are not written."""
     total_dois = 0
     processed_codes = 0
+    failed_codes = []
 
-    if not initialize_output_file(output_filepath):
-        return False
+    writer, completed = start_output(output_filepath, 'anr_code', resume, dedupe, flush_interval)
+    if writer is None:
+        return None
+    if completed is not None:
+        total_dois = sum(writer.code_counts.values())
+        skip = Counter(completed)
+        remaining = []
+        for anr_code in anr_codes:
+            if skip[anr_code]:
+                skip[anr_code] -= 1
+            else:
+                remaining.append(anr_code)
+        processed_codes = len(anr_codes) - len(remaining)
+        logger.info(f"Resuming: {processed_codes} ANR codes already done, {len(remaining)} left")
+        anr_codes, all_codes = remaining, anr_codes
+    else:
+        all_codes = anr_codes
 
-    for i, anr_code in enumerate(anr_codes):
-        if shutdown_requested:
-            logger.warning(f"Processing stopped after {processed_codes}/{len(anr_codes)} ANR codes due to shutdown request")
-            break
+    session = create_session(workers)
+    rate_limiter = RateLimiter(delay, run)
+    batch_sizer = BatchSizer(batch_size)
 
-        logger.info(f"Processing ANR code {i+1}/{len(anr_codes)}: {anr_code}")
+    def fetch(position, batch):
+        logger.info(f"Processing ANR codes {position}-{position + len(batch) - 1}/{len(all_codes)}")
+        # Only the codes missing from the cache are sent to HAL.
+        by_code = {}
+        for anr_code in dict.fromkeys(batch):
+            documents = cached_code_documents(anr_code, max_results, filters)
+            if documents is not None:
+                by_code[anr_code] = documents
+        misses = [anr_code for anr_code in batch if anr_code not in by_code]
+        try:
+            if misses:
+                with run.stage('hal_query') as stage:
+                    by_code.update(query_hal_api(misses, max_results, max_retries, session, rate_limiter,
+                                                 batch_sizer, page_size, filters))
+                    stage.add(rows=sum(len(documents) for documents in by_code.values()
+                                       if isinstance(documents, list)))
+        except QueryCancelled:
+            return None
+        for anr_code, documents in by_code.items():
+            if documents is not None and not isinstance(documents, list) and batch.count(anr_code) > 1:
+                try:
+                    by_code[anr_code] = list(documents)
+                except QueryFailed:
+                    by_code[anr_code] = None
+        return [(anr_code, by_code[anr_code]) for anr_code in batch]
 
-        documents = query_hal_api(anr_code, max_results, max_retries)
+    # Batches are queried concurrently, but results are written strictly in
+    # input order from a bounded window of in-flight batches.
+    batches = make_batches(anr_codes, batch_sizer)
+    position = processed_codes + 1
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            while not shutdown_requested and len(pending) < workers * 2:
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                pending.append(executor.submit(fetch, position, batch))
+                position += len(batch)
+            if shutdown_requested:
+                # Queries already running finish; queued ones are dropped.
+                for future in pending:
+                    future.cancel()
+            if not pending:
+                break
 
-        batch_results = []
-        for doc in documents:
-            doi = doc.get('doiId_s', '')
-            if doi:
-                result = {
-                    'anr_code': anr_code,
-                    'doi': doi,
-                    'title': doc.get('title_s', [''])[0] if isinstance(doc.get('title_s'), list) else doc.get('title_s', ''),
-                    'hal_id': doc.get('halId_s', ''),
-                    'submitted_date': doc.get('submittedDate_s', '')
-                }
-                batch_results.append(result)
+            future = pending.popleft()
+            code_documents = None if future.cancelled() else future.result()
+            if code_documents is None:
+                break
 
-        if batch_results:
-            append_results_to_csv(batch_results, output_filepath)
-            total_dois += len(batch_results)
-            logger.info(f"Found {len(batch_results)} DOIs for ANR code {anr_code}")
+            try:
+                for anr_code, documents in code_documents:
+                    found = None
+                    if documents is not None:
+                        try:
+                            found = write_code_results(anr_code, documents, writer, run, page_size)
+                        except QueryFailed:
+                            writer.discard_key()
+                    if found is None:
+                        # Left out of the checkpoint, so --resume queries it again.
+                        failed_codes.append(anr_code)
+                        run.count('failed_codes', rows=1)
+                        continue
+                    if found:
+                        total_dois += found
+                        logger.info(f"Found {found} DOIs for ANR code {anr_code}")
+                    writer.end_key(anr_code)
+                    processed_codes += 1
+            except QueryCancelled:
+                writer.discard_key()
+                break
 
-        processed_codes += 1
+    session.close()
+    with run.stage('write'):
+        writer.close()
+    if writer.duplicates:
+        logger.info(f"Skipped {writer.duplicates} duplicate (anr_code, doi) rows")
+    if shutdown_requested:
+        logger.warning(f"Processing stopped after {processed_codes}/{len(all_codes)} ANR codes due to shutdown request")
+    logger.info(f"Found a total of {total_dois} DOIs across {processed_codes} ANR codes")
+    if failed_codes:
+        logger.error(f"HAL queries failed for {len(failed_codes)} ANR codes, which have no results in the output: "
+                     f"{', '.join(failed_codes)}")
+        if writer.checkpoint:
+            logger.error("Run again with --resume to query only the failed and remaining codes")
+        return None
+    return total_dois
 
-        if i < len(anr_codes) - 1 and not shutdown_requested:
-            time.sleep(delay)
 
-    logger.info(f"Found a total of {total_dois} DOIs across {processed_codes} ANR codes")
-    return total_dois > 0
+def state_path(output_filepath):
+    return f"{output_filepath}.state.json"
+
+
+def load_state(output_filepath):
+    try:
+        with open(state_path(output_filepath), 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable state file {state_path(output_filepath)}: {e}")
+        return {}
+
+
+def save_state(output_filepath, state):
+    temp_path = f"{state_path(output_filepath)}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(state, file, indent=2)
+    os.replace(temp_path, state_path(output_filepath))
+
+
+def incremental_path(output_filepath):
+    root, extension = split_output_path(output_filepath)
+    return f"{root}.incremental{extension or '.csv'}"
+
+
+def merge_incremental(output_filepath, changes_filepath):
+    """Merge the rows of an incremental run into the full output, keyed by
+    (anr_code, doi): changed rows replace the existing row in place, new
+    rows are appended and duplicate keys are dropped. Only the changes are
+    held in memory."""
+    changes = {result_key(row): row for row in iter_output_rows(changes_filepath)}
+    counts = Counter()
+    root, extension = split_output_path(output_filepath)
+    temp_path = f"{root}.merge.tmp{extension}"
+    merged = ResultWriter(temp_path, dedupe=True, flush_interval=float('inf'))
+    for row in iter_output_rows(output_filepath):
+        key = result_key(row)
+        if key in changes:
+            changed = changes.pop(key)
+            counts['updated' if changed != row else 'unchanged'] += 1
+            row = changed
+        counts['duplicates'] += 1 - merged.write([row])
+    counts['added'] = merged.write(changes.values())
+    merged.close()
+    os.replace(temp_path, output_filepath)
+    return counts
+
+
+def normalize_code(code):
+    """Matching key for an ANR code: upper case, with runs of whitespace,
+    underscores and dash variants turned into a single hyphen."""
+    return re.sub(r'[\s_\u2010-\u2015-]+', '-', code.strip().upper()).strip('-')
+
+
+def export_anr_projects(anr_codes, output_filepath, run, max_results=None, delay=0.5, max_retries=2, page_size=1000,
+                        resume=False, filters=None, dedupe=True, flush_interval=5.0):
+    """Stream every HAL document that has an ANR project reference and join
+    its references against the input codes with a dictionary lookup on
+    normalize_code. Results are written in HAL docid order."""
+    cursor = '*'
+
+    writer, completed = start_output(output_filepath, 'cursor_mark', resume, dedupe, flush_interval)
+    if writer is None:
+        return None
+    code_counts = writer.code_counts
+    total_dois = sum(code_counts.values())
+    if completed is not None:
+        cursor = completed[-1]
+        logger.info(f"Resuming the export after {total_dois} DOIs already written")
+
+    codes_by_key = {}
+    for anr_code in anr_codes:
+        codes_by_key.setdefault(normalize_code(anr_code), {})[anr_code] = None
+
+    session = create_session(1)
+    rate_limiter = RateLimiter(delay, run)
+    params = {
+        'q': EXPORT_QUERY,
+        'fl': HAL_FIELDS,
+        'rows': page_size,
+        'sort': HAL_SORT,
+        'wt': 'json'
+    }
+    if filters:
+        params['fq'] = filters
+    pages = iter_hal_pages(params, 'ANR-referenced HAL documents', max_retries, session, rate_limiter, cursor)
+    scanned = 0
+    try:
+        while True:
+            with run.stage('hal_query') as stage:
+                data = next(pages, None)
+                documents = data.get('response', {}).get('docs', []) if data else []
+                if not documents:
+                    break
+                stage.add(rows=len(documents))
+            scanned += len(documents)
+            logger.info(f"Scanned {scanned}/{data.get('response', {}).get('numFound', 0)} HAL documents")
+
+            with run.stage('join') as stage:
+                page_results = 0
+                for doc in documents:
+                    matched = {}
+                    for reference in document_references(doc):
+                        matched.update(codes_by_key.get(normalize_code(reference), {}))
+                    for anr_code in matched:
+                        if max_results is not None and code_counts[anr_code] >= max_results:
+                            continue
+                        page_results += writer.write(documents_to_results(anr_code, [doc]))
+                stage.add(rows=len(documents))
+            total_dois += page_results
+
+            if data.get('nextCursorMark'):
+                with run.stage('write'):
+                    writer.end_key(data['nextCursorMark'])
+    except QueryCancelled:
+        logger.warning(f"Export stopped after {scanned} HAL documents due to shutdown request")
+    except QueryFailed as e:
+        logger.error(f"Export stopped after {scanned} HAL documents: the HAL query for {e} failed")
+        total_dois = None
+
+    session.close()
+    with run.stage('write'):
+        writer.close()
+    if writer.duplicates:
+        logger.info(f"Skipped {writer.duplicates} duplicate (anr_code, doi) rows")
+    logger.info(f"Found a total of {sum(code_counts.values())} DOIs for {len(code_counts)} of "
+                f"{len(set(anr_codes))} ANR codes")
+    return total_dois
 
 
 def main():
+    global response_cache
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
 
     parser = setup_argument_parser()
     args = parser.parse_args()
+    run = start_run('retrieve_anr_funded_dois_from_hal_api', args)
 
     if args.verbose:
         logger.setLevel(logging.DEBUG)
+    for option, value in (('--workers', args.workers), ('--batch-size', args.batch_size),
+                          ('--page-size', args.page_size), ('--max-results', args.max_results)):
+        if value is not None and value < 1:
+            logger.error(f"{option} must be at least 1")
+            run.mark_failed(f"invalid {option}")
+            sys.exit(1)
+    if args.page_size > MAX_ROWS:
+        logger.error(f"--page-size must be at most {MAX_ROWS}")
+        run.mark_failed("invalid --page-size")
+        sys.exit(1)
 
     logger.info("Starting HAL ANR DOI Retriever")
+    if args.cache_dir:
+        response_cache = ResponseCache(args.cache_dir, ttl=args.cache_ttl,
+                                       max_bytes=int(args.cache_size_mb * 1024 * 1024),
+                                       max_age=args.max_age, run=run)
 
-    anr_codes = read_anr_codes_from_csv(args.input, args.code_column)
+    with run.stage('read_codes') as stage:
+        anr_codes = read_anr_codes_from_csv(args.input, args.code_column)
+        stage.add(rows=len(anr_codes), bytes=os.path.getsize(args.input) if anr_codes else 0)
 
     if not anr_codes:
         logger.error("No ANR codes found. Exiting.")
+        run.mark_failed("no ANR codes found")
         sys.exit(1)
 
-    success = process_anr_projects(
-        anr_codes,
-        args.output,
-        max_results=args.max_results,
-        delay=args.delay,
-        max_retries=args.max_retries
-    )
+    if output_format(args.output) == 'parquet':
+        if args.resume or args.incremental:
+            logger.error("--resume and --incremental need CSV or gzip CSV output")
+            run.mark_failed("unsupported output format")
+            sys.exit(1)
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            logger.error("Writing Parquet output requires pyarrow: pip install pyarrow")
+            run.mark_failed("pyarrow not installed")
+            sys.exit(1)
+
+    # The high-water mark of this run is the time it first started, so that
+    # documents modified while it ran are picked up by the next refresh.
+    state = load_state(args.output)
+    filters = None
+    output_filepath = args.output
+    if args.incremental:
+        if state.get('high_water_mark') and os.path.exists(args.output):
+            filters = [f"modifiedDate_tdate:[{state['high_water_mark']} TO NOW]"]
+            output_filepath = incremental_path(args.output)
+            logger.info(f"Fetching documents modified since {state['high_water_mark']}")
+        else:
+            logger.warning("No completed run to refresh from; running a full harvest")
+    if not (args.resume and state.get('pending_high_water_mark')):
+        state['pending_high_water_mark'] = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        save_state(args.output, state)
+
+    if args.export:
+        found = export_anr_projects(
+            anr_codes,
+            output_filepath,
+            run,
+            max_results=args.max_results,
+            delay=args.delay,
+            max_retries=args.max_retries,
+            page_size=args.page_size,
+            resume=args.resume,
+            filters=filters,
+            dedupe=not args.keep_duplicates,
+            flush_interval=args.flush_interval
+        )
+    else:
+        found = process_anr_projects(
+            anr_codes,
+            output_filepath,
+            run,
+            max_results=args.max_results,
+            delay=args.delay,
+            max_retries=args.max_retries,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            page_size=args.page_size,
+            resume=args.resume,
+            filters=filters,
+            dedupe=not args.keep_duplicates,
+            flush_interval=args.flush_interval
+        )
+    # An incremental run with nothing new is still a success.
+    success = found is not None and (found > 0 or filters is not None)
+
+    if success and not shutdown_requested:
+        if filters:
+            with run.stage('merge') as stage:
+                counts = merge_incremental(args.output, output_filepath)
+                stage.add(rows=sum(counts.values()))
+            os.remove(output_filepath)
+            os.remove(Checkpoint(output_filepath, None).path)
+            logger.info(f"Merged changes into {args.output}: {counts['added']} added, {counts['updated']} updated, "
+                        f"{counts['unchanged']} unchanged, {counts['duplicates']} duplicates dropped")
+        state['high_water_mark'] = state.pop('pending_high_water_mark')
+        save_state(args.output, state)
+
+    if response_cache:
+        logger.info(f"HAL cache: {response_cache.hits} hits, {response_cache.misses} misses")
 
     if shutdown_requested:
         logger.info("Process terminated due to shutdown request")
+        run.mark_interrupted()
         sys.exit(0)
     elif success:
         logger.info("Process completed successfully")
         sys.exit(0)
     else:
         logger.error("Process completed with errors")
+        run.mark_failed("process completed with errors")
         sys.exit(1)
 
 
 if __name__ == "__main__":
-    main()
+    run_main(main)
@@ -1,8 +1,12 @@
 import os
 import csv
+import sys
 import argparse
 from collections import defaultdict
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'instrumentation'))
+from instrumentation import add_instrumentation_arguments, start_run, run_main
+
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Deduplicate CSV entries.')
@@ -17,6 +21,7 @@ def parse_arguments():
                       help='CSV delimiter (default: comma)')
     parser.add_argument('-v', '--verbose', action='store_true', 
                       help='Enable verbose output')
+    add_instrumentation_arguments(parser)
     return parser.parse_args()
 
 
@@ -95,18 +100,27 @@ def write_csv_file(file_path, headers, rows, delimiter=',', verbose=False):
 
 def main():
     args = parse_arguments()
+    run = start_run('deduplicate_csv', args)
     try:
         output_file = args.output if args.output else f"unique_{os.path.basename(args.input_file)}"
         duplicates_file = args.duplicates if args.duplicates else f"duplicates_{os.path.basename(args.input_file)}"
         
-        headers, rows = read_csv_file(args.input_file, args.separator, args.verbose)
+        with run.stage('read') as stage:
+            headers, rows = read_csv_file(args.input_file, args.separator, args.verbose)
+            stage.add(rows=len(rows), bytes=os.path.getsize(args.input_file))
         
-        unique_rows, duplicate_rows = deduplicate_rows(headers, rows, args.keys, args.verbose)
+        with run.stage('deduplicate') as stage:
+            unique_rows, duplicate_rows = deduplicate_rows(headers, rows, args.keys, args.verbose)
+            stage.add(rows=len(rows))
         
-        write_csv_file(output_file, headers, unique_rows, args.separator, args.verbose)
+        with run.stage('write') as stage:
+            write_csv_file(output_file, headers, unique_rows, args.separator, args.verbose)
+            stage.add(rows=len(unique_rows))
         
         if duplicate_rows and args.duplicates is not None:
-            write_csv_file(duplicates_file, headers, duplicate_rows, args.separator, args.verbose)
+            with run.stage('write') as stage:
+                write_csv_file(duplicates_file, headers, duplicate_rows, args.separator, args.verbose)
+                stage.add(rows=len(duplicate_rows))
             if args.verbose:
                 print(f"Wrote {len(duplicate_rows)} duplicate rows to {duplicates_file}")
         
@@ -116,7 +130,8 @@ def main():
         return 0
     except Exception as e:
         print(f"Error: {e}")
+        run.mark_failed(str(e))
         return 1
 
 if __name__ == "__main__":
-    exit(main())
\ No newline at end of file
+    run_main(main)
\ No newline at end of file
@@ -0,0 +1,291 @@
+import os
+import csv
+import sys
+import heapq
+import argparse
+import tempfile
+from itertools import groupby, zip_longest
+from collections import Counter
+
+DEFAULT_KEYS = ('doi', 'anr_code')
+# Values of a boolean field, as create_stats_files parses them, and missing
+# values, which a boolean field may also hold.
+BOOLEAN_VALUES = frozenset(['true', 'false', 't', 'f', 'yes', 'no', 'y', 'n', '1', '0'])
+MISSING_VALUES = frozenset(['', 'null'])
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Diff two get_crossref_funding_metadata results files (CSV or Parquet) by (doi, anr_code).')
+    parser.add_argument('old', help='Results file of the previous run (.csv or .parquet)')
+    parser.add_argument('new', help='Results file of the new run (.csv or .parquet)')
+    parser.add_argument('-o', '--output-dir', default='results_diff',
+                        help='Directory for changed.csv, added.csv, removed.csv and summary.csv '
+                             '(default: results_diff)')
+    parser.add_argument('-k', '--keys',
+                        help='Comma-separated key columns (default: doi,anr_code, plus funder_id when both files '
+                             'have it)')
+    parser.add_argument('-f', '--fields',
+                        help='Comma-separated columns to compare (default: all non-key columns in both files)')
+    parser.add_argument('-c', '--chunk-size', type=int, default=500000,
+                        help='Rows sorted in memory at a time; larger files are sorted externally '
+                             'in runs of this size (default: 500000)')
+    parser.add_argument('-t', '--temp-dir',
+                        help='Directory for the external sort runs (default: system temp directory)')
+    parser.add_argument('--presorted', action='store_true',
+                        help='Inputs are already sorted by the normalized keys; skip sorting')
+    return parser.parse_args()
+
+
+def normalize_key(column, value):
+    value = (value or '').strip()
+    if column == 'anr_code':
+        return value.upper()
+    return value.lower()
+
+
+def parquet_file(file_path):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        print("Reading Parquet files requires pyarrow: pip install pyarrow")
+        sys.exit(1)
+    return pq.ParquetFile(file_path)
+
+
+def is_parquet(file_path):
+    return file_path.lower().endswith(('.parquet', '.pq'))
+
+
+def read_columns(file_path):
+    if is_parquet(file_path):
+        return list(parquet_file(file_path).schema_arrow.names)
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        return next(csv.reader(f), [])
+
+
+def iter_rows(file_path, columns):
+    """Yield each row as a list of strings in `columns` order."""
+    if is_parquet(file_path):
+        for batch in parquet_file(file_path).iter_batches(columns=columns):
+            data = batch.to_pydict()
+            for values in zip(*(data[column] for column in columns)):
+                yield ['' if value is None else str(value) for value in values]
+        return
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        indices = [header.index(column) for column in columns]
+        for row in reader:
+            yield [row[i] if i < len(row) else '' for i in indices]
+
+
+def keyed_rows(file_path, columns, keys):
+    key_indices = [columns.index(key) for key in keys]
+    for row in iter_rows(file_path, columns):
+        yield tuple(normalize_key(keys[j], row[i]) for j, i in enumerate(key_indices)), row
+
+
+def iter_run(run_path, key_count):
+    with open(run_path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.reader(f):
+            yield tuple(row[:key_count]), row[key_count:]
+
+
+def sorted_rows(file_path, columns, keys, chunk_size, temp_dir, presorted=False):
+    """Yield (key, row) in key order. Files up to `chunk_size` rows are sorted
+    in memory; larger ones are cut into sorted runs on disk that are then
+    merged, so memory stays bounded by one chunk."""
+    rows = keyed_rows(file_path, columns, keys)
+    if presorted:
+        previous = None
+        for key, row in rows:
+            if previous is not None and key < previous:
+                raise ValueError(f"{file_path} is not sorted by {', '.join(keys)} at {key}")
+            previous = key
+            yield key, row
+        return
+
+    run_paths = []
+    chunk = []
+    for item in rows:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            run_paths.append(write_run(chunk, temp_dir))
+            chunk = []
+    chunk.sort(key=lambda item: item[0])
+    if not run_paths:
+        yield from chunk
+        return
+    if chunk:
+        run_paths.append(write_run(chunk, temp_dir))
+    try:
+        yield from heapq.merge(*(iter_run(path, len(keys)) for path in run_paths),
+                               key=lambda item: item[0])
+    finally:
+        for path in run_paths:
+            os.remove(path)
+
+
+def write_run(chunk, temp_dir):
+    chunk.sort(key=lambda item: item[0])
+    fd, run_path = tempfile.mkstemp(suffix='.csv', prefix='diff_run_', dir=temp_dir)
+    with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        for key, row in chunk:
+            writer.writerow(list(key) + row)
+    return run_path
+
+
+def merge_join(old_rows, new_rows):
+    """Sort-merge join of two key-ordered streams, yielding
+    (key, old row or None, new row or None). Rows sharing a key are paired in
+    file order; unmatched extras count as removed or added."""
+    old_groups = groupby(old_rows, key=lambda item: item[0])
+    new_groups = groupby(new_rows, key=lambda item: item[0])
+    old_key, old_group = next(old_groups, (None, None))
+    new_key, new_group = next(new_groups, (None, None))
+    while old_group is not None or new_group is not None:
+        if new_group is None or (old_group is not None and old_key < new_key):
+            for _, row in old_group:
+                yield old_key, row, None
+            old_key, old_group = next(old_groups, (None, None))
+        elif old_group is None or new_key < old_key:
+            for _, row in new_group:
+                yield new_key, None, row
+            new_key, new_group = next(new_groups, (None, None))
+        else:
+            pairs = zip_longest([row for _, row in old_group], [row for _, row in new_group])
+            for old_row, new_row in pairs:
+                yield old_key, old_row, new_row
+            old_key, old_group = next(old_groups, (None, None))
+            new_key, new_group = next(new_groups, (None, None))
+
+
+class BooleanFields:
+    """Finds the compared fields that only ever hold boolean or missing
+    values in either file, and counts their value transitions."""
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.candidates = set(fields)
+        self.seen_boolean = set()
+        self.transitions = Counter()
+
+    def observe(self, row, indices):
+        for field, i in zip(self.fields, indices):
+            if field not in self.candidates:
+                continue
+            value = row[i].strip().lower()
+            if value in BOOLEAN_VALUES:
+                self.seen_boolean.add(field)
+            elif value not in MISSING_VALUES:
+                self.candidates.discard(field)
+
+    def add_transition(self, field, old_value, new_value):
+        if field in self.candidates:
+            self.transitions[(field, old_value, new_value)] += 1
+
+    def boolean_transitions(self):
+        """{(field, old value, new value): count} of the boolean fields."""
+        boolean = self.candidates & self.seen_boolean
+        return {transition: count for transition, count in self.transitions.items() if transition[0] in boolean}
+
+
+def diff_files(args):
+    old_columns = read_columns(args.old)
+    new_columns = read_columns(args.new)
+    if args.keys:
+        keys = [key.strip() for key in args.keys.split(',') if key.strip()]
+    else:
+        # Multi-funder results have one row per (doi, anr_code, funder_id).
+        keys = list(DEFAULT_KEYS)
+        if 'funder_id' in old_columns and 'funder_id' in new_columns:
+            keys.append('funder_id')
+    for file_path, columns in ((args.old, old_columns), (args.new, new_columns)):
+        missing = [key for key in keys if key not in columns]
+        if missing:
+            print(f"Key column(s) {', '.join(missing)} not found in {file_path}")
+            sys.exit(1)
+    if args.fields:
+        fields = [field.strip() for field in args.fields.split(',') if field.strip()]
+        missing = [field for field in fields if field not in old_columns or field not in new_columns]
+        if missing:
+            print(f"Field(s) {', '.join(missing)} not found in both files")
+            sys.exit(1)
+    else:
+        fields = [column for column in old_columns if column in new_columns and column not in keys]
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    old_indices = [old_columns.index(field) for field in fields]
+    new_indices = [new_columns.index(field) for field in fields]
+    counts = Counter()
+    field_changes = Counter()
+    booleans = BooleanFields(fields)
+
+    with open(os.path.join(args.output_dir, 'changed.csv'), 'w', encoding='utf-8', newline='') as f_changed, \
+            open(os.path.join(args.output_dir, 'added.csv'), 'w', encoding='utf-8', newline='') as f_added, \
+            open(os.path.join(args.output_dir, 'removed.csv'), 'w', encoding='utf-8', newline='') as f_removed:
+        changed_writer = csv.writer(f_changed)
+        changed_writer.writerow(keys + ['field', 'old_value', 'new_value'])
+        added_writer = csv.writer(f_added)
+        added_writer.writerow(new_columns)
+        removed_writer = csv.writer(f_removed)
+        removed_writer.writerow(old_columns)
+
+        old_rows = sorted_rows(args.old, old_columns, keys, args.chunk_size, args.temp_dir, args.presorted)
+        new_rows = sorted_rows(args.new, new_columns, keys, args.chunk_size, args.temp_dir, args.presorted)
+        for key, old_row, new_row in merge_join(old_rows, new_rows):
+            if old_row is not None:
+                booleans.observe(old_row, old_indices)
+            if new_row is not None:
+                booleans.observe(new_row, new_indices)
+            if new_row is None:
+                removed_writer.writerow(old_row)
+                counts['removed'] += 1
+                continue
+            if old_row is None:
+                added_writer.writerow(new_row)
+                counts['added'] += 1
+                continue
+            row_changed = False
+            for field, i, j in zip(fields, old_indices, new_indices):
+                old_value = old_row[i]
+                new_value = new_row[j]
+                if old_value == new_value:
+                    continue
+                row_changed = True
+                field_changes[field] += 1
+                booleans.add_transition(field, old_value, new_value)
+                changed_writer.writerow(list(key) + [field, old_value, new_value])
+            counts['changed' if row_changed else 'unchanged'] += 1
+
+    transitions = booleans.boolean_transitions()
+    with open(os.path.join(args.output_dir, 'summary.csv'), 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['field', 'old_value', 'new_value', 'count'])
+        for field in fields:
+            if field_changes[field]:
+                writer.writerow([field, '*', '*', field_changes[field]])
+            for (transition_field, old_value, new_value), count in sorted(transitions.items()):
+                if transition_field == field:
+                    writer.writerow([field, old_value, new_value, count])
+    return keys, counts, field_changes
+
+
+def main():
+    args = parse_arguments()
+    if args.chunk_size < 1:
+        print("--chunk-size must be at least 1")
+        sys.exit(1)
+    keys, counts, field_changes = diff_files(args)
+    print(f"Keys: {', '.join(keys)}")
+    print(f"Unchanged: {counts['unchanged']}, changed: {counts['changed']}, "
+          f"added: {counts['added']}, removed: {counts['removed']}")
+    for field, count in field_changes.most_common():
+        print(f"  {field}: {count} changed")
+    print(f"Diff written to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
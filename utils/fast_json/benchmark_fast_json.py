@@ -0,0 +1,169 @@
+import io
+import os
+import csv
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+import fast_json
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+sys.path.insert(0, os.path.join(ROOT, 'utils', 'instrumentation'))
+sys.path.insert(0, os.path.join(ROOT, 'parse_funding_from_osm_file'))
+sys.path.insert(0, os.path.join(ROOT, 'get_crossref_funding_metadata'))
+from instrumentation import RunInstrumentation
+import parse_funding_from_osm_file as osm
+import get_crossref_funding_metadata as crossref
+
+READERS = ('osm_parse', 'fetch_from_crossref', 'process_from_local_json', 'load_member_map')
+RESULT_FIELDS = ['anr_code', 'doi', 'publisher', 'member', 'funder_names', 'award_ids', 'funder_dois',
+                 'doi_asserted_by', 'has_anr_funder_doi', 'anr_code_in_awards', 'anr_name_in_funders',
+                 'created_year', 'error']
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Time the JSON readers of the repository with each installed JSON decoder.')
+    parser.add_argument('--osm-lines', type=int, default=200000,
+                        help='Synthetic OSM JSONL lines to parse (default: 200000)')
+    parser.add_argument('--crossref-files', type=int, default=2000,
+                        help='Synthetic Crossref work files to read (default: 2000)')
+    parser.add_argument('--members', type=int, default=30000,
+                        help='Members in the synthetic members file (default: 30000)')
+    parser.add_argument('--decoders', default=','.join(fast_json.available_decoders()),
+                        help='Comma-separated decoders to compare (default: all installed)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs per case; the fastest is reported (default: 3)')
+    parser.add_argument('-s', '--seed', type=int, default=42,
+                        help='Seed for the synthetic data (default: 42)')
+    args = parser.parse_args()
+    args.decoders = [d.strip() for d in args.decoders.split(',') if d.strip()]
+    missing = [d for d in args.decoders if d not in fast_json.available_decoders()]
+    if missing:
+        parser.error(f"Not installed: {', '.join(missing)}")
+    return args
+
+
+def synthetic_osm_chunk(rng, lines):
+    out = []
+    for i in range(lines):
+        grants = []
+        for _ in range(rng.randint(0, 3)):
+            grants.append({
+                'grantid': f"ANR-{rng.randint(10, 23)}-CE{rng.randint(1, 50):02d}-{rng.randint(1, 9999):04d}",
+                'agency': rng.choice(['ANR', 'ERC', 'H2020']),
+                'funder': 'Agence Nationale de la Recherche',
+                'country': 'France'
+            })
+        record = {
+            'doi': f"10.{1000 + i % 50}/osm.{i}",
+            'year': 2010 + i % 14,
+            'title': f"Publication {i} " * rng.randint(1, 6),
+            'authors': [{'full_name': f"Author {j}", 'affiliations': [f"Lab {rng.randint(1, 500)}"]}
+                        for j in range(rng.randint(1, 12))],
+            'oa_details': {str(year): {'is_oa': rng.random() < 0.6, 'oa_host_type': ['repository']}
+                           for year in range(2019, 2024)},
+            'grants': grants
+        }
+        out.append(json.dumps(record, ensure_ascii=False))
+    return ('\n'.join(out) + '\n').encode('utf-8')
+
+
+def synthetic_crossref_work(rng, doi):
+    """A Crossref /works response of realistic size; the funder checks only
+    read a few of its fields."""
+    funders = [{'name': 'Agence Nationale de la Recherche', 'DOI': '10.13039/501100001665',
+                'doi-asserted-by': 'crossref', 'award': [f"ANR-{rng.randint(10, 23)}-CE23-{rng.randint(1, 9999):04d}"]}]
+    if rng.random() < 0.3:
+        funders.append({'name': 'European Research Council', 'DOI': '10.13039/501100000781',
+                        'doi-asserted-by': 'publisher', 'award': [str(rng.randint(100000, 999999))]})
+    return {
+        'status': 'ok',
+        'message-type': 'work',
+        'message': {
+            'DOI': doi,
+            'publisher': 'Elsevier BV',
+            'member': '78',
+            'created': {'date-parts': [[rng.randint(2005, 2024), 1, 1]], 'timestamp': 1600000000000},
+            'title': [f"Synthetic work {doi}"],
+            'author': [{'given': f"Given {i}", 'family': f"Family {i}", 'sequence': 'additional',
+                        'affiliation': [{'name': f"Laboratory {rng.randint(1, 900)}, France"}]}
+                       for i in range(rng.randint(2, 20))],
+            'reference': [{'key': f"ref{i}", 'doi-asserted-by': 'publisher', 'DOI': f"10.{rng.randint(1000, 9999)}/x{i}",
+                           'unstructured': f"Author A, Author B. Some referenced title {i}. Journal {i % 40}. 2015."}
+                          for i in range(rng.randint(10, 80))],
+            'funder': funders,
+            'license': [{'URL': 'http://creativecommons.org/licenses/by/4.0/', 'content-version': 'vor'}],
+            'link': [{'URL': f"https://example.org/{doi}", 'content-type': 'text/xml'}]
+        }
+    }
+
+
+def write_inputs(work_dir, args):
+    rng = random.Random(args.seed)
+    json_dir = os.path.join(work_dir, 'crossref')
+    os.makedirs(json_dir)
+    dois = [f"10.1016/synthetic.{i}" for i in range(args.crossref_files)]
+    for doi in dois:
+        with open(os.path.join(json_dir, doi.replace('/', '_') + '.json'), 'w', encoding='utf-8') as f:
+            json.dump(synthetic_crossref_work(rng, doi), f, indent=2)
+    members_file = os.path.join(work_dir, 'members.json')
+    members = [{'id': i, 'name': f"Publisher {i}", 'prefixes': [f"10.{10000 + i}"],
+                'counts': {'total-dois': rng.randint(0, 100000), 'current-dois': rng.randint(0, 1000)},
+                'coverage': {'funders-current': rng.random(), 'references-current': rng.random()}}
+               for i in range(args.members)]
+    with open(members_file, 'w', encoding='utf-8') as f:
+        json.dump(members, f)
+    return synthetic_osm_chunk(rng, args.osm_lines), json_dir, dois, members_file
+
+
+def reader_cases(osm_chunk, json_dir, dois, members_file):
+    local_args = argparse.Namespace(json_dir=json_dir, output_dir=json_dir, log_file=os.devnull,
+                                    null_value='NULL', funders=None)
+    run = RunInstrumentation('benchmark_fast_json')
+
+    def process_all():
+        writer = csv.DictWriter(io.StringIO(), fieldnames=RESULT_FIELDS, extrasaction='ignore')
+        for doi in dois:
+            crossref.process_from_local_json({'doi': doi, 'anr_code': 'ANR-20-CE23-0001'}, local_args,
+                                             writer, writer, run)
+
+    return {
+        'osm_parse': lambda: osm.explode_chunk(osm_chunk, 1, 'csv'),
+        'fetch_from_crossref': lambda: [crossref.fetch_from_crossref(doi, {}, json_dir) for doi in dois],
+        'process_from_local_json': process_all,
+        'load_member_map': lambda: crossref.load_member_map(members_file),
+    }
+
+
+def main():
+    args = parse_arguments()
+    with tempfile.TemporaryDirectory(prefix='fast_json_benchmark_') as work_dir:
+        print("Generating synthetic inputs...")
+        cases = reader_cases(*write_inputs(work_dir, args))
+        print(f"{'reader':<25}" + ''.join(f"{decoder:>20}" for decoder in args.decoders))
+        for reader in READERS:
+            timings = []
+            for decoder in args.decoders:
+                fast_json.set_decoder(decoder)
+                runs = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    cases[reader]()
+                    runs.append(time.perf_counter() - start)
+                timings.append(min(runs))
+            baseline = timings[args.decoders.index('json')] if 'json' in args.decoders else None
+            cells = []
+            for seconds in timings:
+                cell = f"{seconds:.3f}s"
+                if baseline:
+                    cell += f" ({baseline / seconds:.1f}x)"
+                cells.append(f"{cell:>20}")
+            print(f"{reader:<25}" + ''.join(cells))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import json
+from typing import Any, List, Optional, Union
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DECODERS = ('auto', 'msgspec', 'orjson', 'json')
+
+
+def add_json_decoder_argument(parser):
+    parser.add_argument('--json-decoder', choices=DECODERS, default='auto',
+                        help='JSON decoding library; auto uses msgspec, then orjson, when installed and the '
+                             'standard library otherwise (default: auto)')
+
+
+def available_decoders():
+    return [name for name, module in (('msgspec', msgspec), ('orjson', orjson), ('json', json))
+            if module is not None]
+
+
+if msgspec is not None:
+    # Only the fields the fetcher reads from a Crossref work. Everything else
+    # in the (often large) record is skipped without being decoded; fields
+    # left at their default are omitted again when converting back to dicts.
+    from msgspec import UNSET, UnsetType
+
+    class CrossrefDate(msgspec.Struct, omit_defaults=True):
+        date_parts: Union[Optional[List[List[Optional[int]]]], UnsetType] = msgspec.field(name='date-parts',
+                                                                                         default=UNSET)
+
+    class CrossrefFunder(msgspec.Struct, omit_defaults=True):
+        name: Any = UNSET
+        DOI: Any = UNSET
+        award: Union[List[Any], UnsetType] = UNSET
+        doi_asserted_by: Any = msgspec.field(name='doi-asserted-by', default=UNSET)
+
+    class CrossrefMessage(msgspec.Struct, omit_defaults=True):
+        publisher: Any = UNSET
+        member: Any = UNSET
+        created: Union[Optional[CrossrefDate], UnsetType] = UNSET
+        funder: Union[List[CrossrefFunder], UnsetType] = UNSET
+
+    class CrossrefWork(msgspec.Struct, omit_defaults=True):
+        message: Union[Optional[CrossrefMessage], UnsetType] = UNSET
+
+    class CrossrefMember(msgspec.Struct, omit_defaults=True):
+        id: Any = UNSET
+        name: Any = UNSET
+
+    msgspec_decoder = msgspec.json.Decoder()
+    work_decoder = msgspec.json.Decoder(CrossrefWork)
+    members_decoder = msgspec.json.Decoder(List[CrossrefMember])
+
+
+class Decoder:
+    """JSON decoding through the fastest library available.
+
+    Every decoder accepts str or bytes and raises ValueError on invalid
+    input. Documents the fast libraries reject but the standard library
+    accepts (NaN, integers beyond 64 bits) are decoded with the standard
+    library, so loads() gives the same result whichever library is picked.
+    """
+
+    def __init__(self, name='auto'):
+        if name == 'auto':
+            name = available_decoders()[0]
+        elif name not in available_decoders():
+            raise ValueError(f"JSON decoder {name} is not installed: pip install {name}")
+        self.name = name
+
+    def loads(self, data):
+        if self.name == 'msgspec':
+            try:
+                return msgspec_decoder.decode(data)
+            except msgspec.MsgspecError:
+                return json.loads(data)
+        if self.name == 'orjson':
+            try:
+                return orjson.loads(data)
+            except orjson.JSONDecodeError:
+                return json.loads(data)
+        return json.loads(data)
+
+    def load(self, f):
+        return self.loads(f.read())
+
+    def loads_typed(self, data, decoder):
+        try:
+            return msgspec.to_builtins(decoder.decode(data))
+        except msgspec.MsgspecError:
+            # Not the expected shape (or not valid for msgspec): decode as is.
+            return self.loads(data)
+
+    def loads_crossref_work(self, data):
+        """Decode a Crossref /works/{doi} response. With msgspec only the
+        publisher, member, created date and funders are decoded."""
+        if self.name == 'msgspec':
+            return self.loads_typed(data, work_decoder)
+        return self.loads(data)
+
+    def loads_members(self, data):
+        """Decode a Crossref members list. With msgspec only each member's
+        id and name are decoded."""
+        if self.name == 'msgspec':
+            return self.loads_typed(data, members_decoder)
+        return self.loads(data)
+
+
+decoder = Decoder()
+
+
+def set_decoder(name):
+    """Select the module-wide decoder; returns the library used."""
+    global decoder
+    decoder = Decoder(name)
+    return decoder.name
+
+
+def loads(data):
+    return decoder.loads(data)
+
+
+def load(f):
+    return decoder.load(f)
+
+
+def loads_crossref_work(data):
+    return decoder.loads_crossref_work(data)
+
+
+def loads_members(data):
+    return decoder.loads_members(data)
@@ -6,6 +6,9 @@ import argparse
 import requests
 from urllib.parse import urlencode
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'instrumentation'))
+from instrumentation import add_instrumentation_arguments, start_run, run_main
+
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Retrieve member names and IDs from Crossref API')
@@ -31,6 +34,7 @@ def parse_arguments():
                        type=float,
                        default=1)
     
+    add_instrumentation_arguments(parser)
     return parser.parse_args()
 
 
@@ -97,21 +101,27 @@ def save_to_file(data, output_path):
 
 def main():
     args = parse_arguments()
+    run = start_run('get_all_crossref_members', args)
     print("Retrieving member count from Crossref API...")
-    total_members = get_member_count(args.email)
+    with run.stage('member_count'):
+        total_members = get_member_count(args.email)
     print(f"Found {total_members} members.")
     print("Retrieving member details...")
-    members = get_members(
-        total_members, 
-        args.rows, 
-        args.email, 
-        args.retry, 
-        args.delay
-    )
+    with run.stage('fetch_members') as stage:
+        members = get_members(
+            total_members, 
+            args.rows, 
+            args.email, 
+            args.retry, 
+            args.delay
+        )
+        stage.add(rows=len(members))
     processed_members = process_members(members)
-    save_to_file(processed_members, args.output)
+    with run.stage('write') as stage:
+        save_to_file(processed_members, args.output)
+        stage.add(rows=len(processed_members), bytes=os.path.getsize(args.output))
     print("Done!")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run_main(main)
\ No newline at end of file
@@ -0,0 +1,219 @@
+import sys
+import json
+import time
+import atexit
+import pstats
+import cProfile
+import platform
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PROFILE_TOP_FUNCTIONS = 25
+# Runs started by start_run(), for run_main() to record the exit status in.
+active_runs = []
+
+
+def add_instrumentation_arguments(parser):
+    group = parser.add_argument_group('instrumentation')
+    group.add_argument('--run-report',
+                       help='Write a JSON run report (stage timings, rows/s, bytes/s, peak memory) to this file on exit')
+    group.add_argument('--profile', action='store_true',
+                       help='Also capture a cProfile profile and tracemalloc peak; the profile is written next to '
+                            'the run report (default report: <script>_run_report.json)')
+    return group
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+class Stage:
+    """Totals of one named stage. Updates are locked so worker threads can
+    share a stage; their seconds then add up to more than the wall time."""
+    __slots__ = ('name', 'seconds', 'calls', 'rows', 'bytes', 'lock')
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.calls = 0
+        self.rows = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def add(self, rows=0, bytes=0):
+        with self.lock:
+            self.rows += rows
+            self.bytes += bytes
+
+    def add_time(self, seconds):
+        with self.lock:
+            self.seconds += seconds
+            self.calls += 1
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'seconds': round(self.seconds, 6),
+            'calls': self.calls,
+            'rows': self.rows,
+            'bytes': self.bytes,
+            'rows_per_second': round(self.rows / self.seconds, 1) if self.seconds > 0 and self.rows else None,
+            'bytes_per_second': round(self.bytes / self.seconds, 1) if self.seconds > 0 and self.bytes else None
+        }
+
+
+class RunInstrumentation:
+    """Named stage timers and throughput counters for one script run.
+
+    Stages with the same name accumulate, so a stage can be entered once per
+    item. The report is written once, on finish() or at interpreter exit.
+    """
+
+    def __init__(self, script, report_path=None, profile=False):
+        self.script = script
+        self.report_path = report_path or (f"{script}_run_report.json" if profile else None)
+        self.profile = profile
+        self.stages = {}
+        self.stages_lock = threading.Lock()
+        self.status = 'completed'
+        self.finished = False
+        self.started_at = datetime.now()
+        self.start = time.perf_counter()
+        self.profiler = None
+        if profile:
+            tracemalloc.start()
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def get_stage(self, name):
+        stage = self.stages.get(name)
+        if stage is None:
+            with self.stages_lock:
+                stage = self.stages.setdefault(name, Stage(name))
+        return stage
+
+    @contextmanager
+    def stage(self, name):
+        stage = self.get_stage(name)
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.add_time(time.perf_counter() - start)
+
+    def count(self, name, rows=0, bytes=0):
+        """Add rows/bytes to a stage without timing it, e.g. from inside a
+        loop already timed by an enclosing stage."""
+        self.get_stage(name).add(rows, bytes)
+
+    def record_exception(self, exc_type):
+        self.status = 'interrupted' if issubclass(exc_type, KeyboardInterrupt) else f"failed: {exc_type.__name__}"
+
+    def record_exit(self, status):
+        """Mark the run failed if the script exits with a non-zero status,
+        unless a more specific status was already recorded."""
+        if status not in (None, 0) and self.status == 'completed':
+            self.status = f"failed: exit status {status}"
+
+    def mark_failed(self, reason):
+        """For scripts that catch their own errors and exit normally."""
+        self.status = f"failed: {reason}"
+
+    def mark_interrupted(self):
+        """For scripts that handle SIGINT/SIGTERM themselves and stop early."""
+        self.status = 'interrupted'
+
+    def profile_summary(self, profile_path):
+        self.profiler.disable()
+        self.profiler.dump_stats(profile_path)
+        stats = pstats.Stats(self.profiler)
+        functions = []
+        for (filename, line, function), (_, calls, total, cumulative, _) in sorted(
+                stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:PROFILE_TOP_FUNCTIONS]:
+            functions.append({
+                'function': f"{filename}:{line}({function})",
+                'calls': calls,
+                'total_seconds': round(total, 6),
+                'cumulative_seconds': round(cumulative, 6)
+            })
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {
+            'profile_file': profile_path,
+            'top_functions_by_cumulative_time': functions,
+            'tracemalloc_current_mb': round(current / (1024 * 1024), 1),
+            'tracemalloc_peak_mb': round(peak / (1024 * 1024), 1)
+        }
+
+    def report(self):
+        wall = time.perf_counter() - self.start
+        report = {
+            'script': self.script,
+            'argv': sys.argv[1:],
+            'status': self.status,
+            'started_at': self.started_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'finished_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'wall_seconds': round(wall, 6),
+            'peak_rss_mb': peak_rss_mb(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'stages': [stage.to_dict() for stage in list(self.stages.values())]
+        }
+        if self.profiler is not None:
+            profile_path = self.report_path.rsplit('.json', 1)[0] + '.prof'
+            report['profile'] = self.profile_summary(profile_path)
+        return report
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        if not self.report_path:
+            return
+        try:
+            with open(self.report_path, 'w', encoding='utf-8') as f:
+                json.dump(self.report(), f, indent=2)
+            print(f"Run report written to {self.report_path}", file=sys.stderr)
+        except Exception as e:
+            print(f"Error writing run report: {e}", file=sys.stderr)
+
+
+def start_run(script, args):
+    """Start instrumenting a run configured by the --run-report/--profile
+    arguments and write its report when the interpreter exits."""
+    run = RunInstrumentation(script, getattr(args, 'run_report', None), getattr(args, 'profile', False))
+    previous_hook = sys.excepthook
+
+    def excepthook(exc_type, exc_value, traceback):
+        run.record_exception(exc_type)
+        previous_hook(exc_type, exc_value, traceback)
+
+    sys.excepthook = excepthook
+    atexit.register(run.finish)
+    active_runs.append(run)
+    return run
+
+
+def run_main(main):
+    """Call a script's main() and exit with its return value, like
+    sys.exit(main()). A non-zero exit status, returned or passed to
+    sys.exit() inside main(), marks the runs it started as failed:
+    SystemExit never reaches sys.excepthook."""
+    try:
+        status = main()
+    except SystemExit as e:
+        status = e.code
+    for run in active_runs:
+        run.record_exit(status)
+    sys.exit(status)